@@ -1,16 +1,34 @@
 # analytics_api.py
+import asyncio
 import os
-import psycopg2
 import re
 import time
 import logging
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import yaml
 import json
+from typing import AsyncIterator, Dict, List, Tuple
 
-from .nl2sql_generator import multi_agent_pipeline, query_ollama, preprocess_question, corrector_agent
+from .nl2sql_generator import (
+    multi_agent_pipeline_async, query_ollama_async, query_ollama_stream,
+    close_async_client, preprocess_question, plan_source_stats, PLAN_CACHE, PLAN_SOURCE_COUNTS, SEMANTIC_CACHE,
+)
+from .ollama_client import OLLAMA, OLLAMA_WARMUP, call_limit
 from .sql_validate import validate_sql
+from .summarizer import SUMMARY_SOURCE_COUNTS, create_fallback_response, template_summary
+from .catalog import get_catalog
+from .db_pool import get_async_pool, close_async_pool
+from .result_cache import ResultCache
+from .cost_guard import (
+    COST_GUARD_ENABLED, COST_GUARD_LIMIT, COST_GUARD_MAX_COST, decide, describe, explain_sql, inject_limit,
+    parse_explain,
+)
+from .jobs import JOB_STATEMENT_TIMEOUT_MS, JobStore
+from .rollups import ROLLUP_CHECK_INTERVAL, ROLLUPS
+from .text_index import KEYWORD_INDEXES
+from .tracing import begin as begin_trace, finish as finish_trace, register_counts, render_metrics, span
+from .pagination import RESULT_PAGE_SIZE, RESULT_MAX_ROWS, InvalidToken, build_page, check_secret, decode_token
 
 # ====== Setup ======
 app = FastAPI()
@@ -20,14 +38,6 @@ logging.basicConfig(
     datefmt="%H:%M:%S",
 )
 
-# Load schema
-with open("semantic_model.yaml", "r", encoding="utf-8") as f:
-    SCHEMA = yaml.safe_load(f)
-SCHEMA_TEXT = "\n".join([
-    f"{t['name']}({', '.join([list(c.keys())[0] for c in t['columns']])})"
-    for t in SCHEMA["tables"]
-])
-
 # DB config
 DB_CONFIG = {
     "dbname": os.getenv("DB_NAME", "postgres"),
@@ -37,26 +47,118 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT", "5432"),
 }
 
+# Connection pool config
+POOL_CONFIG = {
+    "minconn": int(os.getenv("DB_POOL_MIN", "1")),
+    "maxconn": int(os.getenv("DB_POOL_MAX", "10")),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+    "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+    "health_check_after": float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+    "statement_timeout_ms": int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000")),
+}
+
+# /ask/batch: số câu tối đa mỗi batch, số câu chạy song song, và giới hạn riêng cho
+# lời gọi LLM / kết nối DB dùng chung giữa các câu trong cùng một batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "2"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+BATCH_ITEM_TIMEOUT = float(os.getenv("BATCH_ITEM_TIMEOUT", "180"))
+
+# Result cache (invalidated via NOTIFY từ ETL)
+RESULT_CACHE = ResultCache()
+# Job nền cho truy vấn nặng (COST_GUARD_POLICY=async)
+JOBS = JobStore()
+
 class QueryPayload(BaseModel):
     question: str | None = None
     sql: str | None = None
+    # true → response có thêm `trace`: thời gian từng bước của request này
+    trace: bool = False
+
+class BatchPayload(BaseModel):
+    items: List[QueryPayload]
+    max_concurrency: int | None = None
 
 # ====== Helpers ======
-def run_sql(sql: str):
+async def run_sql_async(sql: str, offset: int = 0, page_size: int = RESULT_PAGE_SIZE,
+                        statement_timeout_ms: int | None = None):
     if not sql or not sql.strip().upper().startswith("SELECT"):
         raise ValueError("Invalid query provided. Must be a SELECT statement.")
 
     logging.info("Executing SQL: %s", sql[:160] + ("..." if len(sql) > 160 else ""))
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
+    page_size = max(1, min(page_size, RESULT_MAX_ROWS))
+    async with get_async_pool(DB_CONFIG, POOL_CONFIG).connection(statement_timeout_ms) as conn:
+        stmt = await conn.prepare(sql)
+        cols = [a.name for a in stmt.get_attributes()]
+        cur = await stmt.cursor()
+        if offset:
+            await cur.forward(offset)
+        records = await cur.fetch(page_size)
+        moved = 0
+        if len(records) == page_size and offset + page_size < RESULT_MAX_ROWS:
+            moved = await cur.forward(RESULT_MAX_ROWS - offset - page_size)
+    rows = [tuple(r) for r in records]
+    return build_page(sql, cols, rows, offset, page_size, offset + len(rows) + moved)
+
+async def run_sql_cached(sql: str) -> Tuple[dict, dict]:
+    hit = RESULT_CACHE.get(sql)
+    if hit is not None:
+        result, age = hit
+        return result, {"hit": True, "age_s": round(age, 3)}
+    result = await run_sql_async(sql)
+    RESULT_CACHE.put(sql, result)
+    return result, {"hit": False, "age_s": 0.0}
+
+async def explain_async(sql: str) -> dict:
+    async with get_async_pool(DB_CONFIG, POOL_CONFIG).connection() as conn:
+        raw = await conn.fetchval(explain_sql(sql))
+    return parse_explain(raw)
+
+async def _run_job(sql: str) -> dict:
+    result = await run_sql_async(sql, statement_timeout_ms=JOB_STATEMENT_TIMEOUT_MS)
+    RESULT_CACHE.put(sql, result)
+    return result
+
+async def cost_guard(sql: str, corrections: list) -> Tuple[str, str, dict | None]:
+    """
+    EXPLAIN trước khi chạy và áp policy của deployment. Trả về (sql, action, job):
+    action ∈ allow | limit | warn | reject | async; sql có thể đã được chèn LIMIT.
+    Truy vấn đã có trong result cache thì bỏ qua (không tốn gì để trả lời).
+    """
+    if not COST_GUARD_ENABLED or RESULT_CACHE.contains(sql):
+        return sql, "allow", None
     try:
-        cur.execute(sql)
-        rows = cur.fetchall()
-        cols = [desc[0] for desc in cur.description] if cur.description else []
-        return {"columns": cols, "rows": rows}
-    finally:
-        cur.close()
-        conn.close()
+        estimate = await explain_async(sql)
+    except Exception as e:
+        # SQL lỗi sẽ báo lỗi rõ hơn ở bước thực thi
+        logging.warning("EXPLAIN failed, skipping cost guard: %s", e)
+        return sql, "allow", None
+
+    corrections.append(f"Cost estimate: {describe(estimate)}")
+    action = decide(estimate)
+    if action == "limit":
+        limited = inject_limit(sql, COST_GUARD_LIMIT)
+        if estimate["total_cost"] > COST_GUARD_MAX_COST:
+            # LIMIT chỉ giúp khi planner dừng sớm được (không giúp với aggregate/sort toàn bảng)
+            estimate = await explain_async(limited)
+            if estimate["total_cost"] > COST_GUARD_MAX_COST:
+                corrections.append(f"Cost guard: rejected, still over {COST_GUARD_MAX_COST:.0f} with "
+                                   f"LIMIT {COST_GUARD_LIMIT} ({describe(estimate)})")
+                return sql, "reject", None
+        corrections.append(f"Cost guard: LIMIT {COST_GUARD_LIMIT} applied ({describe(estimate)})")
+        return limited, "limit", None
+    if action == "reject":
+        corrections.append(f"Cost guard: rejected, estimated cost over {COST_GUARD_MAX_COST:.0f}")
+        return sql, "reject", None
+    if action == "async":
+        job = JOBS.submit(lambda: _run_job(sql), {"sql": sql, "estimate": estimate})
+        corrections.append(f"Cost guard: routed to background job {job['job_id']}")
+        return sql, "async", job
+    if action == "warn":
+        corrections.append(f"Cost guard: estimated cost over {COST_GUARD_MAX_COST:.0f}, executing anyway")
+    return sql, action, None
 
 def extract_sql(text: str) -> str:
     if not text:
@@ -77,7 +179,8 @@ def extract_sql(text: str) -> str:
 def _format_result_for_prompt(result: dict, max_rows: int = 6) -> str:
     cols = result.get('columns', []) or []
     rows = result.get('rows', []) or []
-    n_rows = len(rows)
+    # rows chỉ là trang đầu; total_rows là tổng số dòng thật (từ cursor)
+    n_rows = result.get('total_rows', len(rows))
 
     lines = [f"columns: {', '.join(cols)}", f"rows_count: {n_rows}"]
     if n_rows > 0:
@@ -94,7 +197,7 @@ def _format_result_for_prompt(result: dict, max_rows: int = 6) -> str:
                     safe_vals.append(s.replace('\n', ' '))
             lines.append(", ".join(safe_vals))
         if n_rows > max_rows:
-            lines.append(f"... and {n_rows - max_rows} more rows")
+            lines.append(f"... and {n_rows - max_rows}{'+' if result.get('total_capped') else ''} more rows")
     return "\n".join(lines)
 
 def _extract_text_from_ollama(resp) -> str:
@@ -119,74 +222,115 @@ def _contains_raw_sql_or_data(text: str, sql: str, result_repr: str) -> bool:
         return True
     return False
 
-def create_fallback_response(question: str, columns: list, rows: list) -> str:
-    if not rows:
-        return "Không tìm thấy dữ liệu phù hợp với câu hỏi của bạn."
-    try:
-        first_row = rows[0]
-        if isinstance(first_row, (list, tuple)):
-            main_value = first_row[0]
-        elif isinstance(first_row, dict):
-            main_value = list(first_row.values())[0]
-        else:
-            main_value = first_row
-        if isinstance(main_value, (int, float)):
-            return f"Có {int(main_value)} kết quả phù hợp với câu hỏi của bạn."
-        return f"Kết quả chính: {str(main_value)}."
-    except Exception:
-        return "Kết quả có nhưng không thể diễn giải chi tiết."
-
-def summarize_with_llm(question: str, sql: str, result: dict | None, sql_success: bool):
-    if not sql_success:
-        return f"Xin lỗi, tôi không thể lấy dữ liệu cho câu hỏi '{question}'."
-    if not result or not result.get("rows"):
-        return "Không tìm thấy dữ liệu phù hợp."
-
-    safe_result = _format_result_for_prompt(result, max_rows=3)
-    prompt = f"""
+# System prompt cố định (không chứa dữ liệu của request) → Ollama giữ KV cache của prefix
+PROMPT_SUMMARIZER = """
 Bạn là một trợ lý phân tích dữ liệu.
-Người dùng hỏi: "{question}"
-
-Kết quả truy vấn tóm tắt:
-{safe_result}
-
+Hãy trả lời câu hỏi của người dùng dựa trên kết quả truy vấn tóm tắt được cung cấp.
 Hãy trả lời bằng tiếng Việt, tự nhiên, ngắn gọn (1–2 câu).
 - Không lặp lại SQL hoặc từ 'columns', 'rows'.
 - Nếu có số liệu, hãy chèn trực tiếp vào câu trả lời.
 - Không trả về JSON hoặc dict.
 """
-    try:
-        # use legacy simple prompt mode: prompt text + model
-        raw = query_ollama("mistral:7b", "summarizer", prompt, expect_json=False)
 
-        text = _extract_text_from_ollama(raw).strip()
-    except Exception as e:
-        logging.error(f"LLM error in summarizer: {e}")
-        return create_fallback_response(question, result["columns"], result["rows"])
+PROMPT_CORRECTOR = """
+Bạn là chuyên gia sửa SQL PostgreSQL.
+
+Yêu cầu:
+1. Nếu sửa được → trả về 1 câu SQL SELECT hợp lệ, kết thúc bằng dấu chấm phẩy. Không bao quanh bằng ```sql.
+2. Nếu không sửa được → trả JSON: {{ "error":"cannot_fix", "reason":"..." }}.
+
+Schema: {schema_text}
+"""
+
+def _build_summary_prompt(question: str, safe_result: str) -> str:
+    return f"""Người dùng hỏi: "{question}"
 
+Kết quả truy vấn tóm tắt:
+{safe_result}
+"""
+
+def _summary_done(text: str, source: str) -> Tuple[str, str]:
+    SUMMARY_SOURCE_COUNTS[source] += 1
+    return text, source
+
+def _summary_without_llm(question: str, result: dict | None, sql_success: bool,
+                         plan: dict | None) -> Tuple[str, str] | None:
+    """Các trường hợp không cần LLM: lỗi SQL, không có dòng nào, hoặc kết quả khớp template."""
+    if not sql_success:
+        return _summary_done(f"Xin lỗi, tôi không thể lấy dữ liệu cho câu hỏi '{question}'.", "error")
+    if not result or not result.get("rows"):
+        return _summary_done("Không tìm thấy dữ liệu phù hợp.", "empty")
+    if isinstance(plan, dict) and plan.get("sql_corrected"):
+        plan = None
+    try:
+        text = template_summary(question, plan, result)
+    except Exception as e:
+        logging.warning(f"Template summarizer failed, using LLM: {e}")
+        text = None
+    if text:
+        return _summary_done(text, "template")
+    return None
+
+def _finalize_summary(raw, question: str, sql: str, result: dict, safe_result: str) -> Tuple[str, str]:
+    text = _extract_text_from_ollama(raw).strip()
     if _contains_raw_sql_or_data(text, sql, safe_result):
-        return create_fallback_response(question, result["columns"], result["rows"])
-    return text
+        return _summary_done(create_fallback_response(question, result["columns"], result["rows"]), "fallback")
+    return _summary_done(text, "llm")
 
-def corrector_agent(sql: str, error: str,
-                    schema_text: str, question: str, plan: dict) -> str | dict:
-    prompt = f"""
-Bạn là chuyên gia sửa SQL PostgreSQL.
+async def summarize_with_llm_async(question: str, sql: str, result: dict | None, sql_success: bool,
+                                   plan: dict | None = None) -> Tuple[str, str]:
+    shortcut = _summary_without_llm(question, result, sql_success, plan)
+    if shortcut:
+        return shortcut
+
+    safe_result = _format_result_for_prompt(result, max_rows=3)
+    prompt = _build_summary_prompt(question, safe_result)
+    try:
+        raw = await query_ollama_async(OLLAMA.models["summarizer"], "summarizer", prompt, expect_json=False,
+                                       system=PROMPT_SUMMARIZER)
+    except Exception as e:
+        logging.error(f"LLM error in summarizer: {e}")
+        return _summary_done(create_fallback_response(question, result["columns"], result["rows"]), "fallback")
+    return _finalize_summary(raw, question, sql, result, safe_result)
+
+async def summarize_with_llm_stream(question: str, sql: str, result: dict | None, sql_success: bool,
+                                    plan: dict | None = None) -> AsyncIterator[Tuple[str, str, str | None]]:
+    """
+    Yield ("token", text, None) khi Ollama sinh ra, cuối cùng là ("final", câu trả lời đã kiểm tra, nguồn).
+    Câu trả lời từ template không có token nào.
+    """
+    shortcut = _summary_without_llm(question, result, sql_success, plan)
+    if shortcut:
+        yield "final", shortcut[0], shortcut[1]
+        return
 
-Câu hỏi: {question}
+    safe_result = _format_result_for_prompt(result, max_rows=3)
+    prompt = _build_summary_prompt(question, safe_result)
+    parts = []
+    try:
+        async for token in query_ollama_stream(OLLAMA.models["summarizer"], "summarizer", prompt,
+                                             system=PROMPT_SUMMARIZER):
+            parts.append(token)
+            yield "token", token, None
+    except Exception as e:
+        logging.error(f"LLM error in summarizer: {e}")
+        text, source = _summary_done(create_fallback_response(question, result["columns"], result["rows"]),
+                                     "fallback")
+        yield "final", text, source
+        return
+    text, source = _finalize_summary("".join(parts), question, sql, result, safe_result)
+    yield "final", text, source
+
+def _build_corrector_prompt(sql: str, error: str, question: str, plan: dict) -> str:
+    return f"""Câu hỏi: {question}
 Lỗi: {error}
-Schema: {schema_text}
 Plan: {json.dumps(plan, ensure_ascii=False, indent=2)}
 
 SQL hiện tại:
 {sql}
-
-Yêu cầu:
-1. Nếu sửa được → trả về 1 câu SQL SELECT hợp lệ, kết thúc bằng dấu chấm phẩy. Không bao quanh bằng ```sql.
-2. Nếu không sửa được → trả JSON: {{ "error":"cannot_fix", "reason":"..." }}.
 """
-    # use legacy simple prompt mode and expect text back
-    resp = query_ollama(prompt, model=os.getenv("SUMMARIZER_MODEL", "mistral:7b"), expect_json=False)
+
+def _parse_corrector_output(resp) -> str | dict:
     if isinstance(resp, dict):
         return resp
 
@@ -199,67 +343,429 @@ Yêu cầu:
         return txt
     return {"error": "cannot_fix", "reason": "LLM did not produce valid SQL"}
 
+async def corrector_agent_async(sql: str, error: str,
+                                schema_text: str, question: str, plan: dict) -> str | dict:
+    prompt = _build_corrector_prompt(sql, error, question, plan)
+    system = PROMPT_CORRECTOR.format(schema_text=schema_text)
+    resp = await query_ollama_async(OLLAMA.models["corrector"], "corrector", prompt, expect_json=False,
+                                    system=system)
+    return _parse_corrector_output(resp)
+
 # ====== Endpoints ======
-@app.post('/ask')
-def ask(payload: QueryPayload):
+def _refresh_index_status(catalog):
+    """Rollup nào đã build, index từ khoá nào đã có: planner chỉ dùng những gì đang tồn tại."""
+    if catalog.rollups and ROLLUPS.enabled:
+        try:
+            ROLLUPS.refresh_status(DB_CONFIG)
+        except Exception as e:
+            logging.warning("Rollup status check failed: %s", e)
+    if catalog.text_search and KEYWORD_INDEXES.enabled:
+        try:
+            KEYWORD_INDEXES.refresh_status(DB_CONFIG)
+        except Exception as e:
+            logging.warning("Keyword index status check failed: %s", e)
+
+async def _watch_indexes():
+    while True:
+        await asyncio.to_thread(_refresh_index_status, get_catalog())
+        await asyncio.sleep(ROLLUP_CHECK_INTERVAL)
+
+_INDEX_TASK: asyncio.Task | None = None
+
+@app.on_event("startup")
+async def _startup():
+    global _INDEX_TASK
+    check_secret()
+    get_catalog()
+    if ROLLUPS.enabled or KEYWORD_INDEXES.enabled:
+        _INDEX_TASK = asyncio.get_running_loop().create_task(_watch_indexes())
+    # nạp model embedding + index cache ngữ nghĩa đã lưu trên đĩa
+    await asyncio.to_thread(SEMANTIC_CACHE.load)
+    RESULT_CACHE.start_listener(DB_CONFIG)
+    # nạp sẵn các model Ollama ở nền; /ready báo 503 cho tới khi xong
+    if OLLAMA_WARMUP:
+        OLLAMA.start_warm_up()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    SEMANTIC_CACHE.save()
+    RESULT_CACHE.stop_listener()
+    JOBS.cancel_all()
+    if _INDEX_TASK is not None:
+        _INDEX_TASK.cancel()
+    await close_async_client()
+    await close_async_pool()
+
+async def _prepare_sql(payload: QueryPayload) -> Tuple[str, dict | None, list, bool]:
+    """Sinh (hoặc nhận) SQL, validate và sửa nếu cần. Trả về (sql, plan, corrections, runnable)."""
     question = payload.question or ""
-    sql = ""
-    result = None
     corrections: list = []
-    sql_success = False
 
     if payload.sql:
-        sql = extract_sql(payload.sql) or payload.sql.strip()
-        try:
-            result = run_sql(sql)
-            sql_success = True
-        except Exception as e:
-            logging.exception("Direct SQL execution failed")
-            corrections.append(str(e))
+        return extract_sql(payload.sql) or payload.sql.strip(), None, corrections, True
 
-    elif question.strip():
-        try:
-            sql, corr, plan = multi_agent_pipeline(question, schema=SCHEMA)
-            corrections.extend(corr)
-        except Exception as e:
-            logging.exception("SQL generation error")
-            corrections.append(f"SQL generation error: {str(e)}")
-            sql = ""
-            plan = {}
-
-        if sql and sql.strip().upper().startswith("SELECT"):
-            valid, errors = validate_sql(sql, SCHEMA)
-            if valid:
-                try:
-                    result = run_sql(sql)
-                    sql_success = True
-                except Exception as e:
-                    corrections.append(str(e))
-            else:
-                corrections.extend(errors)
-                try:
-                    fixed = corrector_agent(sql, "; ".join(errors), SCHEMA_TEXT, question, plan)
-                    if isinstance(fixed, dict):  # model trả JSON lỗi
-                        corrections.append(json.dumps(fixed, ensure_ascii=False))
-                    else:
-                        fixed_sql = extract_sql(fixed)
-                        if fixed_sql and fixed_sql.upper().startswith("SELECT"):
-                            sql = fixed_sql
-                            result = run_sql(sql)
-                            sql_success = True
-                        else:
-                            corrections.append("Corrector failed to produce valid SQL.")
-                except Exception as e:
-                    corrections.append(f"Corrector exception: {e}")
-
-    analysis = summarize_with_llm(question or "Câu hỏi mặc định", sql, result, sql_success)
-    return {
+    if not question.strip():
+        return "", None, corrections, False
+
+    catalog = get_catalog()
+    try:
+        sql, corr, plan = await multi_agent_pipeline_async(question, schema=catalog)
+        corrections.extend(corr)
+    except Exception as e:
+        logging.exception("SQL generation error")
+        corrections.append(f"SQL generation error: {str(e)}")
+        sql = ""
+        plan = {}
+
+    if not (sql and sql.strip().upper().startswith("SELECT")):
+        return sql, plan, corrections, False
+
+    with span("validate_sql") as sp:
+        valid, errors = validate_sql(sql, catalog)
+        sp["valid"] = valid
+    if valid:
+        return sql, plan, corrections, True
+
+    corrections.extend(errors)
+    try:
+        with span("corrector"):
+            fixed = await corrector_agent_async(sql, "; ".join(errors), catalog.prompt_text, question, plan)
+        if isinstance(fixed, dict):  # model trả JSON lỗi
+            corrections.append(json.dumps(fixed, ensure_ascii=False))
+        else:
+            fixed_sql = extract_sql(fixed)
+            if fixed_sql and fixed_sql.upper().startswith("SELECT"):
+                # SQL đã bị sửa tay → plan không còn mô tả đúng hình dạng kết quả
+                if isinstance(plan, dict):
+                    plan["sql_corrected"] = True
+                return fixed_sql, plan, corrections, True
+            corrections.append("Corrector failed to produce valid SQL.")
+    except Exception as e:
+        corrections.append(f"Corrector exception: {e}")
+    return sql, plan, corrections, False
+
+async def _execute(sql: str, corrections: list) -> Tuple[str, dict | None, bool, dict, dict | None]:
+    """Cost guard rồi thực thi. Trả về (sql đã áp policy, result, success, cache_info, job)."""
+    no_cache = {"hit": False, "age_s": 0.0}
+    try:
+        with span("cost_guard") as sp:
+            sql, action, job = await cost_guard(sql, corrections)
+            sp["action"] = action
+    except Exception as e:
+        logging.exception("Cost guard failed")
+        corrections.append(str(e))
+        return sql, None, False, no_cache, None
+    if action in ("reject", "async"):
+        return sql, None, False, no_cache, job
+    try:
+        with span("run_sql") as sp:
+            result, cache_info = await run_sql_cached(sql)
+            sp.update(rows=result.get("total_rows", len(result.get("rows") or [])), cache_hit=cache_info["hit"])
+        return sql, result, True, cache_info, None
+    except Exception as e:
+        logging.exception("SQL execution failed")
+        corrections.append(str(e))
+        return sql, None, False, no_cache, None
+
+def _guard_summary(corrections: list, job: dict | None) -> Tuple[str, str] | None:
+    """Câu trả lời khi cost guard không cho chạy trực tiếp."""
+    if job is not None:
+        return _summary_done("Truy vấn này ước tính khá nặng nên đã được chuyển sang chạy nền. "
+                             f"Xem kết quả tại /jobs/{job['job_id']}.", "job")
+    if any(str(c).startswith("Cost guard: rejected") for c in corrections):
+        return _summary_done("Xin lỗi, truy vấn cho câu hỏi này ước tính quá nặng nên không được thực thi. "
+                             "Hãy thu hẹp phạm vi (thời gian, nguồn, chủ đề) và thử lại.", "error")
+    return None
+
+def _outcome(sql: str, plan: dict | None, runnable: bool, sql_success: bool, job: dict | None) -> str:
+    """Nhãn outcome cho metrics: ok | corrected | plan_error | sql_error."""
+    if sql_success or job is not None:
+        return "corrected" if isinstance(plan, dict) and plan.get("sql_corrected") else "ok"
+    if not runnable and not (sql or "").strip().upper().startswith("SELECT"):
+        return "plan_error"
+    return "sql_error"
+
+def _rollup_used(sql: str, plan: dict | None) -> str | None:
+    """Rollup đã trả lời câu hỏi (None nếu dùng star join hoặc SQL đã bị sửa sang bảng khác)."""
+    name = plan.get("rollup") if isinstance(plan, dict) else None
+    return name if name and name.lower() in (sql or "").lower() else None
+
+def _plan_source(payload: QueryPayload, plan: dict | None) -> str | None:
+    if payload.sql:
+        return "direct_sql"
+    if isinstance(plan, dict):
+        return plan.get("plan_source", "llm")
+    return "llm" if (payload.question or "").strip() else None
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _answer(payload: QueryPayload, timings: Dict[str, float] | None = None,
+                  db_slots: asyncio.Semaphore | None = None) -> dict:
+    """
+    Toàn bộ pipeline cho một câu hỏi/SQL. `timings` (nếu có) nhận thời gian từng bước (ms);
+    `db_slots` giới hạn số câu cùng thực thi trên DB (dùng trong /ask/batch).
+    """
+    timings = timings if timings is not None else {}
+    question = payload.question or ""
+    result = None
+    sql_success = False
+    cache_info = {"hit": False, "age_s": 0.0}
+    job = None
+
+    trace = begin_trace()
+    t0 = time.perf_counter()
+    sql, plan, corrections, runnable = await _prepare_sql(payload)
+    t1 = time.perf_counter()
+    timings["prepare_ms"] = round((t1 - t0) * 1000, 1)
+    if runnable:
+        if db_slots is None:
+            sql, result, sql_success, cache_info, job = await _execute(sql, corrections)
+        else:
+            async with db_slots:
+                sql, result, sql_success, cache_info, job = await _execute(sql, corrections)
+    t2 = time.perf_counter()
+    timings["execute_ms"] = round((t2 - t1) * 1000, 1)
+
+    with span("summarizer") as sp:
+        guarded = _guard_summary(corrections, job)
+        if guarded:
+            analysis, summary_source = guarded
+        else:
+            analysis, summary_source = await summarize_with_llm_async(question or "Câu hỏi mặc định", sql, result,
+                                                                      sql_success, plan)
+        sp["source"] = summary_source
+    timings["summary_ms"] = round((time.perf_counter() - t2) * 1000, 1)
+    breakdown = finish_trace(trace, _outcome(sql, plan, runnable, sql_success, job),
+                             rows=(result or {}).get("total_rows") if sql_success else None)
+    out = {
         "sql": sql,
         "raw_result": result,
         "analysis": analysis,
         "corrections": corrections,
         "sql_success": sql_success,
+        "result_cache": cache_info,
+        "plan_source": _plan_source(payload, plan),
+        "rollup": _rollup_used(sql, plan),
+        "summary_source": summary_source,
+        "job": job,
     }
+    if payload.trace:
+        out["trace"] = breakdown
+    return out
+
+@app.post('/ask')
+async def ask(payload: QueryPayload):
+    timings: Dict[str, float] = {}
+    out = await _answer(payload, timings)
+    return {**out, "timings_ms": timings}
+
+def _batch_key(item: QueryPayload) -> Tuple[str, str]:
+    """Khóa gộp trùng: SQL bỏ khoảng trắng/dấu ';' thừa, câu hỏi đã tiền xử lý và không phân biệt hoa thường."""
+    if item.sql:
+        return "sql", " ".join(item.sql.split()).rstrip(";").rstrip()
+    return "question", " ".join(preprocess_question(item.question or "").split()).casefold()
+
+@app.post('/ask/batch')
+async def ask_batch(payload: BatchPayload):
+    """
+    Trả lời nhiều câu hỏi/SQL trong một request. Câu trùng nhau chỉ chạy một lần
+    (`duplicate_of` trỏ tới vị trí đầu tiên); các câu chạy song song trong giới hạn
+    BATCH_CONCURRENCY / BATCH_LLM_CONCURRENCY / BATCH_DB_CONCURRENCY. Kết quả theo
+    đúng thứ tự đầu vào; một câu lỗi không làm hỏng cả batch.
+    """
+    if len(payload.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {BATCH_MAX_ITEMS} items)")
+    started = time.perf_counter()
+
+    first_index: Dict[Tuple[str, str], int] = {}
+    unique: List[int] = []
+    duplicate_of: Dict[int, int] = {}
+    for i, item in enumerate(payload.items):
+        key = _batch_key(item)
+        if key in first_index:
+            duplicate_of[i] = first_index[key]
+        else:
+            first_index[key] = i
+            unique.append(i)
+
+    concurrency = BATCH_CONCURRENCY
+    if payload.max_concurrency:
+        concurrency = max(1, min(payload.max_concurrency, BATCH_CONCURRENCY))
+    item_slots = asyncio.Semaphore(concurrency)
+    db_slots = asyncio.Semaphore(max(1, BATCH_DB_CONCURRENCY))
+
+    async def run_one(i: int) -> dict:
+        timings: Dict[str, float] = {}
+        async with item_slots:
+            t0 = time.perf_counter()
+            try:
+                out = await asyncio.wait_for(_answer(payload.items[i], timings, db_slots), BATCH_ITEM_TIMEOUT)
+                out = {"ok": True, **out}
+            except asyncio.TimeoutError:
+                out = {"ok": False, "error": f"Timed out after {BATCH_ITEM_TIMEOUT:.0f}s"}
+            except Exception as e:
+                logging.exception("Batch item %d failed", i)
+                out = {"ok": False, "error": str(e)}
+            timings["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return {**out, "timings_ms": timings}
+
+    # các task tạo trong khối with dùng chung giới hạn lời gọi LLM
+    with call_limit(BATCH_LLM_CONCURRENCY):
+        outputs = await asyncio.gather(*(run_one(i) for i in unique))
+    by_index = dict(zip(unique, outputs))
+
+    items = []
+    for i in range(len(payload.items)):
+        if i in duplicate_of:
+            src = duplicate_of[i]
+            items.append({"index": i, "duplicate_of": src, **by_index[src]})
+        else:
+            items.append({"index": i, "duplicate_of": None, **by_index[i]})
+    return {
+        "items": items,
+        "stats": {
+            "total": len(items),
+            "unique": len(unique),
+            "failed": sum(1 for o in outputs if not o["ok"]),
+            "concurrency": concurrency,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        },
+    }
+
+@app.post('/ask/stream')
+async def ask_stream(payload: QueryPayload):
+    """
+    Server-Sent Events: `sql` → `result` → nhiều `summary_token` → `summary` → `done`.
+    `summary` mang câu trả lời cuối cùng (có thể là fallback nếu LLM lặp lại SQL/dữ liệu).
+    """
+    question = payload.question or "Câu hỏi mặc định"
+
+    async def events():
+        started = time.perf_counter()
+        trace = begin_trace()
+        sql, plan, corrections, runnable = await _prepare_sql(payload)
+        yield _sse("sql", {"sql": sql, "corrections": list(corrections),
+                           "plan_source": _plan_source(payload, plan), "rollup": _rollup_used(sql, plan),
+                           "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)})
+
+        result, sql_success, cache_info, job = None, False, {"hit": False, "age_s": 0.0}, None
+        if runnable:
+            sql, result, sql_success, cache_info, job = await _execute(sql, corrections)
+        yield _sse("result", {
+            "sql": sql,
+            "columns": (result or {}).get("columns", []),
+            "rows": (result or {}).get("rows", []),
+            "total_rows": (result or {}).get("total_rows", 0),
+            "next_token": (result or {}).get("next_token"),
+            "sql_success": sql_success,
+            "corrections": corrections,
+            "result_cache": cache_info,
+            "job": job,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+        with span("summarizer") as sp:
+            guarded = _guard_summary(corrections, job)
+            if guarded:
+                analysis, summary_source = guarded
+            else:
+                analysis, summary_source = "", None
+                async for kind, text, source in summarize_with_llm_stream(question, sql, result, sql_success, plan):
+                    if kind == "token":
+                        yield _sse("summary_token", {"text": text})
+                    else:
+                        analysis, summary_source = text, source
+            sp["source"] = summary_source
+        breakdown = finish_trace(trace, _outcome(sql, plan, runnable, sql_success, job),
+                                 rows=(result or {}).get("total_rows") if sql_success else None)
+        yield _sse("summary", {"analysis": analysis, "summary_source": summary_source})
+        done = {"elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+        if payload.trace:
+            done["trace"] = breakdown
+        yield _sse("done", done)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get('/results/{token}')
+async def results_page(token: str):
+    try:
+        data = decode_token(token)
+    except InvalidToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return await run_sql_async(data["sql"], offset=data["offset"], page_size=data["page_size"])
+    except Exception as e:
+        logging.exception("Result page fetch failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get('/jobs/{job_id}')
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+@app.get('/cache')
+def cache_stats():
+    return {"plan": PLAN_CACHE.stats(), "semantic": SEMANTIC_CACHE.stats(), "result": RESULT_CACHE.stats()}
+
+
+@app.get('/ready')
+async def ready():
+    status = await OLLAMA.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+register_counts("nl2sql_plan_source_total", "Plans by source.", "source", lambda: dict(PLAN_SOURCE_COUNTS))
+register_counts("nl2sql_summary_source_total", "Answers by summary source.", "source",
+                lambda: dict(SUMMARY_SOURCE_COUNTS))
+register_counts("nl2sql_rollup_served_total", "Plans answered from a rollup.", "rollup",
+                lambda: dict(ROLLUPS.counts))
+register_counts("nl2sql_keyword_predicates_total", "Keyword filters by predicate kind.", "kind",
+                lambda: dict(KEYWORD_INDEXES.counts))
+
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get('/pipeline/stats')
+def pipeline_stats():
+    total = sum(SUMMARY_SOURCE_COUNTS.values())
+    return {
+        "plan_source": plan_source_stats(),
+        "summary_source": {
+            "total": total,
+            "by_source": dict(SUMMARY_SOURCE_COUNTS),
+            "without_llm_share": round(1 - SUMMARY_SOURCE_COUNTS["llm"] / total, 4) if total else 0.0,
+        },
+    }
+
+
+@app.get('/rollups')
+async def rollups_status():
+    catalog = get_catalog()
+    await asyncio.to_thread(_refresh_index_status, catalog)
+    return ROLLUPS.stats(catalog.rollups)
+
+
+@app.get('/keyword-indexes')
+async def keyword_indexes_status():
+    catalog = get_catalog()
+    await asyncio.to_thread(_refresh_index_status, catalog)
+    return KEYWORD_INDEXES.stats(catalog)
+
+
+@app.get('/catalog')
+def catalog_info():
+    return get_catalog().stats()
+
+
+@app.get('/pool')
+def pool_stats():
+    return {"async": get_async_pool(DB_CONFIG, POOL_CONFIG).stats()}
 
 
 # def corrector_agent(sql: str, error: str, schema_text: str, question: str, plan: dict) -> Any:
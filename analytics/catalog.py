@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, FrozenSet, List, Tuple
+
+import yaml
+
+from .rollups import parse_rollups
+
+logger = logging.getLogger("analytics.catalog")
+
+# =========================
+# Config
+# =========================
+SEMANTIC_MODEL_PATH = os.getenv("SEMANTIC_MODEL_PATH", "semantic_model.yaml")
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "2"))
+
+TEXT_INDEX_KINDS = ("trigram", "fulltext")
+
+_FK_DESC_RE = re.compile(r"(dw\.[a-z_][a-z0-9_]*)\.([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+def normalize_name(s: str) -> str:
+    if not s:
+        return ""
+    return re.sub(r'[^a-z0-9]', '', s.lower())
+
+
+def _column_name(c) -> str | None:
+    if isinstance(c, dict):
+        if "name" in c:
+            return str(c["name"])
+        # kiểu cũ: - article_id: integer
+        return str(next(iter(c.keys()))) if c else None
+    return str(c) if c is not None else None
+
+
+class SchemaCatalog:
+    """
+    Schema đã biên dịch từ semantic_model.yaml, dùng chung cho mọi stage của pipeline.
+    Đối tượng bất biến sau khi dựng; reload tạo đối tượng mới rồi thay tham chiếu.
+    """
+
+    def __init__(self, raw: Dict, source: str = "", mtime: float | None = None, digest: str = ""):
+        self.raw = raw or {}
+        self.source = source
+        self.mtime = mtime
+        self.hash = digest
+
+        columns: Dict[str, FrozenSet[str]] = {}
+        normalized: Dict[str, Dict[str, str]] = {}
+        aliases: Dict[str, str] = {}
+        fk_edges: List[Tuple[str, str, str, str]] = []
+        # khóa ngoại `required: true` (NOT NULL + ràng buộc FK): INNER JOIN theo nó không loại dòng nào
+        required_fks: List[Tuple[str, str]] = []
+        # alias.cột -> (bảng, cột, loại index: trigram | fulltext) cho filter kiểu từ khoá
+        text_search: Dict[str, Tuple[str, str, str]] = {}
+        for t in self.raw.get("tables", []):
+            tname = t["name"]
+            cols = []
+            for c in t.get("columns", []):
+                cname = _column_name(c)
+                if not cname:
+                    continue
+                cols.append(cname)
+                if isinstance(c, dict) and c.get("text_index"):
+                    kind = str(c["text_index"]).lower()
+                    if kind in TEXT_INDEX_KINDS and t.get("alias"):
+                        text_search[f"{t['alias']}.{cname}".lower()] = (tname, cname, kind)
+                    else:
+                        logger.warning("Ignoring text_index '%s' on %s.%s", kind, tname, cname)
+                if isinstance(c, dict):
+                    ref = c.get("references")
+                    m = _FK_DESC_RE.search(ref or "") if ref else None
+                    if not m and "khóa ngoại" in str(c.get("description", "")).lower():
+                        m = _FK_DESC_RE.search(str(c.get("description", "")))
+                    if m:
+                        fk_edges.append((tname, cname, m.group(1), m.group(2)))
+                        if c.get("required"):
+                            required_fks.append((tname, m.group(1)))
+            columns[tname] = frozenset(cols)
+            normalized[tname] = {normalize_name(c): c for c in cols}
+            if t.get("alias"):
+                aliases[t["alias"]] = tname
+
+        self.columns = columns
+        self.tables: FrozenSet[str] = frozenset(columns)
+        self.normalized = normalized
+        self.aliases = aliases
+        self.table_alias = {v: k for k, v in aliases.items()}
+        self.fk_edges = fk_edges
+        self.text_search = text_search
+        # bản lowercase cho validator SQL
+        self.tables_lower = frozenset(t.lower() for t in self.tables)
+        self.columns_lower = {t.lower(): frozenset(c.lower() for c in cols) for t, cols in columns.items()}
+        self.all_columns_lower = frozenset(c for cols in self.columns_lower.values() for c in cols)
+        self.prompt_text = "\n".join(
+            f"{t['name']}({', '.join(_column_name(c) for c in t.get('columns', []) if _column_name(c))})"
+            for t in self.raw.get("tables", [])
+        )
+        self.join_map = self._build_join_map()
+        # alias dimension JOIN từ bảng fact mà không mất dòng: rollup có/không JOIN chúng vẫn cùng kết quả
+        self.lossless_joins: FrozenSet[str] = frozenset(
+            self.table_alias[dst] for src, dst in required_fks if src in self.table_alias and dst in self.table_alias
+        )
+        # rollup (materialized view) khai báo trong YAML; validator cần biết cột của chúng
+        self.rollups = parse_rollups(self.raw.get("rollups"), self)
+        for r in self.rollups:
+            self.columns_lower[r.name.lower()] = frozenset(c.lower() for c in r.columns)
+        if self.rollups:
+            self.tables_lower = self.tables_lower | {r.name.lower() for r in self.rollups}
+            self.all_columns_lower = frozenset(c for cols in self.columns_lower.values() for c in cols)
+
+    def _build_join_map(self) -> Dict[str, str]:
+        """alias dimension -> mệnh đề JOIN từ bảng fact (theo khóa ngoại khai báo trong YAML)."""
+        out: Dict[str, str] = {}
+        for src, src_col, dst, dst_col in self.fk_edges:
+            src_alias = self.table_alias.get(src)
+            dst_alias = self.table_alias.get(dst)
+            if not src_alias or not dst_alias:
+                continue
+            out[dst_alias] = (
+                f"INNER JOIN {dst} {dst_alias} ON {src_alias}.{src_col} = {dst_alias}.{dst_col}"
+            )
+        return out
+
+    def find_column(self, table: str, requested: str) -> str | None:
+        cols = self.columns.get(table)
+        if not cols:
+            return None
+        if requested in cols:
+            return requested
+        req_norm = normalize_name(requested)
+        exact = self.normalized[table].get(req_norm)
+        if exact:
+            return exact
+        for c in cols:
+            cn = normalize_name(c)
+            if req_norm in cn or cn in req_norm:
+                return c
+        for c in cols:
+            cn = normalize_name(c)
+            if cn.startswith(req_norm) or req_norm.startswith(cn):
+                return c
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "source": self.source,
+            "hash": self.hash,
+            "tables": len(self.tables),
+            "columns": sum(len(c) for c in self.columns.values()),
+            "fk_edges": len(self.fk_edges),
+            "rollups": len(self.rollups),
+            "text_search_columns": len(self.text_search),
+        }
+
+
+def as_catalog(schema) -> SchemaCatalog | None:
+    """Nhận SchemaCatalog hoặc dict YAML thô (tương thích ngược với các caller cũ)."""
+    if schema is None or isinstance(schema, SchemaCatalog):
+        return schema
+    return SchemaCatalog(schema)
+
+
+def load_catalog(path: str) -> SchemaCatalog:
+    with open(path, "rb") as f:
+        data = f.read()
+    raw = yaml.safe_load(data.decode("utf-8"))
+    return SchemaCatalog(raw, source=path, mtime=os.stat(path).st_mtime,
+                         digest=hashlib.sha256(data).hexdigest()[:16])
+
+
+class CatalogManager:
+    """Giữ catalog hiện hành; kiểm tra mtime (tối đa mỗi `check_interval` giây) và reload nguyên tử."""
+
+    def __init__(self, path: str = SEMANTIC_MODEL_PATH, check_interval: float = CATALOG_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._catalog: SchemaCatalog | None = None
+        self._last_check = 0.0
+        self.reloads = 0
+
+    def get(self) -> SchemaCatalog:
+        now = time.monotonic()
+        cat = self._catalog
+        if cat is not None and now - self._last_check < self.check_interval:
+            return cat
+        with self._lock:
+            self._last_check = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if self._catalog is None:
+                    raise
+                logger.warning("Cannot stat %s (%s); keeping current catalog", self.path, e)
+                return self._catalog
+            if self._catalog is None or mtime != self._catalog.mtime:
+                try:
+                    new_cat = load_catalog(self.path)
+                except Exception as e:
+                    if self._catalog is None:
+                        raise
+                    logger.error("Failed to reload %s (%s); keeping current catalog", self.path, e)
+                    return self._catalog
+                if self._catalog is not None:
+                    self.reloads += 1
+                    logger.info("Semantic model reloaded (%s -> %s)", self._catalog.hash, new_cat.hash)
+                self._catalog = new_cat
+            return self._catalog
+
+
+_MANAGER = CatalogManager()
+
+
+def get_catalog() -> SchemaCatalog:
+    return _MANAGER.get()
@@ -0,0 +1,85 @@
+import json
+import os
+import re
+from typing import Dict, List
+
+# =========================
+# Config
+# =========================
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "1") not in ("0", "false", "False", "")
+# Ngưỡng theo đơn vị cost của planner Postgres (Total Cost của node gốc)
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", "1000000"))
+# Số dòng ước tính tối đa trước khi chèn/giảm LIMIT; 0 = tắt (kết quả lớn đã được phân trang,
+# cắt bớt dòng chỉ làm sai câu trả lời và tổng số dòng)
+COST_GUARD_MAX_ROWS = int(os.getenv("COST_GUARD_MAX_ROWS", "0"))
+# Hành động khi vượt COST_GUARD_MAX_COST: reject | limit | async | warn
+COST_GUARD_POLICY = os.getenv("COST_GUARD_POLICY", "limit").strip().lower()
+# LIMIT được chèn (hoặc kẹp xuống) khi vượt ngưỡng số dòng / khi policy=limit
+COST_GUARD_LIMIT = int(os.getenv("COST_GUARD_LIMIT", "1000"))
+
+POLICIES = ("reject", "limit", "async", "warn")
+
+_LIMIT_TAIL_RE = re.compile(r"\bLIMIT\s+(\d+|ALL)(\s+OFFSET\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+
+
+def explain_sql(sql: str) -> str:
+    return f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"
+
+
+def _walk(node: Dict, out: List[Dict]):
+    out.append(node)
+    for child in node.get("Plans", []) or []:
+        _walk(child, out)
+
+
+def parse_explain(raw) -> Dict:
+    """Rút gọn output EXPLAIN (FORMAT JSON): cost, số dòng ước tính, các bảng bị Seq Scan."""
+    data = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+    if isinstance(data, list):
+        data = data[0]
+    root = data["Plan"]
+    nodes: List[Dict] = []
+    _walk(root, nodes)
+    seq_scans = sorted({
+        f"{n.get('Schema', '')}.{n['Relation Name']}".lstrip(".")
+        for n in nodes if n.get("Node Type") == "Seq Scan" and n.get("Relation Name")
+    })
+    return {
+        "total_cost": float(root.get("Total Cost", 0.0)),
+        "startup_cost": float(root.get("Startup Cost", 0.0)),
+        "plan_rows": int(root.get("Plan Rows", 0)),
+        "node_type": root.get("Node Type"),
+        "seq_scans": seq_scans,
+    }
+
+
+def inject_limit(sql: str, limit: int) -> str:
+    """Thêm LIMIT ở cuối câu, hoặc kẹp LIMIT sẵn có xuống `limit` nếu lớn hơn."""
+    body = sql.strip().rstrip(";").rstrip()
+    m = _LIMIT_TAIL_RE.search(body)
+    if m:
+        current = m.group(1)
+        if current.upper() != "ALL" and int(current) <= limit:
+            return body + ";"
+        return f"{body[:m.start()]}LIMIT {limit}{m.group(2) or ''};"
+    return f"{body}\nLIMIT {limit};"
+
+
+def describe(estimate: Dict) -> str:
+    txt = f"cost={estimate['total_cost']:.0f}, rows={estimate['plan_rows']}"
+    if estimate.get("seq_scans"):
+        txt += f", seq_scan={','.join(estimate['seq_scans'])}"
+    return txt
+
+
+def decide(estimate: Dict, policy: str = COST_GUARD_POLICY, max_cost: float = COST_GUARD_MAX_COST,
+           max_rows: int = COST_GUARD_MAX_ROWS) -> str:
+    """
+    Quyết định cho một estimate: allow | limit | reject | async | warn.
+    Vượt cost → theo policy của deployment; vượt số dòng (nếu bật max_rows) → chèn LIMIT.
+    """
+    if estimate["total_cost"] > max_cost:
+        return policy if policy in POLICIES else "reject"
+    if max_rows and estimate["plan_rows"] > max_rows:
+        return "limit"
+    return "allow"
@@ -0,0 +1,420 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List
+
+import psycopg2
+
+logger = logging.getLogger("analytics.db_pool")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _PooledConn:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Pool kết nối psycopg2 có giới hạn, dùng chung giữa các thread.
+    - maxconn: số kết nối tối đa (chặn chờ khi hết, tối đa `timeout` giây).
+    - max_idle / max_lifetime: tái tạo kết nối nhàn rỗi quá lâu hoặc quá già.
+    - health_check_after: kết nối nhàn rỗi lâu hơn ngưỡng này sẽ được `SELECT 1` trước khi trả ra.
+    - statement_timeout_ms: áp dụng bằng SET LOCAL cho mỗi lần checkout.
+    """
+
+    def __init__(self, db_config: Dict, minconn: int = 1, maxconn: int = 10,
+                 timeout: float = 10.0, max_idle: float = 300.0, max_lifetime: float = 3600.0,
+                 health_check_after: float = 30.0, statement_timeout_ms: int = 0):
+        if maxconn < 1:
+            raise ValueError("maxconn must be >= 1")
+        self.db_config = dict(db_config)
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.statement_timeout_ms = statement_timeout_ms
+
+        self._idle: List[_PooledConn] = []
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._failed_checks = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(self.minconn):
+            try:
+                self._idle.append(self._connect())
+                self._size += 1
+            except psycopg2.Error as e:
+                logger.warning("Could not pre-open pooled connection: %s", e)
+                break
+
+    # ----- internals -----
+    def _connect(self) -> _PooledConn:
+        return _PooledConn(psycopg2.connect(**self.db_config))
+
+    def _discard(self, pc: _PooledConn):
+        try:
+            pc.conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, pc: _PooledConn, now: float) -> bool:
+        if pc.conn.closed:
+            return True
+        if self.max_lifetime and now - pc.created_at > self.max_lifetime:
+            return True
+        if self.max_idle and now - pc.last_used > self.max_idle:
+            return True
+        return False
+
+    def _healthy(self, pc: _PooledConn, now: float) -> bool:
+        if not self.health_check_after or now - pc.last_used < self.health_check_after:
+            return True
+        try:
+            with pc.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            pc.conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning("Pooled connection failed health check: %s", e)
+            self._failed_checks += 1
+            return False
+
+    def _acquire(self) -> _PooledConn:
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        pc = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        pc = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout}s waiting for a DB connection "
+                            f"(max {self.maxconn} in use)"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+                waited = time.monotonic() - start
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+        # Mở/kiểm tra kết nối ngoài lock để không chặn các thread khác
+        try:
+            now = time.monotonic()
+            if pc is not None and (self._expired(pc, now) or not self._healthy(pc, now)):
+                self._discard(pc)
+                self._recycled += 1
+                pc = None
+            if pc is None:
+                pc = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checkouts += 1
+        return pc
+
+    def _release(self, pc: _PooledConn, broken: bool = False):
+        if not broken and not pc.conn.closed:
+            try:
+                # Kết thúc transaction (SET LOCAL statement_timeout hết hiệu lực theo)
+                pc.conn.rollback()
+            except Exception:
+                broken = True
+        with self._cond:
+            if broken or pc.conn.closed or self._closed:
+                self._discard(pc)
+                self._size -= 1
+            else:
+                pc.last_used = time.monotonic()
+                self._idle.append(pc)
+            self._cond.notify()
+
+    # ----- public API -----
+    @contextmanager
+    def connection(self, statement_timeout_ms: int | None = None):
+        pc = self._acquire()
+        broken = False
+        try:
+            st = self.statement_timeout_ms if statement_timeout_ms is None else statement_timeout_ms
+            if st:
+                with pc.conn.cursor() as cur:
+                    cur.execute("SET LOCAL statement_timeout = %s", (int(st),))
+            yield pc.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._release(pc, broken=broken)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "size": self._size,
+                "max_size": self.maxconn,
+                "in_use": self._size - len(self._idle),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_checks,
+                "wait_time_total_ms": round(self._wait_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for pc in self._idle:
+                self._discard(pc)
+                self._size -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+# =========================
+# Singleton per-process
+# =========================
+_POOL: ConnectionPool | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool(db_config: Dict, pool_config: Dict) -> ConnectionPool:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ConnectionPool(db_config, **pool_config)
+                logger.info("DB pool created (min=%s, max=%s)", _POOL.minconn, _POOL.maxconn)
+    return _POOL
+
+
+def close_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.close()
+            _POOL = None
+
+
+# =========================
+# Async pool (asyncpg) cho các endpoint async
+# =========================
+def _asyncpg_dsn_kwargs(db_config: Dict) -> Dict:
+    return {
+        "host": db_config.get("host"),
+        "port": int(db_config.get("port") or 5432),
+        "database": db_config.get("dbname"),
+        "user": db_config.get("user"),
+        "password": db_config.get("password"),
+    }
+
+
+class AsyncConnectionPool:
+    """
+    Bọc asyncpg.Pool với cùng cấu hình và metrics như ConnectionPool.
+    - max_idle: asyncpg tự đóng kết nối nhàn rỗi quá lâu (max_inactive_connection_lifetime).
+    - max_lifetime / health_check_after: kiểm tra lúc checkout như ConnectionPool; kết nối quá già
+      hoặc không qua được `SELECT 1` bị terminate để asyncpg mở kết nối mới.
+    """
+
+    def __init__(self, db_config: Dict, minconn: int = 1, maxconn: int = 10,
+                 timeout: float = 10.0, max_idle: float = 300.0, max_lifetime: float = 3600.0,
+                 health_check_after: float = 30.0, statement_timeout_ms: int = 0, init=None):
+        self.db_config = dict(db_config)
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.statement_timeout_ms = statement_timeout_ms
+        # coroutine chạy một lần cho mỗi kết nối mới (vd. đăng ký codec kiểu dữ liệu)
+        self.init = init
+        self._pool = None
+        self._init_lock = asyncio.Lock()
+        # backend pid → (created_at, last_used); proxy của asyncpg đổi mỗi lần acquire, pid thì không
+        self._created: Dict[int, float] = {}
+        self._last_used: Dict[int, float] = {}
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._failed_checks = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def _ensure(self):
+        if self._pool is None:
+            async with self._init_lock:
+                if self._pool is None:
+                    import asyncpg
+                    # asyncpg tự tái tạo kết nối nhàn rỗi (max_inactive_connection_lifetime)
+                    # và tự reset/kiểm tra kết nối khi trả về pool.
+                    self._pool = await asyncpg.create_pool(
+                        min_size=self.minconn,
+                        max_size=self.maxconn,
+                        max_inactive_connection_lifetime=self.max_idle,
+                        max_queries=50000,
+                        init=self._init_conn,
+                        **_asyncpg_dsn_kwargs(self.db_config),
+                    )
+                    logger.info("Async DB pool created (min=%s, max=%s)", self.minconn, self.maxconn)
+        return self._pool
+
+    async def _init_conn(self, conn):
+        now = time.monotonic()
+        pid = conn.get_server_pid()
+        self._created[pid] = now
+        self._last_used[pid] = now
+        if self.init is not None:
+            await self.init(conn)
+
+    def _forget(self, pid: int):
+        self._created.pop(pid, None)
+        self._last_used.pop(pid, None)
+
+    async def _checked(self, conn) -> bool:
+        """False nếu kết nối quá già hoặc không qua health check (khi đó đã bị terminate)."""
+        now = time.monotonic()
+        pid = conn.get_server_pid()
+        expired = bool(self.max_lifetime) and now - self._created.get(pid, now) > self.max_lifetime
+        if not expired and self.health_check_after \
+                and now - self._last_used.get(pid, now) >= self.health_check_after:
+            try:
+                await conn.fetchval("SELECT 1", timeout=self.timeout)
+            except Exception as e:
+                logger.warning("Pooled connection failed health check: %s", e)
+                self._failed_checks += 1
+                expired = True
+        if expired:
+            self._forget(pid)
+            self._recycled += 1
+            conn.terminate()
+        return not expired
+
+    async def _acquire(self, pool):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        self._waiting += 1
+        try:
+            while True:
+                try:
+                    conn = await pool.acquire(timeout=max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"Timed out after {self.timeout}s waiting for a DB connection (max {self.maxconn} in use)"
+                    )
+                try:
+                    healthy = await self._checked(conn)
+                except BaseException:
+                    await pool.release(conn)
+                    raise
+                if healthy:
+                    return conn
+                # kết nối đã terminate: trả lại để asyncpg mở kết nối mới ở lần acquire sau
+                await pool.release(conn)
+        finally:
+            self._waiting -= 1
+            waited = time.monotonic() - start
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+    @asynccontextmanager
+    async def connection(self, statement_timeout_ms: int | None = None):
+        pool = await self._ensure()
+        conn = await self._acquire(pool)
+        self._checkouts += 1
+        self._in_use += 1
+        try:
+            st = self.statement_timeout_ms if statement_timeout_ms is None else statement_timeout_ms
+            async with conn.transaction(readonly=True):
+                if st:
+                    await conn.execute(f"SET LOCAL statement_timeout = {int(st)}")
+                yield conn
+        finally:
+            self._in_use -= 1
+            if not conn.is_closed():
+                self._last_used[conn.get_server_pid()] = time.monotonic()
+            await pool.release(conn)
+
+    def stats(self) -> Dict:
+        size = self._pool.get_size() if self._pool is not None else 0
+        checkouts = self._checkouts
+        return {
+            "size": size,
+            "max_size": self.maxconn,
+            "in_use": self._in_use,
+            "idle": self._pool.get_idle_size() if self._pool is not None else 0,
+            "waiting": self._waiting,
+            "checkouts": checkouts,
+            "timeouts": self._timeouts,
+            "recycled": self._recycled,
+            "failed_health_checks": self._failed_checks,
+            "wait_time_total_ms": round(self._wait_total * 1000, 3),
+            "wait_time_avg_ms": round(self._wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+            "wait_time_max_ms": round(self._wait_max * 1000, 3),
+        }
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+_ASYNC_POOL: AsyncConnectionPool | None = None
+
+
+def get_async_pool(db_config: Dict, pool_config: Dict) -> AsyncConnectionPool:
+    global _ASYNC_POOL
+    if _ASYNC_POOL is None:
+        _ASYNC_POOL = AsyncConnectionPool(db_config, **pool_config)
+    return _ASYNC_POOL
+
+
+async def close_async_pool():
+    global _ASYNC_POOL
+    if _ASYNC_POOL is not None:
+        await _ASYNC_POOL.close()
+        _ASYNC_POOL = None
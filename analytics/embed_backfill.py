@@ -0,0 +1,271 @@
+# embed_backfill.py
+# Điền dw.dim_articles.embedding cho các bài chưa có (hoặc đã cũ) bằng cùng model MiniLM của /search:
+#   - đọc bằng server-side cursor theo article_id tăng dần (không nạp cả bảng vào RAM)
+#   - encode theo batch lớn trên process pool (mỗi process một bản model, dùng hết các core)
+#   - ghi lại bằng COPY vào bảng tạm + một UPDATE ... FROM cho mỗi batch
+#   - checkpoint article_id cuối cùng đã ghi: chạy lại sau khi crash sẽ tiếp tục từ đó
+#
+#   python -m analytics.embed_backfill                  # NULL hoặc cũ (text/model đổi so với lúc encode)
+#   python -m analytics.embed_backfill --incremental    # chỉ bài mới nạp (embedding IS NULL)
+#   python -m analytics.embed_backfill --reset          # bỏ checkpoint, quét lại từ đầu
+#
+# "Cũ" được nhận ra qua cột embedding_hash = md5(model || text) ghi kèm mỗi vector; model gồm cả
+# backend (ENCODER_BACKEND=onnx ghi "<model>+onnx-int8") để vector /search và vector đã lưu cùng nguồn.
+import argparse
+import io
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import psycopg2
+
+from .encoder import EMBEDDING_MODEL, ENCODER_BACKEND, ENCODER_BACKENDS, load_model, model_key
+from .vector_index import VECTOR_COLUMN, VECTOR_TABLE, _db_config
+
+logger = logging.getLogger("analytics.embed_backfill")
+
+# =========================
+# Config
+# =========================
+# Số dòng mỗi batch encode/ghi (một checkpoint mỗi batch)
+BACKFILL_BATCH = int(os.getenv("BACKFILL_BATCH", "512"))
+# Số dòng mỗi lần fetch từ server-side cursor
+BACKFILL_FETCH = int(os.getenv("BACKFILL_FETCH", "5000"))
+# 0 = số core
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "0"))
+BACKFILL_CHECKPOINT = os.getenv(
+    "BACKFILL_CHECKPOINT", os.path.join(os.getenv("MODEL_DIR", "models"), "embed_backfill.json")
+)
+# MiniLM chỉ đọc ~128 token đầu: cắt text trên DB để không kéo cả bài về
+BACKFILL_MAX_CHARS = int(os.getenv("BACKFILL_MAX_CHARS", "2000"))
+BACKFILL_LOG_EVERY = float(os.getenv("BACKFILL_LOG_EVERY", "10"))
+
+HASH_COLUMN = f"{VECTOR_COLUMN}_hash"
+# Text được embed: nội dung bài (tiêu đề nếu không có nội dung)
+_TEXT_SQL = f"left(coalesce(nullif(content, ''), title, ''), {BACKFILL_MAX_CHARS})"
+
+
+# =========================
+# Worker (chạy trong process con)
+# =========================
+_MODEL = None
+
+
+def _init_worker(model_name: str, backend: str, threads: int):
+    global _MODEL
+    # mỗi process một thread: N process x 1 thread tận dụng core tốt hơn các thread tranh nhau
+    _MODEL = load_model(model_name, backend, threads)
+
+
+def _encode_chunk(texts: List[str]) -> np.ndarray:
+    return np.asarray(_MODEL.encode(texts, batch_size=64), dtype=np.float32)
+
+
+# =========================
+# Checkpoint
+# =========================
+class Checkpoint:
+    """article_id cuối cùng đã ghi xong, theo mode; ghi file tạm rồi os.replace (không hỏng khi crash)."""
+
+    def __init__(self, path: str, mode: str, model: str):
+        self.path, self.mode, self.model = path, mode, model
+        self.last_id = 0
+        self.rows = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f).get(mode) or {}
+        except (OSError, ValueError):
+            state = {}
+        # đổi model thì vector cũ không còn dùng được: bắt đầu lại
+        if state.get("model") == model and not state.get("done"):
+            self.last_id = int(state.get("last_id") or 0)
+            self.rows = int(state.get("rows") or 0)
+
+    def save(self, last_id: int, rows: int, done: bool = False):
+        self.last_id, self.rows = last_id, rows
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.mode] = {"model": self.model, "last_id": last_id, "rows": rows, "done": done,
+                           "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.save(0, 0)
+
+
+# =========================
+# Đọc / ghi
+# =========================
+def ensure_hash_column(db_config: Dict):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            # thêm cột không có default: chỉ đổi metadata, không ghi lại bảng
+            cur.execute(f"ALTER TABLE {VECTOR_TABLE} ADD COLUMN IF NOT EXISTS {HASH_COLUMN} text")
+    finally:
+        conn.close()
+
+
+def _select_sql(incremental: bool) -> str:
+    stale = f"{VECTOR_COLUMN} IS NULL"
+    if not incremental:
+        stale += f" OR {HASH_COLUMN} IS DISTINCT FROM md5(%(model)s || {_TEXT_SQL})"
+    return (f"SELECT article_id, {_TEXT_SQL} AS text, md5(%(model)s || {_TEXT_SQL}) AS hash "
+            f"FROM {VECTOR_TABLE} WHERE article_id > %(after)s AND ({stale}) ORDER BY article_id")
+
+
+def count_pending(db_config: Dict, incremental: bool, model: str, after: int) -> int:
+    conn = psycopg2.connect(**db_config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM ({_select_sql(incremental)}) t", {"model": model, "after": after})
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def iter_batches(db_config: Dict, incremental: bool, model: str, after: int, batch: int):
+    """Các batch (ids, texts, hashes) đọc qua named cursor (server-side), theo article_id tăng dần."""
+    conn = psycopg2.connect(**db_config)
+    try:
+        with conn.cursor(name="embed_backfill") as cur:
+            cur.itersize = BACKFILL_FETCH
+            cur.execute(_select_sql(incremental), {"model": model, "after": after})
+            ids, texts, hashes = [], [], []
+            for article_id, text, h in cur:
+                ids.append(article_id)
+                texts.append(text or "")
+                hashes.append(h)
+                if len(ids) >= batch:
+                    yield ids, texts, hashes
+                    ids, texts, hashes = [], [], []
+            if ids:
+                yield ids, texts, hashes
+    finally:
+        conn.close()
+
+
+class Writer:
+    """COPY (text format) vào bảng tạm rồi UPDATE ... FROM: một round trip ghi cho cả batch."""
+
+    def __init__(self, db_config: Dict):
+        self.conn = psycopg2.connect(**db_config)
+        with self.conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE embed_stage (article_id integer PRIMARY KEY, "
+                        "embedding text NOT NULL, hash text NOT NULL) ON COMMIT DELETE ROWS")
+        self.conn.commit()
+
+    def write(self, ids: List[int], vecs: np.ndarray, hashes: List[str]):
+        buf = io.StringIO()
+        for article_id, vec, h in zip(ids, vecs, hashes):
+            buf.write(f"{article_id}\t[{','.join(f'{x:.7g}' for x in vec)}]\t{h}\n")
+        buf.seek(0)
+        with self.conn.cursor() as cur:
+            cur.copy_expert("COPY embed_stage (article_id, embedding, hash) FROM STDIN", buf)
+            cur.execute(f"UPDATE {VECTOR_TABLE} a SET {VECTOR_COLUMN} = s.embedding::vector, {HASH_COLUMN} = s.hash "
+                        f"FROM embed_stage s WHERE a.article_id = s.article_id")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# =========================
+# Pipeline
+# =========================
+def run(db_config: Dict, incremental: bool = False, reset: bool = False, batch: int = BACKFILL_BATCH,
+        workers: int = BACKFILL_WORKERS, checkpoint_path: str = BACKFILL_CHECKPOINT,
+        model: str = EMBEDDING_MODEL, backend: str = ENCODER_BACKEND, limit: int | None = None) -> Dict:
+    mode = "incremental" if incremental else "full"
+    key = model_key(model, backend)
+    ckpt = Checkpoint(checkpoint_path, mode, key)
+    if reset:
+        ckpt.reset()
+    ensure_hash_column(db_config)
+    total = count_pending(db_config, incremental, key, ckpt.last_id)
+    if limit:
+        total = min(total, limit)
+    workers = workers or os.cpu_count() or 1
+    logger.info("Backfill (%s, %s): %d rows to encode after article_id %d, %d workers, batch %d",
+                mode, backend, total, ckpt.last_id, workers, batch)
+    if not total:
+        ckpt.save(ckpt.last_id, ckpt.rows, done=True)
+        return {"mode": mode, "rows": 0, "seconds": 0.0, "rows_per_s": 0.0}
+
+    writer = Writer(db_config)
+    started = last_log = time.perf_counter()
+    done_rows = 0
+    # tối đa 2 batch mỗi worker đang encode; ghi theo đúng thứ tự gửi để checkpoint luôn liên tục
+    inflight: deque[Tuple[List[int], List[str], object]] = deque()
+
+    def drain_one():
+        nonlocal done_rows, last_log
+        ids, hashes, fut = inflight.popleft()
+        writer.write(ids, fut.result(), hashes)
+        done_rows += len(ids)
+        ckpt.save(ids[-1], ckpt.rows + len(ids))
+        now = time.perf_counter()
+        if now - last_log >= BACKFILL_LOG_EVERY:
+            rate = done_rows / (now - started)
+            logger.info("%d/%d rows (%.1f rows/s, ETA %.0fs), last article_id %d",
+                        done_rows, total, rate, (total - done_rows) / rate if rate else 0, ids[-1])
+            last_log = now
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model, backend, 1)) as pool:
+            sent = 0
+            for ids, texts, hashes in iter_batches(db_config, incremental, key, ckpt.last_id, batch):
+                if limit and sent >= limit:
+                    break
+                if limit:
+                    ids, texts, hashes = ids[:limit - sent], texts[:limit - sent], hashes[:limit - sent]
+                inflight.append((ids, hashes, pool.submit(_encode_chunk, texts)))
+                sent += len(ids)
+                if len(inflight) >= 2 * workers:
+                    drain_one()
+            while inflight:
+                drain_one()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    # hết dữ liệu (không phải dừng vì --limit): lần chạy sau quét lại từ đầu
+    ckpt.save(0 if not limit else ckpt.last_id, ckpt.rows, done=not limit)
+    rate = done_rows / elapsed if elapsed else 0.0
+    logger.info("Backfill (%s) done: %d rows in %.1fs (%.1f rows/s)", mode, done_rows, elapsed, rate)
+    return {"mode": mode, "rows": done_rows, "seconds": round(elapsed, 1), "rows_per_s": round(rate, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill dw.dim_articles.embedding (resumable)")
+    parser.add_argument("--incremental", action="store_true", help="chỉ các bài chưa có embedding")
+    parser.add_argument("--reset", action="store_true", help="bỏ checkpoint, quét lại từ đầu")
+    parser.add_argument("--batch", type=int, default=BACKFILL_BATCH)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="0 = số core")
+    parser.add_argument("--limit", type=int, default=None, help="dừng sau bấy nhiêu dòng (chạy thử)")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT)
+    parser.add_argument("--backend", choices=ENCODER_BACKENDS, default=ENCODER_BACKEND)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+
+    out = run(_db_config(), incremental=args.incremental, reset=args.reset, batch=args.batch,
+              workers=args.workers, checkpoint_path=args.checkpoint, backend=args.backend, limit=args.limit)
+    print(json.dumps(out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# encoder.py
+# Encoder câu truy vấn dùng chung cho /search: gom các request đồng thời trong vài ms thành một
+# lần model.encode theo batch (một forward pass thay vì N pass nhỏ tranh nhau CPU), và giữ
+# LRU cache embedding của các câu truy vấn gần đây.
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("analytics.encoder")
+
+# =========================
+# Config
+# =========================
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# Số câu tối đa mỗi lần encode và thời gian chờ gom thêm câu sau câu đầu tiên
+ENCODER_MAX_BATCH = int(os.getenv("ENCODER_MAX_BATCH", "32"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+# 0 = tắt cache
+ENCODER_CACHE_SIZE = int(os.getenv("ENCODER_CACHE_SIZE", "4096"))
+# torch (SentenceTransformer) | onnx (int8 ONNX Runtime, xem onnx_encoder.py; cần export trước)
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch").strip().lower()
+
+ENCODER_BACKENDS = ("torch", "onnx")
+
+
+def load_model(model_name: str = EMBEDDING_MODEL, backend: str = ENCODER_BACKEND, threads: int = 0):
+    """Model có .encode(texts, batch_size) theo backend; threads=0 giữ mặc định của backend."""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}' (expected one of {', '.join(ENCODER_BACKENDS)})")
+    if backend == "onnx":
+        from .onnx_encoder import ENCODER_ONNX_DIR, ENCODER_ONNX_THREADS, OnnxEncoder
+        model = OnnxEncoder(ENCODER_ONNX_DIR, threads or ENCODER_ONNX_THREADS)
+        if model.meta.get("model") != model_name:
+            logger.warning("ONNX encoder in %s was exported from %s, not %s",
+                           ENCODER_ONNX_DIR, model.meta.get("model"), model_name)
+        return model
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name)
+
+
+def model_key(model_name: str = EMBEDDING_MODEL, backend: str = ENCODER_BACKEND) -> str:
+    """Tên ghi kèm embedding đã lưu: vector int8 lệch nhẹ so với torch nên đổi backend = encode lại."""
+    return model_name if backend == "torch" else f"{model_name}+onnx-int8"
+
+
+class EmbeddingCache:
+    """LRU text → vector (thread-safe; vector lưu dạng read-only để không bị sửa qua tham chiếu)."""
+
+    def __init__(self, maxsize: int = ENCODER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> np.ndarray | None:
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            vec = self._data.get(text)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(text)
+            self.hits += 1
+            return vec
+
+    def put(self, text: str, vec: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        vec.flags.writeable = False
+        with self._lock:
+            self._data[text] = vec
+            self._data.move_to_end(text)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class BatchEncoder:
+    """
+    encode(text) đưa câu vào hàng đợi; một task nền lấy câu đầu tiên, chờ tối đa max_wait_ms
+    (hoặc tới khi đủ max_batch) rồi encode cả batch trong thread riêng. Câu trùng (đang chờ
+    hoặc đang encode) chỉ encode một lần.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, max_batch: int = ENCODER_MAX_BATCH,
+                 max_wait_ms: float = ENCODER_MAX_WAIT_MS, cache_size: int = ENCODER_CACHE_SIZE,
+                 backend: str = ENCODER_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.cache = EmbeddingCache(cache_size)
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        # câu đang chờ encode: request trùng dùng chung future thay vì encode lại ở batch sau
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # metrics
+        self.requests = 0
+        self.batches = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.max_batch_seen = 0
+
+    # ----- model -----
+    def load(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    t0 = time.perf_counter()
+                    self._model = load_model(self.model_name, self.backend)
+                    logger.info("Loaded %s (%s) in %.1fs", self.model_name, self.backend,
+                                time.perf_counter() - t0)
+        return self._model
+
+    def encode_now(self, texts: List[str]) -> np.ndarray:
+        """Encode đồng bộ một batch (không qua hàng đợi, không cache)."""
+        model = self.load()
+        return np.asarray(model.encode(texts, batch_size=max(1, len(texts))), dtype=np.float32)
+
+    # ----- hàng đợi -----
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for fut in self._inflight.values():
+            if not fut.done():
+                fut.cancel()
+        self._inflight.clear()
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # lấy nốt những câu đã nằm sẵn trong hàng đợi
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            texts = [t for t, _ in batch]
+            t0 = time.perf_counter()
+            try:
+                vecs = await asyncio.to_thread(self.encode_now, texts)
+            except Exception as e:
+                logger.exception("Batch encode failed (%d texts)", len(texts))
+                for text, fut in batch:
+                    self._inflight.pop(text, None)
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.encode_seconds += time.perf_counter() - t0
+            self.batches += 1
+            self.encoded += len(texts)
+            self.max_batch_seen = max(self.max_batch_seen, len(texts))
+            for (text, fut), vec in zip(batch, vecs):
+                self.cache.put(text, vec)
+                self._inflight.pop(text, None)
+                if not fut.done():
+                    fut.set_result(vec)
+
+    async def encode(self, text: str) -> np.ndarray:
+        return (await self.encode_many([text]))[0]
+
+    async def encode_many(self, texts: List[str]) -> List[np.ndarray]:
+        """Vector cho từng câu (theo thứ tự); câu đã cache trả về ngay, còn lại vào chung batch."""
+        self.start()
+        self.requests += len(texts)
+        out: List = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            key = (text or "").strip()
+            vec = self.cache.get(key)
+            if vec is not None:
+                out[i] = vec
+                continue
+            fut = self._inflight.get(key)
+            if fut is None:
+                fut = asyncio.get_running_loop().create_future()
+                self._inflight[key] = fut
+                self._queue.put_nowait((key, fut))
+            pending.append((i, fut))
+        for i, fut in pending:
+            # shield: một request bị huỷ không được huỷ future dùng chung với request khác
+            out[i] = await asyncio.shield(fut)
+        return out
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "loaded": self._model is not None,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+            "encode_ms_total": round(self.encode_seconds * 1000, 1),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "cache": {"size": len(self.cache), "maxsize": self.cache.maxsize,
+                      "hits": self.cache.hits, "misses": self.cache.misses},
+        }
@@ -0,0 +1,267 @@
+# fake_ollama.py
+# Server giả lập Ollama (/api/generate, /api/chat, /api/ps, /api/tags) để chạy tải / hồi quy
+# mà không cần model thật:
+#   FAKE_OLLAMA_RECORDINGS=recordings.jsonl FAKE_OLLAMA_PROFILE=gpu-7b \
+#       uvicorn analytics.fake_ollama:app --port 11435
+# rồi trỏ API vào nó bằng OLLAMA_HOST=localhost:11435.
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from .ollama_client import _model_key, prompt_key
+
+logger = logging.getLogger("analytics.fake_ollama")
+
+# =========================
+# Config
+# =========================
+# JSONL do OllamaClient ghi (OLLAMA_RECORD_FILE); có thể nhiều file, phân cách bằng dấu phẩy
+FAKE_OLLAMA_RECORDINGS = os.getenv("FAKE_OLLAMA_RECORDINGS", "")
+# Prompt không có bản ghi: error (404 như model lỗi) | empty (trả text rỗng) | echo (trả lại user message)
+FAKE_OLLAMA_MISS = os.getenv("FAKE_OLLAMA_MISS", "error").strip().lower()
+FAKE_OLLAMA_PROFILE = os.getenv("FAKE_OLLAMA_PROFILE", "instant").strip().lower()
+# Ghi đè từng thông số của profile (rỗng = theo profile)
+FAKE_OLLAMA_TTFT_MS = os.getenv("FAKE_OLLAMA_TTFT_MS", "")
+FAKE_OLLAMA_TOKENS_PER_S = os.getenv("FAKE_OLLAMA_TOKENS_PER_S", "")
+FAKE_OLLAMA_JITTER = os.getenv("FAKE_OLLAMA_JITTER", "")
+# Tỉ lệ lỗi giả lập, vd. "timeout=0.02,malformed=0.05,empty=0.05,error=0.01"
+FAKE_OLLAMA_FAULTS = os.getenv("FAKE_OLLAMA_FAULTS", "")
+# Lỗi timeout = treo bấy nhiêu giây trước khi trả lời (lớn hơn OLLAMA_TIMEOUT của client)
+FAKE_OLLAMA_HANG_S = float(os.getenv("FAKE_OLLAMA_HANG_S", "600"))
+FAKE_OLLAMA_SEED = os.getenv("FAKE_OLLAMA_SEED", "")
+
+# ttft_ms: thời gian tới token đầu (gồm prompt eval); tokens_per_s: tốc độ sinh; jitter: ±tỉ lệ ngẫu nhiên
+PROFILES: Dict[str, Dict[str, float]] = {
+    "instant": {"ttft_ms": 0.0, "tokens_per_s": 0.0, "jitter": 0.0},
+    "gpu-7b": {"ttft_ms": 150.0, "tokens_per_s": 60.0, "jitter": 0.1},
+    "cpu-7b": {"ttft_ms": 800.0, "tokens_per_s": 10.0, "jitter": 0.15},
+    "slow": {"ttft_ms": 3000.0, "tokens_per_s": 4.0, "jitter": 0.2},
+}
+FAULTS = ("timeout", "malformed", "empty", "error")
+
+
+def parse_faults(spec: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        name, _, rate = part.partition("=")
+        name = name.strip().lower()
+        if name not in FAULTS:
+            raise ValueError(f"Unknown fault '{name}' (expected one of {', '.join(FAULTS)})")
+        rates[name] = float(rate or 0)
+    return rates
+
+
+def build_profile(name: str = FAKE_OLLAMA_PROFILE) -> Dict[str, float]:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile '{name}' (expected one of {', '.join(PROFILES)})")
+    profile = dict(PROFILES[name])
+    for key, raw in (("ttft_ms", FAKE_OLLAMA_TTFT_MS), ("tokens_per_s", FAKE_OLLAMA_TOKENS_PER_S),
+                     ("jitter", FAKE_OLLAMA_JITTER)):
+        if raw:
+            profile[key] = float(raw)
+    return profile
+
+
+def _split_tokens(text: str) -> List[str]:
+    """Chia text thành các 'token' ~4 ký tự, giữ nguyên khi nối lại."""
+    return [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+
+
+class FakeOllama:
+    """Kho bản ghi + mô phỏng độ trễ và lỗi; tách khỏi app để dùng lại trong script."""
+
+    def __init__(self, recordings: str = FAKE_OLLAMA_RECORDINGS, miss: str = FAKE_OLLAMA_MISS,
+                 profile: Dict[str, float] | None = None, faults: Dict[str, float] | None = None,
+                 seed: str = FAKE_OLLAMA_SEED):
+        self.miss = miss
+        self.profile = profile or build_profile()
+        self.faults = parse_faults(FAKE_OLLAMA_FAULTS) if faults is None else faults
+        self.rng = random.Random(int(seed)) if seed else random.Random()
+        self.responses: Dict[str, Dict] = {}
+        self.loaded: Dict[str, float] = {}
+        self.counts: Counter = Counter()
+        for path in filter(None, (p.strip() for p in recordings.split(","))):
+            self.load(path)
+
+    def load(self, path: str) -> int:
+        n = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping malformed recording line in %s", path)
+                    continue
+                # bản ghi sau cùng của cùng một prompt thắng
+                self.responses[rec["key"]] = rec["response"]
+                n += 1
+        logger.info("Loaded %d recordings from %s (%d distinct prompts)", n, path, len(self.responses))
+        return n
+
+    # ----- hành vi -----
+    def pick_fault(self) -> str | None:
+        roll = self.rng.random()
+        acc = 0.0
+        for name in FAULTS:
+            acc += self.faults.get(name, 0.0)
+            if roll < acc:
+                return name
+        return None
+
+    def ttft_s(self) -> float:
+        return self._jittered(self.profile["ttft_ms"] / 1000)
+
+    def token_s(self) -> float:
+        rate = self.profile["tokens_per_s"]
+        return self._jittered(1 / rate) if rate > 0 else 0.0
+
+    def _jittered(self, value: float) -> float:
+        j = self.profile.get("jitter", 0.0)
+        return max(0.0, value * (1 + self.rng.uniform(-j, j))) if j else value
+
+    def lookup(self, path: str, payload: dict) -> str | None:
+        """Text của bản ghi khớp prompt; None nếu không có (xử lý theo FAKE_OLLAMA_MISS)."""
+        rec = self.responses.get(prompt_key(path, payload))
+        if rec is not None:
+            self.counts["hit"] += 1
+            msg = rec.get("message")
+            return msg.get("content", "") if isinstance(msg, dict) else rec.get("response", "")
+        self.counts["miss"] += 1
+        if self.miss == "empty":
+            return ""
+        if self.miss == "echo":
+            messages = payload.get("messages") or []
+            return messages[-1].get("content", "") if messages else payload.get("prompt", "")
+        return None
+
+    def stats(self) -> Dict:
+        return {"recordings": len(self.responses), "profile": self.profile, "faults": self.faults,
+                "miss_policy": self.miss, "counts": dict(self.counts), "loaded": sorted(self.loaded)}
+
+
+FAKE = FakeOllama()
+app = FastAPI(title="fake-ollama")
+
+
+def _chunk(path: str, model: str, text: str, done: bool) -> dict:
+    out = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": done}
+    if path == "/api/chat":
+        out["message"] = {"role": "assistant", "content": text}
+    else:
+        out["response"] = text
+    return out
+
+
+def _final_stats(payload: dict, text: str, started: float, ttft: float) -> dict:
+    prompt = json.dumps(payload.get("messages") or payload.get("prompt") or "", ensure_ascii=False)
+    total_ns = int((time.perf_counter() - started) * 1e9)
+    eval_count = len(_split_tokens(text)) if text else 0
+    return {"done_reason": "stop", "total_duration": total_ns, "load_duration": 0,
+            "prompt_eval_count": max(1, len(prompt) // 4), "prompt_eval_duration": int(ttft * 1e9),
+            "eval_count": eval_count, "eval_duration": max(0, total_ns - int(ttft * 1e9))}
+
+
+async def _respond(path: str, request: Request):
+    started = time.perf_counter()
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "invalid JSON body"}, status_code=400)
+    model = payload.get("model") or ""
+    FAKE.loaded[_model_key(model)] = time.time()
+    FAKE.counts["requests"] += 1
+
+    # /api/generate không có prompt = lệnh load model (warm-up)
+    if path == "/api/generate" and not payload.get("prompt") and not payload.get("system"):
+        return {"model": model, "created_at": _chunk(path, model, "", True)["created_at"], "response": "",
+                "done": True, "done_reason": "load"}
+
+    fault = FAKE.pick_fault()
+    if fault:
+        FAKE.counts[f"fault_{fault}"] += 1
+    if fault == "timeout":
+        await asyncio.sleep(FAKE_OLLAMA_HANG_S)
+    if fault == "error":
+        return JSONResponse({"error": "fake: injected server error"}, status_code=500)
+
+    text = "" if fault == "empty" else FAKE.lookup(path, payload)
+    if text is None:
+        return JSONResponse({"error": f"fake: no recording for prompt {prompt_key(path, payload)[:12]}"},
+                            status_code=404)
+    stream = payload.get("stream", True)  # mặc định của Ollama là stream
+    ttft = FAKE.ttft_s()
+
+    if not stream:
+        tokens = _split_tokens(text)
+        await asyncio.sleep(ttft + sum(FAKE.token_s() for _ in tokens))
+        if fault == "malformed":
+            return Response('{"model": "' + model + '", "message": {"content": "', media_type="application/json")
+        return {**_chunk(path, model, text, True), **_final_stats(payload, text, started, ttft)}
+
+    async def chunks():
+        await asyncio.sleep(ttft)
+        for i, tok in enumerate(_split_tokens(text)):
+            if fault == "malformed" and i == 1:
+                yield '{"model": "' + model + '", "message": {"content\n'
+                return
+            yield json.dumps(_chunk(path, model, tok, False), ensure_ascii=False) + "\n"
+            await asyncio.sleep(FAKE.token_s())
+        yield json.dumps({**_chunk(path, model, "", True), **_final_stats(payload, text, started, ttft)},
+                         ensure_ascii=False) + "\n"
+
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    return await _respond("/api/chat", request)
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    return await _respond("/api/generate", request)
+
+
+@app.get("/api/ps")
+def ps():
+    return {"models": [{"name": m, "model": m} for m in sorted(FAKE.loaded)]}
+
+
+@app.get("/api/tags")
+def tags():
+    return {"models": [{"name": m, "model": m} for m in sorted(FAKE.loaded)]}
+
+
+@app.get("/api/version")
+def version():
+    return {"version": "0.0.0-fake"}
+
+
+@app.get("/fake/stats")
+def fake_stats():
+    return FAKE.stats()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Ollama server (record/replay, latency, faults)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=11435)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+    uvicorn.run(app, host=args.host, port=args.port)
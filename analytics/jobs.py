@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger("analytics.jobs")
+
+# =========================
+# Config
+# =========================
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "2"))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", "200"))
+JOB_STATEMENT_TIMEOUT_MS = int(os.getenv("JOB_STATEMENT_TIMEOUT_MS", "600000"))
+
+
+class JobStore:
+    """
+    Hàng đợi job nền trong process cho các truy vấn nặng bị cost guard chuyển sang chạy
+    bất đồng bộ. Tối đa `max_concurrency` job chạy cùng lúc; kết quả giữ trong `ttl` giây.
+    """
+
+    def __init__(self, ttl: float = JOB_TTL, max_concurrency: int = JOB_MAX_CONCURRENCY,
+                 max_stored: int = JOB_MAX_STORED):
+        self.ttl = ttl
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_stored = max_stored
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sem: asyncio.Semaphore | None = None
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [k for k, j in self._jobs.items()
+                       if j["finished_at"] and now - j["finished_at"] > self.ttl]:
+            del self._jobs[job_id]
+        while len(self._jobs) > self.max_stored:
+            job_id, job = next(iter(self._jobs.items()))
+            if job["status"] in ("queued", "running"):
+                break
+            del self._jobs[job_id]
+
+    def submit(self, run: Callable[[], Awaitable[Dict]], meta: Dict | None = None) -> Dict:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._purge()
+        job_id = uuid.uuid4().hex
+        job = {"job_id": job_id, "status": "queued", "submitted_at": time.time(), "started_at": None,
+               "finished_at": None, "result": None, "error": None, **(meta or {})}
+        self._jobs[job_id] = job
+        self._tasks[job_id] = asyncio.get_running_loop().create_task(self._run(job, run))
+        return self.public(job)
+
+    async def _run(self, job: Dict, run: Callable[[], Awaitable[Dict]]):
+        try:
+            async with self._sem:
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                job["result"] = await run()
+                job["status"] = "done"
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job["job_id"], e)
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.time()
+            self._tasks.pop(job["job_id"], None)
+
+    @staticmethod
+    def public(job: Dict) -> Dict:
+        out = {k: v for k, v in job.items() if k != "result"}
+        if job["finished_at"] and job["started_at"]:
+            out["elapsed_s"] = round(job["finished_at"] - job["started_at"], 3)
+        return out
+
+    def get(self, job_id: str) -> Dict | None:
+        self._purge()
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        out = self.public(job)
+        out["result"] = job["result"]
+        return out
+
+    def cancel_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    def stats(self) -> Dict:
+        by_status: Dict[str, int] = {}
+        for j in self._jobs.values():
+            by_status[j["status"]] = by_status.get(j["status"], 0) + 1
+        return {"stored": len(self._jobs), "max_concurrency": self.max_concurrency, "by_status": by_status}
@@ -1,54 +1,62 @@
+import asyncio
+import copy
 import json
 import logging
 import re
-from typing import List, Tuple, Dict, Any
+from collections import Counter
+from typing import AsyncIterator, List, Tuple, Dict, Any
 
-import requests
-from requests.exceptions import ReadTimeout, RequestException
+import httpx
+
+from .catalog import SchemaCatalog, as_catalog, normalize_name
+from .ollama_client import OLLAMA, OLLAMA_MODELS
+from .plan_cache import PlanCache
+from .rollups import route_plan
+from .rule_parser import parse_question
+from .semantic_cache import SemanticCache
+from .text_index import KEYWORD_INDEXES
+from .tracing import annotate, span
 
 logger = logging.getLogger("analytics.nl2sql_generator")
 
 # =========================
 # Config
 # =========================
-OLLAMA_HOST = "http://host.docker.internal:11434"
-OLLAMA_TIMEOUT = 60
-MAX_RETRIES = 2
+# Host, model, timeout, keep_alive: xem analytics/ollama_client.py (đọc từ biến môi trường)
+DECONSTRUCTOR_MODEL = OLLAMA_MODELS["deconstructor"]
+
+_DEFAULT_JOIN_MAP = {
+    "da": "INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id",
+    "au": "INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id",
+    "dt": "INNER JOIN dw.dim_topics dt ON fa.topic_id = dt.topic_id",
+    "dd": "INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id",
+}
 
-def intelligent_join_builder(plan: dict) -> str:
-    all_columns_text = json.dumps(plan)
-    used_aliases = set(re.findall(r'\b(fa|da|au|dt|dd)\b', all_columns_text))
+def _join_map(catalog: SchemaCatalog | None) -> Dict[str, str]:
+    # join_map dựng sẵn từ khóa ngoại trong semantic_model.yaml nếu có catalog
+    return catalog.join_map if catalog is not None and catalog.join_map else _DEFAULT_JOIN_MAP
 
+def star_join_aliases(plan: dict, catalog: SchemaCatalog | None = None) -> List[str]:
+    """Các alias dimension mà star join sẽ INNER JOIN cho plan (mọi alias xuất hiện trong plan)."""
+    used_aliases = set(re.findall(r'\b(fa|da|au|dt|dd)\b', json.dumps(plan)))
     if "fa" not in used_aliases or len(used_aliases) <= 1:
-        return "FROM dw.fact_articles fa"
+        return []
+    join_map = _join_map(catalog)
+    return [alias for alias in ["da", "au", "dt", "dd"] if alias in used_aliases and alias in join_map]
 
+def intelligent_join_builder(plan: dict, catalog: SchemaCatalog | None = None) -> str:
+    join_map = _join_map(catalog)
     joins = ["FROM dw.fact_articles fa"]
-    join_map = {
-        "da": "INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id",
-        "au": "INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id",
-        "dt": "INNER JOIN dw.dim_topics dt ON fa.topic_id = dt.topic_id",
-        "dd": "INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id",
-    }
-
-    for alias in ["da", "au", "dt", "dd"]:
-        if alias in used_aliases:
-            joins.append(join_map[alias])
-
+    joins += [join_map[alias] for alias in star_join_aliases(plan, catalog)]
     return "\n".join(joins)
 
 # ----- New helpers: schema index & fuzzy column matcher -----
-def build_schema_index(catalog: dict) -> Dict[str, set]:
-    idx = {}
-    for t in catalog.get("tables", []):
-        # Đảm bảo chỉ lấy tên cột từ key 'name'
-        cols = {c['name'] for c in t.get("columns", []) if isinstance(c, dict) and 'name' in c}
-        idx[t["name"]] = cols
-    return idx
+def build_schema_index(catalog) -> Dict[str, set]:
+    # Index đã được dựng sẵn trong SchemaCatalog; giữ hàm cho các caller cũ
+    return as_catalog(catalog).columns
 
 def normalize_col_name(s: str) -> str:
-    if not s:
-        return ""
-    return re.sub(r'[^a-z0-9]', '', s.lower())
+    return normalize_name(s)
 
 def find_best_column_match(table: str, requested: str, schema_index: Dict[str, set]) -> str | None:
     if table not in schema_index:
@@ -70,10 +78,12 @@ def find_best_column_match(table: str, requested: str, schema_index: Dict[str, s
             return c
     return None
 
-def filters_to_sql_where(filters: List[Dict[str, Any]]) -> str:
+def filters_to_sql_where(filters: List[Dict[str, Any]], catalog: SchemaCatalog | None = None) -> str:
     """
     Chuyển filters từ object thành chuỗi điều kiện SQL hợp lệ.
     Hỗ trợ toán tử IN với giá trị là list.
+    Có catalog: filter từ khoá trên cột `text_index` dùng predicate trigram/full-text nếu index đã có
+    ('=' chỉ được coi là filter từ khoá khi có "match": "keyword").
     """
     conditions = []
     for f in filters:
@@ -84,7 +94,10 @@ def filters_to_sql_where(filters: List[Dict[str, Any]]) -> str:
         if not col or val is None:
             continue
 
-        if op == "IN" and isinstance(val, list):
+        indexed = KEYWORD_INDEXES.predicate(col, op, val, catalog, keyword=f.get("match") == "keyword")
+        if indexed:
+            conditions.append(indexed)
+        elif op == "IN" and isinstance(val, list):
             # Xử lý đặc biệt cho toán tử IN với list
             if not val: continue # Bỏ qua nếu list rỗng
             # Chuyển đổi các phần tử trong list thành chuỗi có dấu nháy đơn
@@ -157,6 +170,7 @@ QUY TẮC VÀNG (BẮT BUỘC TUÂN THỦ):
 - 🛑 **GROUP BY CHỈ CÁC CỘT TRONG `dimensions`:** Mệnh đề GROUP BY phải chứa TẤT CẢ và CHỈ các cột trong `dimensions`.
 - 🛑 **ĐỌC KỸ CÂU HỎI ĐỂ XÁC ĐỊNH `dimensions`:** Nếu câu hỏi là "Tác giả nào...", thì `dimensions` phải là `[au.author_name]`. Nếu câu hỏi là "Ngày nào...", thì `dimensions` phải là `[dd.full_date]`.
 - 🛑 **Lọc ngày đầy đủ:** Khi câu hỏi có ngày cụ thể (ví dụ: "15/6/2022"), hãy lọc theo cả 3 cột: `dd.day=15`, `dd.month=6`, `dd.year=2022`.
+- 🛑 **"chứa" trên da.title, da.content, fa.keywords:** dùng `{"column": "da.title", "operator": "ILIKE", "value": "%covid%"}`. Nếu dùng "=" với nghĩa "chứa", thêm `"match": "keyword"` vào điều kiện.
 - 🛑 **Hiểu "A so với B":** Khi so sánh (ví dụ: "năm 2019 so với 2020"), hãy dùng toán tử `IN` cho `filters`, ví dụ: `{"column": "dd.year", "operator": "IN", "value": [2019, 2020]}`.
 - 🛑 **Hiểu "...nhất":** Khi hỏi "Ai/Cái gì ... nhất" (ví dụ: "tiêu cực nhất"), hãy hiểu là đếm số lượng (`COUNT`) và sắp xếp giảm dần (`DESC`), không phải lấy `MAX` của một cột khác.
 - 🛑 **Chọn đúng phép tính:** "Tổng thấp nhất" nghĩa là tính `SUM` rồi `ORDER BY ... ASC`. "Giá trị thấp nhất" mới là dùng `MIN`. Tương tự với "cao nhất".
@@ -232,93 +246,128 @@ OUTPUT: chỉ SQL statement.
 # =========================
 # Ollama query wrapper
 # =========================
-def query_ollama(model: str, role: str, user_input: str, expect_json: bool = True) -> dict | str:
-    valid_roles = {"deconstructor", "planner", "corrector"}
+def _build_ollama_request(model: str, role: str, user_input: str, system: str | None = None) -> Tuple[str, dict]:
+    """
+    Request /api/chat: system prompt cố định của role là message đầu tiên, chỉ phần
+    user thay đổi giữa các lần gọi → Ollama dùng lại KV cache của prefix system.
+    """
+    valid_roles = {"deconstructor", "planner", "corrector", "summarizer"}
     if role not in valid_roles:
         raise ValueError(f"Unknown role {role}")
 
-    # Chọn prompt dựa role (giữ nguyên hoặc tuỳ chỉnh nếu cần)
-    if role == "deconstructor":
-        system_prompt = PROMPT_DECONSTRUCTOR
-    elif role == "planner":
-        system_prompt = PROMPT_PLANNER
-    else:
-        system_prompt = ""
+    # Chọn prompt dựa role; summarizer/corrector truyền system prompt riêng qua `system`
+    if system is None:
+        if role == "deconstructor":
+            system = PROMPT_DECONSTRUCTOR
+        elif role == "planner":
+            system = PROMPT_PLANNER
+        else:
+            system = ""
+
+    messages = []
+    if system.strip():
+        messages.append({"role": "system", "content": system.strip()})
+    if role in ("deconstructor", "planner"):
+        user_input = f"Câu hỏi hoặc plan:\n{user_input}\n\nTrả lời:"
+    messages.append({"role": "user", "content": user_input})
 
     payload = {
         "model": model,
         "options": {"temperature": 0.0},
-        "prompt": f"{system_prompt.strip()}\n\nCâu hỏi hoặc plan:\n{user_input}\n\nTrả lời:",
+        "messages": messages,
         "stream": False,
     }
-    url = f"{OLLAMA_HOST}/api/generate"
-    last_err = None
+    return "/api/chat", payload
+
+def _response_text(resp_json: dict) -> str:
+    msg = resp_json.get("message")
+    if isinstance(msg, dict):
+        return msg.get("content", "") or ""
+    return resp_json.get("response", "") or ""
+
+def _parse_ollama_text(raw_text: str, expect_json: bool) -> dict | str:
+    if not expect_json:
+        return raw_text
+    # Biểu thức chính quy mới: tìm khối JSON nằm giữa ```json và ``` hoặc chỉ ``` và ```
+    match = re.search(r"```(?:json)?\s*({[\s\S]*?})\s*```", raw_text)
+    candidate = ""
+    if match:
+        candidate = match.group(1).strip()
+    else:
+        # Fallback: nếu không có ```, thử tìm JSON đầu tiên trong chuỗi
+        start_index = raw_text.find('{')
+        if start_index != -1:
+            # Tìm dấu ngoặc nhọn đóng tương ứng
+            brace_count = 0
+            json_end = -1
+            for i, char in enumerate(raw_text[start_index:]):
+                if char == '{':
+                    brace_count += 1
+                elif char == '}':
+                    brace_count -= 1
+                    if brace_count == 0:
+                        json_end = start_index + i + 1
+                        break
+            if json_end != -1:
+                candidate = raw_text[start_index:json_end]
 
-    for attempt in range(1, MAX_RETRIES + 1):
+    if candidate:
         try:
-            resp = requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT)
-            resp.raise_for_status()
-            resp_json = resp.json()
-            raw_text = resp_json.get("response", "").strip()
-            logger.info("Raw Ollama response (%s, attempt %d): %s", role, attempt, raw_text[:500])
-            if expect_json:
-                # Biểu thức chính quy mới: tìm khối JSON nằm giữa ```json và ``` hoặc chỉ ``` và ```
-                match = re.search(r"```(?:json)?\s*({[\s\S]*?})\s*```", raw_text)
-                candidate = ""
-                if match:
-                    candidate = match.group(1).strip()
-                else:
-                    # Fallback: nếu không có ```, thử tìm JSON đầu tiên trong chuỗi
-                    start_index = raw_text.find('{')
-                    if start_index != -1:
-                        # Tìm dấu ngoặc nhọn đóng tương ứng
-                        brace_count = 0
-                        json_end = -1
-                        for i, char in enumerate(raw_text[start_index:]):
-                            if char == '{':
-                                brace_count += 1
-                            elif char == '}':
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    json_end = start_index + i + 1
-                                    break
-                        if json_end != -1:
-                            candidate = raw_text[start_index:json_end]
-
-                if candidate:
-                    try:
-                        parsed = json.loads(candidate)
-                        return parsed
-                    except json.JSONDecodeError as e:
-                        logger.error("JSON parse failed after cleaning: %s. Raw candidate: %s", str(e), candidate[:300])
-                        return {"error": "failed_parse", "raw": raw_text}
-                else:
-                    logger.error("Could not extract any JSON from raw response. Raw: %s", raw_text[:300])
-                    return {"error": "no_json_found", "raw": raw_text}
-            else:
-                return raw_text
-        except ReadTimeout as e:
-            last_err = e
-            logger.warning("Ollama %s timeout (attempt %d/%d)", role, attempt, MAX_RETRIES)
-        except RequestException as e:
-            last_err = e
-            logger.error("Ollama %s request error: %s", role, str(e))
-            break
-
-    return {"error": "request_failed", "detail": str(last_err)}
+            return json.loads(candidate)
+        except json.JSONDecodeError as e:
+            logger.error("JSON parse failed after cleaning: %s. Raw candidate: %s", str(e), candidate[:300])
+            return {"error": "failed_parse", "raw": raw_text}
+    logger.error("Could not extract any JSON from raw response. Raw: %s", raw_text[:300])
+    return {"error": "no_json_found", "raw": raw_text}
+
+def query_ollama(model: str, role: str, user_input: str, expect_json: bool = True,
+                 system: str | None = None) -> dict | str:
+    path, payload = _build_ollama_request(model, role, user_input, system)
+    resp_json = OLLAMA.request(path, payload, label=role)
+    if "error" in resp_json:
+        return resp_json
+    raw_text = _response_text(resp_json).strip()
+    logger.info("Raw Ollama response (%s): %s", role, raw_text[:500])
+    return _parse_ollama_text(raw_text, expect_json)
+
+def get_async_client() -> httpx.AsyncClient:
+    return OLLAMA.async_client()
+
+async def close_async_client():
+    await OLLAMA.aclose()
+    OLLAMA.close()
+
+async def query_ollama_async(model: str, role: str, user_input: str, expect_json: bool = True,
+                             system: str | None = None) -> dict | str:
+    path, payload = _build_ollama_request(model, role, user_input, system)
+    resp_json = await OLLAMA.arequest(path, payload, label=role)
+    if "error" in resp_json:
+        return resp_json
+    raw_text = _response_text(resp_json).strip()
+    logger.info("Raw Ollama response (%s): %s", role, raw_text[:500])
+    return _parse_ollama_text(raw_text, expect_json)
+
+async def query_ollama_stream(model: str, role: str, user_input: str,
+                              system: str | None = None) -> AsyncIterator[str]:
+    """Gọi Ollama với stream=true, yield từng đoạn text ngay khi model sinh ra."""
+    path, payload = _build_ollama_request(model, role, user_input, system)
+    async for chunk in OLLAMA.astream(path, payload, label=role):
+        text = _response_text(chunk)
+        if text:
+            yield text
 
 
 # =========================
 # Schema Validation Agent
 # =========================
-def schema_validation_agent(plan: dict, catalog: dict) -> Tuple[bool, List[str]]:
+def schema_validation_agent(plan: dict, catalog: SchemaCatalog | dict) -> Tuple[bool, List[str]]:
     errors: List[str] = []
     if not plan or not isinstance(plan, dict):
         return False, ["Plan is empty or not dict."]
 
-    # Xây dựng index schema một cách chính xác
-    valid_columns_per_table = build_schema_index(catalog)
-    valid_tables = set(valid_columns_per_table.keys())
+    catalog = as_catalog(catalog)
+    valid_columns_per_table = catalog.columns
+    valid_tables = catalog.tables
 
     alias_to_table: Dict[str, str] = plan.get("aliases", {})
 
@@ -367,11 +416,12 @@ ALIAS_FIX_MAP = {
     "date": "dw.dim_date",
 }
 
-def normalize_plan(plan: dict, valid_tables: set, schema: dict) -> dict:
+def normalize_plan(plan: dict, valid_tables: set, schema: SchemaCatalog | dict) -> dict:
     if not plan or not isinstance(plan, dict):
         return plan
 
-    schema_index = build_schema_index(schema)
+    catalog = as_catalog(schema)
+    schema_index = catalog.columns
 
     aliases = plan.get("aliases") or {}
     new_aliases = {}
@@ -410,7 +460,7 @@ def normalize_plan(plan: dict, valid_tables: set, schema: dict) -> dict:
     # Chuyển filters thành điều kiện WHERE hợp lệ
     filters_raw = plan.get("filters", [])
     if filters_raw and isinstance(filters_raw, list) and filters_raw and isinstance(filters_raw[0], dict):
-        where_clause = filters_to_sql_where(filters_raw)
+        where_clause = filters_to_sql_where(filters_raw, catalog)
         plan["where_conditions"] = [where_clause] if where_clause else []
     else:
         plan["where_conditions"] = filters_raw
@@ -435,10 +485,10 @@ def normalize_plan(plan: dict, valid_tables: set, schema: dict) -> dict:
             if col.endswith("_id"):
                 prefix = col[:-3]
                 candidate_name = f"{prefix}_name"
-                best = find_best_column_match(table_name, candidate_name, schema_index)
+                best = catalog.find_column(table_name, candidate_name)
                 if best:
                     return f"{alias}.{best}"
-            best = find_best_column_match(table_name, col, schema_index)
+            best = catalog.find_column(table_name, col)
             if best:
                 return f"{alias}.{best}"
             return f"{alias}.{col}"
@@ -504,12 +554,22 @@ def postprocess_sql(sql: str) -> str:
 # =========================
 # Agents wrapper
 # =========================
-def query_deconstructor_agent(question: str) -> dict:
-    return query_ollama("mistral:7b", "deconstructor", question, expect_json=True)
+async def query_deconstructor_agent_async(question: str) -> dict:
+    return await query_ollama_async(DECONSTRUCTOR_MODEL, "deconstructor", question, expect_json=True)
 
-def query_planner_agent(plan_json: Any, schema: dict = None) -> str:
+def query_planner_agent(plan_json: Any, schema: SchemaCatalog | dict = None) -> str:
     plan_dict = json.loads(plan_json) if isinstance(plan_json, str) else plan_json
-    join_clause = intelligent_join_builder(plan_dict)
+    catalog = as_catalog(schema)
+    # Rollup dựng sẵn trả lời được plan → không cần star join. Rollup phải JOIN đúng các bảng
+    # star join sẽ JOIN: INNER JOIN bỏ các bài thiếu dòng dimension, nên bảng khác → kết quả khác.
+    routed = route_plan(plan_dict, catalog, star_join_aliases(plan_dict, catalog)) \
+        if catalog is not None and isinstance(plan_dict, dict) else None
+    if isinstance(plan_dict, dict):
+        plan_dict["rollup"] = routed[1] if routed else None
+    if routed:
+        annotate(rollup=routed[1])
+        return postprocess_sql(routed[0])
+    join_clause = intelligent_join_builder(plan_dict, catalog)
 
     select_clause = []
     metric = plan_dict.get("metric")
@@ -564,77 +624,121 @@ def query_planner_agent(plan_json: Any, schema: dict = None) -> str:
 # =========================
 # Pipeline
 # =========================
-def multi_agent_pipeline(question: str, schema: dict = None) -> Tuple[str, List[str], dict]:
-    # Step 1: Deconstructor
-    decon = query_deconstructor_agent(question)
+# Cache plan đã validate: câu hỏi lặp lại sẽ bỏ qua hoàn toàn Deconstructor
+PLAN_CACHE = PlanCache(preprocess=lambda q: preprocess_question(q))
+# Cache ngữ nghĩa: câu hỏi diễn đạt lại dùng lại plan cũ với literal được gán lại
+SEMANTIC_CACHE = SemanticCache()
+# Đếm số request theo đường sinh plan: plan_cache | rules | semantic_cache | llm
+PLAN_SOURCE_COUNTS: Counter = Counter()
+
+def _validate_plan(decon: dict, schema: SchemaCatalog = None) -> Tuple[dict | None, str | None, List[str]]:
     if "error" in decon:
-        return "-- PLAN_VALIDATION_ERROR: deconstructor_failed", [decon["error"]], None
+        return None, "-- PLAN_VALIDATION_ERROR: deconstructor_failed", [decon["error"]]
 
     # Step 2: Normalize - pass schema along
     if schema:
-        decon = normalize_plan(decon, {t["name"] for t in schema.get("tables", [])}, schema)
+        with span("normalize_plan"):
+            decon = normalize_plan(decon, schema.tables, schema)
 
     # Step 3: Validation
     if schema:
-        is_valid, plan_errors = schema_validation_agent(decon, schema)
+        with span("schema_validation") as sp:
+            is_valid, plan_errors = schema_validation_agent(decon, schema)
+            sp["valid"] = is_valid
         if not is_valid:
-            return f"-- PLAN_VALIDATION_ERROR: Schema validation failed -> {'; '.join(plan_errors)}", plan_errors, decon
+            return decon, f"-- PLAN_VALIDATION_ERROR: Schema validation failed -> {'; '.join(plan_errors)}", plan_errors
 
+    return decon, None, []
+
+def _plan_to_sql(decon: dict, schema: SchemaCatalog = None) -> Tuple[str, List[str], dict]:
     # Step 4: Planner → SQL (give schema so postprocessing can be smarter if needed)
-    sql_out = query_planner_agent(decon, schema=schema)
+    with span("query_planner"):
+        sql_out = query_planner_agent(decon, schema=schema)
     if not isinstance(sql_out, str):
         return "-- PLAN_VALIDATION_ERROR: planner_failed", ["planner_failed"], decon
 
     return sql_out, [], decon
 
+def _finish_pipeline(question: str, decon: dict, schema: SchemaCatalog = None) -> Tuple[Tuple[str, List[str], dict], dict | None]:
+    raw_plan = copy.deepcopy(decon) if isinstance(decon, dict) and "error" not in decon else None
+    plan, err_sql, errors = _validate_plan(decon, schema)
+    if err_sql:
+        return (err_sql, errors, plan), None
+    out = _plan_to_sql(plan, schema)
+    if schema and not out[1]:
+        PLAN_CACHE.put(question, out[2])
+        return out, raw_plan
+    return out, None
+
+def _from_semantic_cache(question: str, hit, schema: SchemaCatalog) -> Tuple[str, List[str], dict] | None:
+    if hit is None:
+        return None
+    rebound, info = hit
+    plan, err_sql, _ = _validate_plan(rebound, schema)
+    if err_sql:
+        logger.info("Semantic cache candidate rejected by validation: %s", info)
+        return None
+    logger.info("Semantic cache hit: %s", info)
+    PLAN_CACHE.put(question, plan)
+    return _plan_to_sql(plan, schema)
 
-    return sql_out, [], decon
-
-def corrector_agent(sql: str, error: str, schema_text: str, question: str, plan: dict) -> str | dict:
-    prompt = f"""
-Bạn là chuyên gia sửa SQL PostgreSQL. Nhiệm vụ của bạn là sửa câu SQL bị lỗi dựa trên thông tin được cung cấp.
-
-Câu hỏi của người dùng: "{question}"
-Schema các bảng: {schema_text}
-Logical Plan (ý định ban đầu): {json.dumps(plan, ensure_ascii=False, indent=2)}
-
-SQL bị lỗi:
-{sql}
-Lỗi từ database hoặc validator: "{error}"
-
-Phân tích lỗi và yêu cầu sửa:
-
-Đọc kỹ lỗi: Lỗi này có thể là do cột không tồn tại, sai tên bảng, hoặc sai logic GROUP BY.
-
-Đối chiếu với Plan và Schema: Kiểm tra xem SQL có tuân thủ đúng các cột trong schema và ý định trong plan không. Ví dụ: plan yêu cầu 'group by' cột A, nhưng SQL lại thiếu.
-
-Sửa SQL: Viết lại câu lệnh SQL SELECT cho đúng. Đảm bảo nó trả lời được câu hỏi ban đầu.
-
-Chỉ trả về SQL: Kết quả cuối cùng chỉ chứa mã SQL, kết thúc bằng dấu chấm phẩy, không có giải thích hay ```sql.
-
-Ví dụ sửa lỗi 'Non-aggregated select column not in GROUP BY':
-
-Lỗi: Cột 'da.source_name' phải xuất hiện trong mệnh đề GROUP BY hoặc được sử dụng trong một hàm tổng hợp.
-
-Sửa: Thêm 'da.source_name' vào mệnh đề GROUP BY.
+def _from_rules(question: str, schema: SchemaCatalog) -> Tuple[str, List[str], dict] | None:
+    parsed = parse_question(preprocess_question(question))
+    if parsed is None:
+        return None
+    plan, err_sql, errors = _validate_plan(parsed, schema)
+    if err_sql:
+        logger.warning("Rule-based plan rejected, falling back to LLM: %s", errors)
+        return None
+    PLAN_CACHE.put(question, plan)
+    return _plan_to_sql(plan, schema)
+
+def _mark_source(out: Tuple[str, List[str], dict], source: str) -> Tuple[str, List[str], dict]:
+    PLAN_SOURCE_COUNTS[source] += 1
+    if isinstance(out[2], dict):
+        out[2]["plan_source"] = source
+    return out
+
+def _fast_paths(question: str, schema: SchemaCatalog) -> Tuple[str, List[str], dict] | None:
+    cached = PLAN_CACHE.get(question)
+    if cached is not None:
+        return _mark_source(_plan_to_sql(cached, schema), "plan_cache")
+    out = _from_rules(question, schema)
+    if out is not None:
+        return _mark_source(out, "rules")
+    return None
 
-Bây giờ, hãy sửa câu SQL trên.
-"""
-    # use simple prompt mode: pass prompt text and request parsed JSON only if the model returns JSON
-    resp = query_ollama(prompt, model="mistral:7b", expect_json=False)
-    # if model returned a JSON-like dict (rare here), return it as-is
-    if isinstance(resp, dict):
-        return resp
-    # else resp is text; extract SQL if possible
-    txt = str(resp).strip()
-    txt = re.sub(r"^```(?:sql)?", "", txt, flags=re.IGNORECASE).strip("`\n ")
-    m = re.search(r"(SELECT[\s\S]*?;)", txt, re.IGNORECASE)
-    if m:
-        return m.group(1).strip()
-    if txt.upper().startswith("SELECT"):
-        return txt
-    # fallback
-    return {"error": "cannot_fix", "reason": "LLM did not produce valid SQL"}
+async def multi_agent_pipeline_async(question: str, schema: SchemaCatalog | dict = None) -> Tuple[str, List[str], dict]:
+    schema = as_catalog(schema)
+    with span("preprocess"):
+        question = preprocess_question(question)
+    if schema:
+        with span("plan_lookup") as sp:
+            out = _fast_paths(question, schema)
+            if out is None:
+                # encode MiniLM là CPU-bound → chạy ngoài event loop
+                hit = await asyncio.to_thread(SEMANTIC_CACHE.lookup, question)
+                out = _from_semantic_cache(question, hit, schema)
+                if out is not None:
+                    out = _mark_source(out, "semantic_cache")
+            sp["hit"] = out[2].get("plan_source") if out is not None and isinstance(out[2], dict) else None
+        if out is not None:
+            return out
+    # Step 1: Deconstructor (chỉ bước gọi LLM là I/O, các bước sau là CPU nhẹ)
+    with span("deconstructor"):
+        decon = await query_deconstructor_agent_async(question)
+    out, raw_plan = _finish_pipeline(question, decon, schema)
+    if raw_plan is not None:
+        await asyncio.to_thread(SEMANTIC_CACHE.add, question, raw_plan, out[2], out[0])
+    return _mark_source(out, "llm")
+
+def plan_source_stats() -> Dict[str, Any]:
+    total = sum(PLAN_SOURCE_COUNTS.values())
+    return {
+        "total": total,
+        "by_source": dict(PLAN_SOURCE_COUNTS),
+        "without_llm_share": round(1 - PLAN_SOURCE_COUNTS["llm"] / total, 4) if total else 0.0,
+    }
 
 def preprocess_question(q: str) -> str:
     return q.strip()
\ No newline at end of file
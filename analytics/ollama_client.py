@@ -0,0 +1,340 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ReadTimeout, RequestException
+
+from .tracing import record_llm
+
+logger = logging.getLogger("analytics.ollama_client")
+
+# =========================
+# Config
+# =========================
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://host.docker.internal:11434")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+# Thời gian Ollama giữ model trong RAM/VRAM sau request cuối ("5m", "1h", "-1" = giữ mãi)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Context window gửi kèm mọi request (0 = dùng mặc định của model). Phải đủ chứa system prompt,
+# nếu không Ollama cắt đầu prompt và KV cache của prefix không dùng lại được.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") not in ("0", "false", "False", "")
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "300"))
+# Ghi lại mọi cặp request/response (JSONL) để fake_ollama phát lại; rỗng = tắt
+OLLAMA_RECORD_FILE = os.getenv("OLLAMA_RECORD_FILE", "")
+
+_SUMMARIZER_MODEL = os.getenv("SUMMARIZER_MODEL", "mistral:7b")
+OLLAMA_MODELS: Dict[str, str] = {
+    "deconstructor": os.getenv("DECONSTRUCTOR_MODEL", "mistral:7b"),
+    "summarizer": _SUMMARIZER_MODEL,
+    "corrector": os.getenv("CORRECTOR_MODEL", _SUMMARIZER_MODEL),
+}
+
+
+# Semaphore giới hạn số lời gọi Ollama async đồng thời; đặt bằng call_limit() (vd. cho /ask/batch)
+_CALL_LIMIT: ContextVar[asyncio.Semaphore | None] = ContextVar("ollama_call_limit", default=None)
+
+
+@contextlib.contextmanager
+def call_limit(max_calls: int):
+    """Mọi task tạo ra trong khối with dùng chung tối đa `max_calls` lời gọi Ollama cùng lúc."""
+    token = _CALL_LIMIT.set(asyncio.Semaphore(max(1, max_calls)))
+    try:
+        yield
+    finally:
+        _CALL_LIMIT.reset(token)
+
+
+@contextlib.asynccontextmanager
+async def _call_slot():
+    sem = _CALL_LIMIT.get()
+    if sem is None:
+        yield
+        return
+    async with sem:
+        yield
+
+
+def normalize_host(host: str) -> str:
+    """docker-compose đặt OLLAMA_HOST dạng 'host:port' (không có scheme) như CLI của Ollama."""
+    host = (host or "").strip().rstrip("/")
+    if not host.startswith(("http://", "https://")):
+        host = f"http://{host}"
+    return host
+
+
+def _model_key(name: str) -> str:
+    # Ollama tự thêm tag ':latest' khi không chỉ định
+    return name if ":" in name else f"{name}:latest"
+
+
+def prompt_key(path: str, payload: dict) -> str:
+    """Hash của phần quyết định output (model + prompt/messages); bỏ qua keep_alive, options, stream."""
+    body = {k: payload.get(k) for k in ("model", "messages", "prompt", "system", "format")}
+    body["model"] = _model_key(body["model"] or "")
+    body["path"] = path
+    raw = json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class OllamaClient:
+    """
+    Client dùng chung cho Ollama: requests.Session (pool keep-alive) cho đường sync,
+    httpx.AsyncClient cho mỗi event loop cho đường async. Mọi request đều gửi kèm
+    `keep_alive` để model không bị unload giữa các câu hỏi.
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, models: Dict[str, str] | None = None,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE, timeout: float = OLLAMA_TIMEOUT,
+                 max_retries: int = OLLAMA_MAX_RETRIES, max_connections: int = OLLAMA_MAX_CONNECTIONS,
+                 num_ctx: int = OLLAMA_NUM_CTX, record_file: str = OLLAMA_RECORD_FILE):
+        self.host = normalize_host(host)
+        self.models = dict(models or OLLAMA_MODELS)
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.max_retries = max(1, max_retries)
+        self.max_connections = max_connections
+        self.num_ctx = num_ctx
+        self.record_file = record_file
+
+        self._record_lock = threading.Lock()
+        self._session: requests.Session | None = None
+        self._async_client: httpx.AsyncClient | None = None
+        self._async_loop = None
+        self._warmup_task: asyncio.Task | None = None
+        # model -> {"loaded": bool, "load_s": float | None, "error": str | None}
+        self.warmup: Dict[str, Dict] = {}
+
+    def url(self, path: str) -> str:
+        return f"{self.host}{path}"
+
+    def with_keep_alive(self, payload: dict) -> dict:
+        """Thêm keep_alive và num_ctx; num_ctx phải giống nhau ở mọi request, đổi giá trị là Ollama load lại model."""
+        if self.keep_alive and "keep_alive" not in payload:
+            payload = {**payload, "keep_alive": self.keep_alive}
+        if self.num_ctx > 0:
+            options = payload.get("options") or {}
+            if "num_ctx" not in options:
+                payload = {**payload, "options": {**options, "num_ctx": self.num_ctx}}
+        return payload
+
+    # ----- transports -----
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            self._session = s
+        return self._session
+
+    def async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client.is_closed or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    async def aclose(self):
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+        self._async_client = None
+        self._async_loop = None
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    # ----- /api/chat, /api/generate -----
+    def log_timings(self, label: str, resp_json: dict):
+        """
+        Ghi lại thống kê Ollama trả về. prompt_eval_count nhỏ (chỉ bằng phần user message)
+        nghĩa là system prompt đã được lấy từ KV cache thay vì đánh giá lại.
+        """
+        if "prompt_eval_count" not in resp_json and "eval_duration" not in resp_json:
+            return
+        ns = 1e-6
+        logger.info(
+            "Ollama %s: prompt_eval_count=%s prompt_eval_ms=%.1f eval_count=%s eval_ms=%.1f total_ms=%.1f",
+            label,
+            resp_json.get("prompt_eval_count", 0),
+            resp_json.get("prompt_eval_duration", 0) * ns,
+            resp_json.get("eval_count", 0),
+            resp_json.get("eval_duration", 0) * ns,
+            resp_json.get("total_duration", 0) * ns,
+        )
+        record_llm(label, resp_json)
+
+    def record(self, path: str, payload: dict, resp_json: dict):
+        """Nối một dòng {key, path, model, request, response} vào OLLAMA_RECORD_FILE."""
+        if not self.record_file:
+            return
+        line = json.dumps({
+            "key": prompt_key(path, payload),
+            "path": path,
+            "model": payload.get("model"),
+            "request": {k: payload[k] for k in ("messages", "prompt", "system") if k in payload},
+            "response": resp_json,
+        }, ensure_ascii=False)
+        try:
+            with self._record_lock, open(self.record_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning("Cannot record Ollama response to %s: %s", self.record_file, e)
+
+    def request(self, path: str, payload: dict, label: str = "") -> dict:
+        """POST (stream=false), retry khi timeout. Lỗi trả về dict có key 'error'."""
+        payload = self.with_keep_alive(payload)
+        last_err = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                resp = self.session.post(self.url(path), json=payload, timeout=self.timeout)
+                resp.raise_for_status()
+                resp_json = resp.json()
+                self.log_timings(label, resp_json)
+                self.record(path, payload, resp_json)
+                return resp_json
+            except ValueError as e:
+                last_err = e
+                logger.error("Ollama %s returned malformed JSON: %s", label, e)
+                break
+            except ReadTimeout as e:
+                last_err = e
+                logger.warning("Ollama %s timeout (attempt %d/%d)", label, attempt, self.max_retries)
+            except RequestException as e:
+                last_err = e
+                logger.error("Ollama %s request error: %s", label, str(e))
+                break
+        return {"error": "request_failed", "detail": str(last_err)}
+
+    async def arequest(self, path: str, payload: dict, label: str = "") -> dict:
+        payload = self.with_keep_alive(payload)
+        client = self.async_client()
+        last_err = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with _call_slot():
+                    resp = await client.post(self.url(path), json=payload)
+                resp.raise_for_status()
+                resp_json = resp.json()
+                self.log_timings(label, resp_json)
+                self.record(path, payload, resp_json)
+                return resp_json
+            except ValueError as e:
+                last_err = e
+                logger.error("Ollama %s returned malformed JSON: %s", label, e)
+                break
+            except httpx.TimeoutException as e:
+                last_err = e
+                logger.warning("Ollama %s timeout (attempt %d/%d)", label, attempt, self.max_retries)
+            except httpx.HTTPError as e:
+                last_err = e
+                logger.error("Ollama %s request error: %s", label, str(e))
+                break
+        return {"error": "request_failed", "detail": str(last_err)}
+
+    async def astream(self, path: str, payload: dict, label: str = "") -> AsyncIterator[dict]:
+        """POST với stream=true, yield từng chunk NDJSON đã parse."""
+        payload = self.with_keep_alive({**payload, "stream": True})
+        client = self.async_client()
+        parts: List[str] = []
+        async with _call_slot(), client.stream("POST", self.url(path), json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Malformed Ollama stream chunk (%s): %s", label, line[:200])
+                    continue
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                if self.record_file:
+                    parts.append((chunk.get("message") or {}).get("content") or chunk.get("response") or "")
+                yield chunk
+                if chunk.get("done"):
+                    self.log_timings(label, chunk)
+                    if self.record_file:
+                        # ghi lại như một response không stream
+                        text = "".join(parts)
+                        full = {**chunk, "message": {"role": "assistant", "content": text}} \
+                            if path == "/api/chat" else {**chunk, "response": text}
+                        self.record(path, payload, full)
+                    break
+
+    # ----- warm-up / readiness -----
+    def required_models(self) -> List[str]:
+        return sorted(set(self.models.values()))
+
+    async def warm_up(self) -> Dict[str, Dict]:
+        """
+        Nạp trước mọi model pipeline dùng: /api/generate không có prompt chỉ load model
+        vào bộ nhớ (kèm keep_alive) mà không sinh token.
+        """
+        client = self.async_client()
+        for model in self.required_models():
+            t0 = time.perf_counter()
+            try:
+                resp = await client.post(
+                    self.url("/api/generate"),
+                    json=self.with_keep_alive({"model": model}),
+                    timeout=OLLAMA_WARMUP_TIMEOUT,
+                )
+                resp.raise_for_status()
+                self.warmup[model] = {"loaded": True, "load_s": round(time.perf_counter() - t0, 3), "error": None}
+                logger.info("Ollama model %s loaded in %.1fs", model, time.perf_counter() - t0)
+            except httpx.HTTPError as e:
+                self.warmup[model] = {"loaded": False, "load_s": None, "error": str(e) or type(e).__name__}
+                logger.warning("Ollama warm-up failed for %s: %s", model, e)
+        return self.warmup
+
+    def start_warm_up(self):
+        """Chạy warm-up nền (không chặn startup); bỏ qua nếu đang chạy."""
+        if self._warmup_task is None or self._warmup_task.done():
+            self._warmup_task = asyncio.get_running_loop().create_task(self.warm_up())
+
+    async def loaded_models(self) -> List[str]:
+        resp = await self.async_client().get(self.url("/api/ps"), timeout=5.0)
+        resp.raise_for_status()
+        return [m.get("name") or m.get("model") for m in resp.json().get("models", [])]
+
+    async def readiness(self) -> Dict:
+        """Sẵn sàng khi mọi model cần thiết đang nằm trong bộ nhớ của Ollama (theo /api/ps)."""
+        required = self.required_models()
+        try:
+            loaded = {_model_key(m) for m in await self.loaded_models() if m}
+        except (httpx.HTTPError, ValueError) as e:
+            return {"ready": False, "host": self.host, "keep_alive": self.keep_alive,
+                    "error": str(e) or type(e).__name__,
+                    "models": {m: False for m in required}, "warmup": self.warmup}
+        status = {m: _model_key(m) in loaded for m in required}
+        ready = all(status.values())
+        # model đã bị unload (hết keep_alive / Ollama restart) → nạp lại ở nền
+        if not ready and OLLAMA_WARMUP:
+            self.start_warm_up()
+        return {"ready": ready, "host": self.host, "keep_alive": self.keep_alive,
+                "models": status, "warmup": self.warmup}
+
+
+OLLAMA = OllamaClient()
@@ -0,0 +1,199 @@
+# onnx_encoder.py
+# Backend encoder ONNX Runtime (int8) cho MiniLM: không cần torch lúc chạy, ít RAM và nhanh hơn
+# trên CPU. Bật bằng ENCODER_BACKEND=onnx sau khi export:
+#
+#   python -m analytics.onnx_encoder export    # SentenceTransformer -> ONNX -> quantize int8
+#   python -m analytics.onnx_encoder check     # so embedding với backend PyTorch (cosine)
+#
+# Thư mục export gồm model.onnx (int8), tokenizer.json và encoder.json (model gốc, pooling, max_seq).
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+logger = logging.getLogger("analytics.onnx_encoder")
+
+# =========================
+# Config
+# =========================
+ENCODER_ONNX_DIR = os.getenv(
+    "ENCODER_ONNX_DIR", os.path.join(os.getenv("MODEL_DIR", "models"), "minilm-onnx-int8")
+)
+# 0 = để ONNX Runtime tự chọn (số core vật lý)
+ENCODER_ONNX_THREADS = int(os.getenv("ENCODER_ONNX_THREADS", "0"))
+# Ngưỡng cosine tối thiểu giữa ONNX và PyTorch cho `check`
+ENCODER_ONNX_MIN_COSINE = float(os.getenv("ENCODER_ONNX_MIN_COSINE", "0.98"))
+
+MODEL_FILE = "model.onnx"
+META_FILE = "encoder.json"
+
+# Câu mẫu cho `check` khi không truyền --texts
+SAMPLE_TEXTS = [
+    "Giá vàng hôm nay tăng mạnh",
+    "Đội tuyển Việt Nam thắng Thái Lan 2-0",
+    "Bộ Y tế khuyến cáo phòng chống sốt xuất huyết",
+    "Ngân hàng Nhà nước điều chỉnh lãi suất điều hành",
+    "Trí tuệ nhân tạo thay đổi ngành giáo dục",
+    "Tác giả nào viết nhiều bài về the-thao nhất?",
+    "COVID-19",
+    "the-thao",
+]
+
+
+def _session(path: str, threads: int):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError("ENCODER_BACKEND=onnx needs the onnxruntime package") from e
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+
+class OnnxEncoder:
+    """
+    Cùng giao diện với SentenceTransformer ở những chỗ repo dùng: encode(texts, batch_size)
+    và get_sentence_embedding_dimension(). Pooling = mean theo attention mask, như model gốc.
+    """
+
+    def __init__(self, model_dir: str = ENCODER_ONNX_DIR, threads: int = ENCODER_ONNX_THREADS):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.max_seq_length = int(self.meta.get("max_seq_length", 128))
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=int(self.meta.get("pad_token_id", 1)),
+                                      pad_token=self.meta.get("pad_token", "<pad>"))
+        self.session = _session(os.path.join(model_dir, MODEL_FILE), threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dim = int(self.meta.get("dimension", 0)) or None
+
+    def encode(self, texts, batch_size: int = 32, **_) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        out = []
+        for i in range(0, len(texts), max(1, batch_size)):
+            out.append(self._encode_batch(texts[i:i + batch_size]))
+        vecs = np.concatenate(out) if out else np.zeros((0, self.dim or 0), dtype=np.float32)
+        return vecs[0] if single else vecs
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        return mean_pool(hidden, mask)
+
+    def get_sentence_embedding_dimension(self) -> int | None:
+        return self.dim
+
+
+def mean_pool(hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    m = mask[..., None].astype(np.float32)
+    return ((hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)).astype(np.float32)
+
+
+# =========================
+# Export / check
+# =========================
+def export(model_name: str, out_dir: str = ENCODER_ONNX_DIR, quantize: bool = True, opset: int = 14) -> str:
+    """Export transformer của SentenceTransformer sang ONNX (trục batch/seq động), rồi quantize int8."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    hf_model, tokenizer = st[0].auto_model.eval(), st.tokenizer
+    os.makedirs(out_dir, exist_ok=True)
+    sample = tokenizer(["xin chào"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    fp32_path = os.path.join(out_dir, "model_fp32.onnx")
+    t0 = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model, tuple(sample[n] for n in names), fp32_path,
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names},
+                          "last_hidden_state": {0: "batch", 1: "seq"}},
+            opset_version=opset,
+        )
+    logger.info("Exported %s to %s in %.1fs", model_name, fp32_path, time.perf_counter() - t0)
+
+    out_path = os.path.join(out_dir, MODEL_FILE)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        # dynamic quantization: weight int8, activation quantize lúc chạy; không cần dữ liệu hiệu chỉnh
+        quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, out_path)
+
+    tokenizer.save_pretrained(out_dir)
+    meta = {"model": model_name, "quantized": quantize, "pooling": "mean",
+            "max_seq_length": st.get_max_seq_length(), "dimension": st.get_sentence_embedding_dimension(),
+            "pad_token": tokenizer.pad_token, "pad_token_id": tokenizer.pad_token_id}
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    logger.info("Wrote %s (%.1f MiB)", out_path, os.path.getsize(out_path) / 2**20)
+    return out_path
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return (a * b).sum(axis=1)
+
+
+def check(model_name: str, model_dir: str = ENCODER_ONNX_DIR, texts: List[str] | None = None,
+          min_cosine: float = ENCODER_ONNX_MIN_COSINE) -> Dict:
+    """So embedding ONNX với PyTorch trên cùng các câu: cosine từng câu và sai số tuyệt đối lớn nhất."""
+    from sentence_transformers import SentenceTransformer
+
+    texts = texts or SAMPLE_TEXTS
+    ref = np.asarray(SentenceTransformer(model_name, device="cpu").encode(texts), dtype=np.float32)
+    got = OnnxEncoder(model_dir).encode(texts)
+    cos = cosine_rows(ref, got)
+    return {"texts": len(texts), "min_cosine": round(float(cos.min()), 5),
+            "mean_cosine": round(float(cos.mean()), 5), "max_abs_diff": round(float(np.abs(ref - got).max()), 5),
+            "threshold": min_cosine, "ok": bool(cos.min() >= min_cosine)}
+
+
+def main():
+    import argparse
+    import sys
+
+    from .encoder import EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description="Export / check the int8 ONNX MiniLM encoder")
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--out", default=ENCODER_ONNX_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="giữ fp32 (để so sánh)")
+    parser.add_argument("--texts", help="file text, mỗi dòng một câu (mặc định: câu mẫu)")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+
+    if args.command == "export":
+        export(args.model, args.out, quantize=not args.no_quantize)
+        return
+    texts = None
+    if args.texts:
+        with open(args.texts, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    out = check(args.model, args.out, texts)
+    print(json.dumps(out))
+    sys.exit(0 if out["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
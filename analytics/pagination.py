@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+logger = logging.getLogger("analytics.pagination")
+
+# =========================
+# Config
+# =========================
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "200"))
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "100000"))
+RESULT_TOKEN_TTL = int(os.getenv("RESULT_TOKEN_TTL", "3600"))
+# Token chứa SQL → phải ký để client không tự chèn SQL tuỳ ý vào /results/{token}.
+# Không đặt biến môi trường thì mỗi process tự sinh secret (token mất hiệu lực khi restart, và worker
+# khác không đọc được token của nhau): check_secret() chặn lúc khởi động nếu chạy nhiều worker.
+RESULT_TOKEN_SECRET = os.getenv("RESULT_TOKEN_SECRET", "")
+_SECRET = (RESULT_TOKEN_SECRET or os.urandom(32).hex()).encode()
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def check_secret():
+    """Gọi lúc khởi động API: nhiều worker (WEB_CONCURRENCY của uvicorn/gunicorn) bắt buộc có secret chung."""
+    if RESULT_TOKEN_SECRET:
+        return
+    workers = int(os.getenv("WEB_CONCURRENCY", "1") or "1")
+    if workers > 1:
+        raise RuntimeError(f"RESULT_TOKEN_SECRET must be set when running {workers} workers: "
+                           "a token signed by one worker would be rejected by the others")
+    logger.warning("RESULT_TOKEN_SECRET is not set; continuation tokens are signed with a per-process key "
+                   "and stop working after a restart")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def encode_token(sql: str, offset: int, page_size: int) -> str:
+    body = json.dumps({"sql": sql, "offset": offset, "page_size": page_size,
+                       "exp": int(time.time()) + RESULT_TOKEN_TTL}, separators=(",", ":")).encode()
+    sig = hmac.new(_SECRET, body, hashlib.sha256).digest()[:16]
+    return f"{_b64(body)}.{_b64(sig)}"
+
+
+def decode_token(token: str) -> Dict:
+    try:
+        body_s, sig_s = token.split(".", 1)
+        body = _unb64(body_s)
+        sig = _unb64(sig_s)
+    except (ValueError, TypeError):
+        raise InvalidToken("Malformed continuation token")
+    expected = hmac.new(_SECRET, body, hashlib.sha256).digest()[:16]
+    if not hmac.compare_digest(sig, expected):
+        raise InvalidToken("Invalid continuation token signature")
+    data = json.loads(body)
+    if data.get("exp", 0) < time.time():
+        raise InvalidToken("Continuation token expired")
+    return data
+
+
+def build_page(sql: str, columns: list, rows: list, offset: int, page_size: int, total: int) -> Dict:
+    """Kết quả một trang: rows + tổng số dòng (có thể bị chặn bởi RESULT_MAX_ROWS) + token trang tiếp."""
+    end = offset + len(rows)
+    has_more = end < total and end < RESULT_MAX_ROWS
+    return {
+        "columns": columns,
+        "rows": rows,
+        "offset": offset,
+        "total_rows": total,
+        "total_capped": total >= RESULT_MAX_ROWS,
+        "has_more": has_more,
+        "next_token": encode_token(sql, end, page_size) if has_more else None,
+    }
@@ -0,0 +1,117 @@
+import copy
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from .catalog import SchemaCatalog, get_catalog
+
+logger = logging.getLogger("analytics.plan_cache")
+
+# =========================
+# Config
+# =========================
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "3600"))
+
+
+def fold_question(q: str) -> str:
+    """Chuẩn hoá câu hỏi để so khớp chính xác: gộp khoảng trắng, chữ thường, bỏ dấu tiếng Việt."""
+    if not q:
+        return ""
+    s = q.casefold().replace("đ", "d")
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = re.sub(r"\s+", " ", s).strip()
+    return s.rstrip(" ?.!")
+
+
+class PlanCache:
+    """
+    LRU + TTL cache cho logical plan đã qua normalize_plan và schema_validation_agent.
+    Key = (digest của catalog hiện hành, câu hỏi đã fold). Khi get_catalog() nạp lại
+    semantic_model.yaml với nội dung khác, digest đổi theo và toàn bộ cache bị xoá.
+    """
+
+    def __init__(self, maxsize: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL,
+                 catalog: Callable[[], SchemaCatalog] = get_catalog,
+                 preprocess: Callable[[str], str] | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.catalog = catalog
+        self.preprocess = preprocess or (lambda q: q)
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_hash = ""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _current_schema_hash(self) -> str:
+        try:
+            new_hash = self.catalog().hash
+        except OSError:
+            return self._schema_hash
+        if new_hash != self._schema_hash:
+            if self._schema_hash:
+                logger.info("Semantic model changed (%s -> %s); clearing plan cache", self._schema_hash, new_hash)
+                self._data.clear()
+                self.invalidations += 1
+            self._schema_hash = new_hash
+        return self._schema_hash
+
+    def make_key(self, question: str) -> tuple:
+        return (self._current_schema_hash(), fold_question(self.preprocess(question)))
+
+    def get(self, question: str) -> Dict | None:
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            key = self.make_key(question)
+            item = self._data.get(key)
+            if item is not None:
+                stored_at, plan = item
+                if self.ttl and time.monotonic() - stored_at > self.ttl:
+                    del self._data[key]
+                    item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(plan)
+
+    def put(self, question: str, plan: Dict):
+        if self.maxsize <= 0 or not plan:
+            return
+        with self._lock:
+            key = self.make_key(question)
+            self._data[key] = (time.monotonic(), copy.deepcopy(plan))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "schema_hash": self._schema_hash,
+            }
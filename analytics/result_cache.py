@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import re
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import psycopg2
+import sqlparse
+
+logger = logging.getLogger("analytics.result_cache")
+
+# =========================
+# Config
+# =========================
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "512"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "900"))
+RESULT_CACHE_CHANNEL = os.getenv("RESULT_CACHE_CHANNEL", "warehouse_loaded")
+
+_TABLE_RE = re.compile(r"\b(dw\.[a-z_][a-z0-9_]*)\b")
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Bỏ comment, chuẩn hoá keyword về chữ thường và gộp khoảng trắng (không đụng vào literal)."""
+    if not sql:
+        return ""
+    txt = sqlparse.format(sql, strip_comments=True, keyword_case="lower")
+    parts = re.split(r"('(?:[^']|'')*')", txt)
+    out = []
+    for i, p in enumerate(parts):
+        if i % 2 == 1:
+            out.append(p)
+        else:
+            p = re.sub(r"\s+", " ", p)
+            p = re.sub(r"\s*([(),=<>])\s*", r"\1", p)
+            out.append(p)
+    return "".join(out).strip().rstrip(";").strip()
+
+
+def _estimate_bytes(result: Dict) -> int:
+    try:
+        return len(json.dumps(result, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class ResultCache:
+    """
+    Cache kết quả SQL theo SQL đã canonical hoá, giới hạn theo số entry và tổng byte.
+    Bị xoá khi ETL gửi NOTIFY trên RESULT_CACHE_CHANNEL (payload rỗng → xoá hết,
+    payload là tên bảng, ví dụ 'dw.fact_articles' → chỉ xoá các truy vấn dùng bảng đó).
+    TTL là phương án dự phòng khi listener mất kết nối.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.last_invalidation: float | None = None
+        self._listener: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    # ----- cache ops -----
+    def get(self, sql: str) -> Tuple[Dict, float] | None:
+        if self.max_entries <= 0:
+            return None
+        key = canonicalize_sql(sql)
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                stored_at, result, size, _ = item
+                age = time.time() - stored_at
+                if self.ttl and age > self.ttl:
+                    self._drop(key)
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return result, age
+            self.misses += 1
+            return None
+
+    def contains(self, sql: str) -> bool:
+        """Kiểm tra có entry còn hạn hay không (không tính vào hit/miss)."""
+        if self.max_entries <= 0:
+            return False
+        key = canonicalize_sql(sql)
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not (self.ttl and time.time() - item[0] > self.ttl)
+
+    def put(self, sql: str, result: Dict):
+        if self.max_entries <= 0 or result is None:
+            return
+        key = canonicalize_sql(sql)
+        size = _estimate_bytes(result)
+        if size > self.max_bytes:
+            return
+        tables = frozenset(_TABLE_RE.findall(key))
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.time(), result, size, tables)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def invalidate(self, table: str | None = None):
+        with self._lock:
+            if table:
+                table = table.strip().lower()
+                for key in [k for k, v in self._data.items() if table in v[3]]:
+                    self._drop(key)
+            else:
+                self._data.clear()
+                self._bytes = 0
+            self.invalidations += 1
+            self.last_invalidation = time.time()
+        logger.info("Result cache invalidated (%s)", table or "all")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "listening": bool(self._listener and self._listener.is_alive()),
+            }
+
+    # ----- LISTEN/NOTIFY -----
+    def start_listener(self, db_config: Dict, channel: str = RESULT_CACHE_CHANNEL):
+        if self._listener and self._listener.is_alive():
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(
+            target=self._listen_loop, args=(dict(db_config), channel), name="result-cache-listener", daemon=True
+        )
+        self._listener.start()
+
+    def stop_listener(self):
+        self._stop.set()
+
+    def _listen_loop(self, db_config: Dict, channel: str):
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**db_config)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {psycopg2.extensions.quote_ident(channel, cur)};")
+                logger.info("Result cache listening on channel '%s'", channel)
+                # Có thể đã bỏ lỡ NOTIFY trong lúc mất kết nối → xoá để an toàn
+                if backoff > 1.0:
+                    self.invalidate()
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        self.invalidate(n.payload or None)
+            except Exception as e:
+                logger.warning("Result cache listener error: %s (retry in %.0fs)", e, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
@@ -0,0 +1,365 @@
+# rollups.py
+# Bảng tổng hợp sẵn (materialized view) khai báo trong semantic_model.yaml:
+#
+#   rollups:
+#     - name: dw.rollup_topic_month
+#       dimensions: [dt.topic_name, dd.year, dd.month]
+#       measures: [word_count, read_time]
+#
+# Mỗi rollup lưu article_count = COUNT(*) và với mỗi measure: sum_/cnt_/min_/max_<col>.
+# Planner trả lời plan từ rollup nhỏ nhất chứa đủ dimension/filter/measure và JOIN đúng các bảng
+# star join sẽ JOIN, thay vì star join;
+# AVG được tính lại bằng SUM(sum_x) / SUM(cnt_x) (trung bình của trung bình là sai).
+#
+#   python -m analytics.rollups build [--rebuild]   # tạo MV + unique index
+#   python -m analytics.rollups refresh              # REFRESH ... CONCURRENTLY + NOTIFY result cache
+#   python -m analytics.rollups status
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import psycopg2
+
+logger = logging.getLogger("analytics.rollups")
+
+# =========================
+# Config
+# =========================
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") not in ("0", "false", "False", "")
+# Bao lâu (s) kiểm tra lại rollup nào đã được build trên DB
+ROLLUP_CHECK_INTERVAL = float(os.getenv("ROLLUP_CHECK_INTERVAL", "300"))
+
+ROLLUP_ALIAS = "r"
+# Gộp lại từ các cột đã lưu trong rollup: metric -> biểu thức
+_REAGG = {
+    "sum": "SUM({r}.sum_{m})::bigint",
+    "avg": "SUM({r}.sum_{m})::numeric / NULLIF(SUM({r}.cnt_{m}), 0)",
+    "min": "MIN({r}.min_{m})",
+    "max": "MAX({r}.max_{m})",
+}
+_COUNT_EXPR = "COALESCE(SUM({r}.article_count), 0)::bigint"
+
+_REF_RE = re.compile(r"\b([a-z_][a-z0-9_]*)\.([a-z_][a-z0-9_]*)\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"\b[a-z_][a-z0-9_.]*\b", re.IGNORECASE)
+_LITERAL_RE = re.compile(r"('(?:[^']|'')*')")
+# Từ khoá được phép trong điều kiện WHERE khi viết lại lên rollup
+_WHERE_WORDS = {"and", "or", "not", "in", "like", "ilike", "is", "null", "between", "true", "false"}
+
+
+class Rollup:
+    """Một rollup đã khai báo: dimension (alias.cột của star schema) → cột của MV."""
+
+    def __init__(self, name: str, dimensions: List[str], measures: List[str], fact_table: str,
+                 fact_alias: str, joins: Dict[str, str], est_rows: int | None = None):
+        self.name = name
+        self.dimensions = [d.strip().lower() for d in dimensions]
+        self.measures = [m.strip().lower().split(".")[-1] for m in measures]
+        self.fact_table = fact_table
+        self.fact_alias = fact_alias
+        self.joins = joins
+        self.est_rows = est_rows
+        # tên cột trong MV: tên cột gốc, thêm tiền tố alias nếu bị trùng
+        bare = [d.split(".")[-1] for d in self.dimensions]
+        self.dim_columns = {
+            d: (b if bare.count(b) == 1 else d.replace(".", "_")) for d, b in zip(self.dimensions, bare)
+        }
+
+    @property
+    def joined_aliases(self) -> frozenset:
+        """Alias dimension được INNER JOIN khi build (chỉ các bảng có trong dimensions)."""
+        return frozenset(d.split(".")[0] for d in self.dimensions) - {self.fact_alias}
+
+    @property
+    def columns(self) -> List[str]:
+        cols = list(self.dim_columns.values()) + ["article_count"]
+        for m in self.measures:
+            cols += [f"sum_{m}", f"cnt_{m}", f"min_{m}", f"max_{m}"]
+        return cols
+
+    def select_sql(self) -> str:
+        fa = self.fact_alias
+        items = [f"{d} AS {c}" for d, c in self.dim_columns.items()] + ["COUNT(*) AS article_count"]
+        for m in self.measures:
+            items += [f"SUM({fa}.{m}) AS sum_{m}", f"COUNT({fa}.{m}) AS cnt_{m}",
+                      f"MIN({fa}.{m}) AS min_{m}", f"MAX({fa}.{m}) AS max_{m}"]
+        lines = [f"SELECT {', '.join(items)}", f"FROM {self.fact_table} {fa}"]
+        lines += [self.joins[a] for a in sorted(self.joined_aliases)]
+        if self.dimensions:
+            lines.append(f"GROUP BY {', '.join(self.dimensions)}")
+        return "\n".join(lines)
+
+    def create_sql(self) -> List[str]:
+        index = f"{self.name.split('.')[-1]}_key"
+        stmts = [f"CREATE MATERIALIZED VIEW IF NOT EXISTS {self.name} AS\n{self.select_sql()}\nWITH DATA"]
+        # unique index: bắt buộc cho REFRESH ... CONCURRENTLY
+        if self.dimensions:
+            stmts.append(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {self.name} "
+                         f"({', '.join(self.dim_columns.values())})")
+        return stmts
+
+    def describe(self) -> Dict:
+        return {"name": self.name, "dimensions": self.dimensions, "measures": self.measures,
+                "est_rows": self.est_rows}
+
+
+def parse_rollups(raw: List[Dict] | None, catalog) -> List[Rollup]:
+    """Dựng Rollup từ phần `rollups:` của YAML; bỏ qua (kèm cảnh báo) khai báo tham chiếu alias lạ."""
+    out: List[Rollup] = []
+    for r in raw or []:
+        fact = r.get("fact", "dw.fact_articles")
+        fact_alias = catalog.table_alias.get(fact)
+        dims = [str(d) for d in r.get("dimensions") or []]
+        unknown = [d for d in dims if "." not in d or
+                   (d.split(".")[0] != fact_alias and d.split(".")[0] not in catalog.join_map)]
+        if not r.get("name") or not fact_alias or unknown:
+            logger.warning("Skipping rollup %s: unknown fact table or dimensions %s", r.get("name"), unknown)
+            continue
+        out.append(Rollup(r["name"], dims, [str(m) for m in r.get("measures") or []], fact, fact_alias,
+                          catalog.join_map, r.get("est_rows")))
+    return out
+
+
+# =========================
+# Routing
+# =========================
+def _outside_literals(text: str, fn) -> str:
+    parts = _LITERAL_RE.split(text)
+    return "".join(p if i % 2 else fn(p) for i, p in enumerate(parts))
+
+
+def _rewrite_where(cond: str, rollup: Rollup) -> str | None:
+    """alias.cột → r.cột của rollup; None nếu điều kiện dùng cột/biểu thức rollup không có."""
+    ok = True
+
+    def sub(text: str) -> str:
+        nonlocal ok
+
+        def repl(m):
+            nonlocal ok
+            key = f"{m.group(1)}.{m.group(2)}".lower()
+            if key not in rollup.dim_columns:
+                ok = False
+                return m.group(0)
+            return f"{ROLLUP_ALIAS}.{rollup.dim_columns[key]}"
+
+        text = _REF_RE.sub(repl, text)
+        for w in _WORD_RE.findall(text):
+            if w.lower() not in _WHERE_WORDS and not w.lower().startswith(f"{ROLLUP_ALIAS}."):
+                ok = False
+        if "(" in text and not re.search(r"\bIN\s*\(", text, re.IGNORECASE):
+            ok = False
+        return text
+
+    out = _outside_literals(cond, sub)
+    return out if ok else None
+
+
+def _metric_key(expr: str) -> str:
+    return re.sub(r"\s+", "", str(expr or "")).lower()
+
+
+class RollupRegistry:
+    """Rollup nào đã build (và populated) trên DB, kèm số dòng ước tính; đếm số lần được dùng."""
+
+    def __init__(self, enabled: bool = ROLLUPS_ENABLED):
+        self.enabled = enabled
+        self.available: Dict[str, float] = {}
+        self.checked_at: float | None = None
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def refresh_status(self, db_config: Dict) -> Dict[str, float]:
+        conn = psycopg2.connect(**db_config)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT m.schemaname || '.' || m.matviewname, c.reltuples
+                    FROM pg_matviews m
+                    JOIN pg_namespace n ON n.nspname = m.schemaname
+                    JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = m.matviewname
+                    WHERE m.ispopulated
+                """)
+                found = {name: float(rows) for name, rows in cur.fetchall()}
+        finally:
+            conn.close()
+        with self._lock:
+            self.available = found
+            self.checked_at = time.time()
+        return found
+
+    def candidates(self, rollups: List[Rollup]) -> List[Rollup]:
+        if not self.enabled:
+            return []
+        return [r for r in rollups if r.name in self.available]
+
+    def rows(self, rollup: Rollup) -> float | None:
+        rows = self.available.get(rollup.name)
+        # reltuples = -1 khi chưa ANALYZE
+        return rows if rows is not None and rows >= 0 else rollup.est_rows
+
+    def stats(self, rollups: List[Rollup]) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "checked_at": self.checked_at,
+            "declared": [dict(r.describe(), available=r.name in self.available, rows=self.rows(r))
+                         for r in rollups],
+            "served": dict(self.counts),
+        }
+
+
+ROLLUPS = RollupRegistry()
+
+
+def route_plan(plan: Dict, catalog, joined: Iterable[str]) -> Tuple[str, str] | None:
+    """
+    Viết plan thành SQL trên rollup nhỏ nhất trả lời được; trả về (sql, tên rollup) hoặc None
+    để planner dùng star join như cũ. `joined`: alias dimension mà star join sẽ INNER JOIN; chỉ
+    rollup JOIN đúng các bảng đó mới cho cùng kết quả (bài không có tác giả/chủ đề bị loại như nhau).
+    JOIN theo khóa ngoại `required` (catalog.lossless_joins, vd. fa.date_id → dd) không loại dòng nào nên không tính.
+    """
+    lossless = getattr(catalog, "lossless_joins", frozenset())
+    joined = frozenset(joined) - lossless
+    rollups = ROLLUPS.candidates(getattr(catalog, "rollups", None) or [])
+    if not rollups or not isinstance(plan, dict) or plan.get("having"):
+        return None
+    metric = (plan.get("metric") or "").lower() or None
+    metric_col = str(plan.get("metric_col") or "")
+    dims = [str(d).strip() for d in plan.get("dimensions") or []]
+    where = [w for w in plan.get("where_conditions") or [] if w]
+    if metric not in (None, "count", *_REAGG) or (metric in _REAGG and not metric_col):
+        return None
+    measure = metric_col.split(".")[-1].lower() if metric in _REAGG else None
+
+    best = None
+    for r in rollups:
+        if r.joined_aliases - lossless != joined or any(d.lower() not in r.dim_columns for d in dims):
+            continue
+        if measure and (measure not in r.measures or metric_col.split(".")[0] != r.fact_alias):
+            continue
+        conds = [_rewrite_where(w, r) for w in where]
+        if any(c is None for c in conds):
+            continue
+        size = ROLLUPS.rows(r)
+        key = (size is None, size or 0, len(r.dimensions))
+        if best is None or key < best[0]:
+            best = (key, r, conds)
+    if best is None:
+        return None
+    _, r, conds = best
+
+    a = ROLLUP_ALIAS
+    select = [f"{a}.{r.dim_columns[d.lower()]}" for d in dims]
+    metric_alias = None
+    if metric == "count" or (not metric and not dims):
+        metric_alias = "count_result"
+        select.append(f"{_COUNT_EXPR.format(r=a)} AS {metric_alias}")
+    elif metric in _REAGG:
+        metric_alias = f"{metric}_result"
+        select.append(f"{_REAGG[metric].format(r=a, m=measure)} AS {metric_alias}")
+
+    sql = f"SELECT {', '.join(select)}\nFROM {r.name} {a}"
+    if conds:
+        sql += f"\nWHERE {conds[0]}"
+    if dims:
+        sql += f"\nGROUP BY {', '.join(select[:len(dims)])}"
+
+    ob = plan.get("order_by")
+    if isinstance(ob, dict) and ob.get("column"):
+        col = _metric_key(ob["column"])
+        if col in {d.lower() for d in dims}:
+            target = f"{a}.{r.dim_columns[col]}"
+        elif metric_alias and (col == _metric_key(f"{metric}({metric_col})") or
+                               (metric == "count" and col == "count(*)")):
+            target = metric_alias
+        else:
+            return None
+        sql += f"\nORDER BY {target} {ob.get('direction', 'ASC')}"
+    if plan.get("limit"):
+        sql += f"\nLIMIT {plan['limit']}"
+    ROLLUPS.counts[r.name] += 1
+    return sql + ";", r.name
+
+
+# =========================
+# CLI: build / refresh / status
+# =========================
+def _db_config() -> Dict:
+    return {
+        "dbname": os.getenv("DB_NAME", "postgres"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASS", "postgres"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+    }
+
+
+def build(rollups: List[Rollup], db_config: Dict, rebuild: bool = False):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for r in rollups:
+                t0 = time.perf_counter()
+                if rebuild:
+                    cur.execute(f"DROP MATERIALIZED VIEW IF EXISTS {r.name}")
+                for stmt in r.create_sql():
+                    cur.execute(stmt)
+                cur.execute(f"ANALYZE {r.name}")
+                logger.info("Built %s in %.1fs", r.name, time.perf_counter() - t0)
+    finally:
+        conn.close()
+
+
+def refresh(rollups: List[Rollup], db_config: Dict, channel: str):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for r in rollups:
+                t0 = time.perf_counter()
+                # CONCURRENTLY: truy vấn đang đọc rollup không bị khoá trong lúc refresh
+                concurrently = " CONCURRENTLY" if r.dimensions else ""
+                cur.execute(f"REFRESH MATERIALIZED VIEW{concurrently} {r.name}")
+                cur.execute(f"ANALYZE {r.name}")
+                # kết quả đã cache đọc từ rollup này không còn đúng
+                cur.execute("SELECT pg_notify(%s, %s)", (channel, r.name))
+                logger.info("Refreshed %s in %.1fs", r.name, time.perf_counter() - t0)
+    finally:
+        conn.close()
+
+
+def main():
+    import argparse
+
+    from .catalog import load_catalog, SEMANTIC_MODEL_PATH
+    from .result_cache import RESULT_CACHE_CHANNEL
+
+    parser = argparse.ArgumentParser(description="Build/refresh rollup materialized views")
+    parser.add_argument("command", choices=["build", "refresh", "status", "sql"])
+    parser.add_argument("--rebuild", action="store_true", help="DROP rồi tạo lại (khi đổi khai báo)")
+    parser.add_argument("--only", nargs="*", help="chỉ các rollup này")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+
+    rollups = load_catalog(SEMANTIC_MODEL_PATH).rollups
+    if args.only:
+        rollups = [r for r in rollups if r.name in args.only]
+    if args.command == "sql":
+        for r in rollups:
+            print(";\n".join(r.create_sql()) + ";\n")
+    elif args.command == "build":
+        build(rollups, _db_config(), rebuild=args.rebuild)
+    elif args.command == "refresh":
+        refresh(rollups, _db_config(), RESULT_CACHE_CHANNEL)
+    else:
+        ROLLUPS.refresh_status(_db_config())
+        for r in ROLLUPS.stats(rollups)["declared"]:
+            print(f"{r['name']:<32} {'ready' if r['available'] else 'missing':<8} rows={r['rows']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+# =========================
+# Rule-based Deconstructor (fast path)
+# =========================
+# Nhận diện các dạng câu hỏi phổ biến và sinh ra cùng logical plan như
+# query_deconstructor_agent, không cần gọi LLM. Câu nào không khớp chắc chắn
+# một template thì trả về None để pipeline rơi về LLM.
+
+ENTITY_COLUMNS = {
+    "nguồn": "da.source_name",
+    "tác giả": "au.author_name",
+    "chủ đề": "dt.topic_name",
+    "ngày": "dd.full_date",
+    "tháng": "dd.month",
+    "năm": "dd.year",
+}
+ALIAS_TABLES = {
+    "fa": "dw.fact_articles",
+    "da": "dw.dim_articles",
+    "au": "dw.dim_authors",
+    "dt": "dw.dim_topics",
+    "dd": "dw.dim_date",
+}
+MEASURES = {
+    "số từ": ("fa.word_count", "số từ"),
+    "thời gian đọc": ("fa.read_time", "thời gian đọc"),
+}
+AGGREGATES = {"tổng": "sum", "trung bình": "avg"}
+SENTIMENTS = {"tích cực": "pos", "tiêu cực": "neg", "trung lập": "neu"}
+DIRECTIONS = {"cao nhất": "DESC", "nhiều nhất": "DESC", "thấp nhất": "ASC", "ít nhất": "ASC"}
+
+# Những cụm mà template không xử lý được → luôn để LLM làm
+_BLOCKERS = [
+    "từ khóa", "tiêu đề", "nội dung", "chứa", "dưới", "trên", "hơn", "so với", "không có",
+    "duy nhất", "khác nhau", "phổ biến", "dài nhất", "ngắn nhất", "tăng", "giảm", "tỷ lệ", "phần trăm",
+    "trung bình mỗi", "mỗi tháng cao", "sang", " và ", "tối đa", "tối thiểu", "lớn nhất", "nhỏ nhất",
+]
+_HAVING_RE = re.compile(r"ít nhất \d+")
+
+_ENTITY = r"(nguồn|tác giả|chủ đề|ngày|tháng|năm)"
+_MEASURE = r"(số từ|thời gian đọc)"
+_ARTICLES = r"bài(?: viết| báo)?"
+
+# --- filters (áp dụng theo thứ tự, phần đã khớp bị xoá khỏi câu) ---
+_F_DATE = re.compile(r"(?:vào |trong |của )?ngày (\d{1,2})/(\d{1,2})/((?:19|20)\d{2})")
+_F_MONTH_YEAR = re.compile(r"(?:vào |trong |của )?tháng (\d{1,2})(?:/| năm | )((?:19|20)\d{2})")
+_F_MONTH = re.compile(r"(?:vào |trong |của )?tháng (\d{1,2})\b")
+_F_YEAR = re.compile(r"(?:vào |trong |của )?(?:năm )?\b((?:19|20)\d{2})\b")
+_F_SENTIMENT = re.compile(r"(?:có |với )?(?:cảm xúc |sentiment )?(tích cực|tiêu cực|trung lập)")
+_F_TOPIC = re.compile(
+    r"(?:về |thuộc |của )?chủ đề (?:['\"“‘]([a-z0-9]+(?:-[a-z0-9]+)*)['\"”’]|([a-z0-9]+(?:-[a-z0-9]+)+))"
+)
+
+# --- templates trên phần câu còn lại ---
+_T_COUNT = re.compile(rf"^(?:có bao nhiêu|số lượng|tổng số|đếm số|số) {_ARTICLES}(?: được đăng| được viết)?$")
+_T_SCALAR_MEASURE = re.compile(rf"^(tổng|trung bình) {_MEASURE}(?: của)?(?: các)? ?(?:{_ARTICLES})?$")
+_T_GROUP_COUNT = re.compile(
+    rf"^(?:có bao nhiêu|số lượng|tổng số|số) {_ARTICLES}(?: trong)? (?:theo|của|trong|cho)? ?(?:từng|mỗi) {_ENTITY}$"
+)
+_T_GROUP_MEASURE = re.compile(
+    rf"^(tổng|trung bình) {_MEASURE}(?: của)?(?: các)? ?(?:{_ARTICLES})? (?:theo|của|cho)? ?(?:từng|mỗi) {_ENTITY}$"
+)
+_T_TOP_MEASURE = re.compile(
+    rf"^(?:top (\d+) )?{_ENTITY}(?: nào)? có (tổng|trung bình) {_MEASURE}(?: của)?(?: các)? ?(?:{_ARTICLES})? "
+    r"(cao nhất|thấp nhất|nhiều nhất|ít nhất)$"
+)
+_T_TOP_COUNT = re.compile(
+    rf"^(?:top (\d+) )?{_ENTITY}(?: nào)?(?: có| viết)? ?(nhiều|ít)? ?(?:{_ARTICLES} )?nhất$"
+)
+
+
+def _normalize(question: str) -> str:
+    q = (question or "").strip().lower()
+    q = re.sub(r"[?!.]+$", "", q)
+    return re.sub(r"\s+", " ", q).strip()
+
+
+def _extract_filters(text: str) -> Tuple[List[Dict[str, Any]], str]:
+    filters: List[Dict[str, Any]] = []
+
+    def add(col, val):
+        filters.append({"column": col, "operator": "=", "value": val})
+
+    m = _F_DATE.search(text)
+    if m:
+        add("dd.day", int(m.group(1)))
+        add("dd.month", int(m.group(2)))
+        add("dd.year", int(m.group(3)))
+        text = _F_DATE.sub(" ", text, count=1)
+    m = _F_MONTH_YEAR.search(text)
+    if m:
+        add("dd.month", int(m.group(1)))
+        add("dd.year", int(m.group(2)))
+        text = _F_MONTH_YEAR.sub(" ", text, count=1)
+    m = _F_MONTH.search(text)
+    if m:
+        add("dd.month", int(m.group(1)))
+        text = _F_MONTH.sub(" ", text, count=1)
+    m = _F_YEAR.search(text)
+    if m:
+        add("dd.year", int(m.group(1)))
+        text = _F_YEAR.sub(" ", text, count=1)
+    m = _F_TOPIC.search(text)
+    if m:
+        add("dt.topic_name", m.group(1) or m.group(2))
+        text = _F_TOPIC.sub(" ", text, count=1)
+    m = _F_SENTIMENT.search(text)
+    if m:
+        add("fa.sentiment", SENTIMENTS[m.group(1)])
+        text = _F_SENTIMENT.sub(" ", text, count=1)
+
+    # Mỗi cột chỉ được lọc một lần; trùng nghĩa là câu phức tạp hơn template
+    cols = [f["column"] for f in filters]
+    if len(cols) != len(set(cols)):
+        return [], ""
+    # Còn số/ngày chưa được hiểu → không chắc chắn
+    if re.search(r"\d{4}|\d+/\d+", text):
+        return [], ""
+
+    text = re.sub(r"\b(trong|vào)\s*$", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return filters, text
+
+
+def _aliases_for(columns: List[str]) -> Dict[str, str]:
+    aliases = {"fa": ALIAS_TABLES["fa"]}
+    for c in columns:
+        a = c.split(".")[0]
+        if a in ALIAS_TABLES:
+            aliases[a] = ALIAS_TABLES[a]
+    return aliases
+
+
+def _plan(metric: str, metric_hint: str, dimensions: List[str], filters: List[Dict],
+          order_by: Dict | None = None, limit: int | None = None) -> Dict:
+    cols = list(dimensions) + [f["column"] for f in filters]
+    return {
+        "from_tables": ["dw.fact_articles"],
+        "aliases": _aliases_for(cols),
+        "metric": metric,
+        "metric_hint": metric_hint,
+        "dimensions": dimensions,
+        "filters": filters,
+        "order_by": order_by or {},
+        "limit": limit,
+    }
+
+
+def parse_question(question: str) -> Dict | None:
+    """Trả về plan dict (cùng dạng với Deconstructor) nếu câu hỏi khớp một template, ngược lại None."""
+    text = _normalize(question)
+    if not text or any(b in f" {text} " for b in _BLOCKERS) or _HAVING_RE.search(text):
+        return None
+
+    filters, rest = _extract_filters(text)
+    if not rest:
+        return None
+
+    if _T_COUNT.match(rest):
+        return _plan("count", "Số bài viết", [], filters)
+
+    m = _T_SCALAR_MEASURE.match(rest)
+    if m:
+        agg, measure = AGGREGATES[m.group(1)], m.group(2)
+        return _plan(agg, f"{m.group(1).capitalize()} {MEASURES[measure][1]}", [], filters)
+
+    m = _T_GROUP_COUNT.match(rest)
+    if m:
+        dim = ENTITY_COLUMNS[m.group(1)]
+        return _plan("count", f"Số bài viết theo {m.group(1)}", [dim], filters)
+
+    m = _T_GROUP_MEASURE.match(rest)
+    if m:
+        agg, measure, entity = AGGREGATES[m.group(1)], m.group(2), m.group(3)
+        return _plan(agg, f"{m.group(1).capitalize()} {MEASURES[measure][1]} theo {entity}",
+                     [ENTITY_COLUMNS[entity]], filters)
+
+    m = _T_TOP_MEASURE.match(rest)
+    if m:
+        limit = int(m.group(1)) if m.group(1) else 1
+        entity, agg_word, measure, direction = m.group(2), m.group(3), m.group(4), DIRECTIONS[m.group(5)]
+        agg = AGGREGATES[agg_word]
+        return _plan(agg, f"{agg_word.capitalize()} {MEASURES[measure][1]} theo {entity}",
+                     [ENTITY_COLUMNS[entity]], filters,
+                     {"column": f"{agg}({MEASURES[measure][0]})", "direction": direction}, limit)
+
+    m = _T_TOP_COUNT.match(rest)
+    if m:
+        limit = int(m.group(1)) if m.group(1) else 1
+        entity, amount = m.group(2), m.group(3)
+        # "tác giả nào có bài viết tiêu cực nhất" → đếm giảm dần (chỉ hợp lệ khi có filter cảm xúc)
+        if amount is None and not any(f["column"] == "fa.sentiment" for f in filters):
+            return None
+        direction = "ASC" if amount == "ít" else "DESC"
+        return _plan("count", f"Số bài viết theo {entity}", [ENTITY_COLUMNS[entity]], filters,
+                     {"column": "COUNT(*)", "direction": direction}, limit)
+
+    return None
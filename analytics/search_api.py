@@ -1,10 +1,22 @@
-import psycopg2
+import asyncio
 import os
-from fastapi import FastAPI
+import time
+from typing import List
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
 import uvicorn
 
+try:
+    from .db_pool import get_async_pool, close_async_pool
+    from .encoder import BatchEncoder
+    from .text_index import hybrid_params, hybrid_search
+    from .vector_index import register_vector, search, search_params
+except ImportError:  # chạy trực tiếp: python analytics/search_api.py
+    from db_pool import get_async_pool, close_async_pool
+    from encoder import BatchEncoder
+    from text_index import hybrid_params, hybrid_search
+    from vector_index import register_vector, search, search_params
+
 
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "db"),
@@ -14,32 +26,115 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "postgres"),
 }
 
+POOL_CONFIG = {
+    "minconn": int(os.getenv("DB_POOL_MIN", "1")),
+    "maxconn": int(os.getenv("DB_POOL_MAX", "10")),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+    "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+    "health_check_after": float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+    "statement_timeout_ms": int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "10000")),
+}
+
+# Số câu tối đa mỗi /search/batch và số truy vấn DB chạy song song trong một batch
+SEARCH_BATCH_MAX_ITEMS = int(os.getenv("SEARCH_BATCH_MAX_ITEMS", "100"))
+SEARCH_BATCH_DB_CONCURRENCY = int(os.getenv("SEARCH_BATCH_DB_CONCURRENCY", "4"))
+
 app = FastAPI()
-model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# gom các câu truy vấn đồng thời thành một lần encode theo batch + LRU cache embedding
+ENCODER = BatchEncoder()
 
 class SearchQuery(BaseModel):
     query: str
     top_k: int = 5
+    # ann (index HNSW/IVFFlat) | exact (quét toàn bộ) | hybrid (ANN + full-text, RRF); None = SEARCH_MODE
+    mode: str | None = None
+    # recall/tốc độ của ANN: hnsw.ef_search và ivfflat.probes (None = mặc định theo config)
+    ef_search: int | None = None
+    probes: int | None = None
+    # hybrid: trọng số nhánh full-text (0..1) và số ứng viên mỗi nhánh (None = HYBRID_*)
+    lexical_weight: float | None = None
+    candidates: int | None = None
+
+def _pool():
+    # vector gửi dạng nhị phân (codec đăng ký cho mỗi kết nối mới)
+    return get_async_pool(DB_CONFIG, {**POOL_CONFIG, "init": register_vector})
+
+class SearchBatch(BaseModel):
+    items: List[SearchQuery]
+
+def _params(q: SearchQuery) -> dict:
+    params = search_params(q.mode, q.top_k, q.ef_search, q.probes)
+    if params["mode"] == "hybrid":
+        params = hybrid_params(q.top_k, q.lexical_weight, q.candidates, q.ef_search, q.probes)
+    return params
+
+async def _run_search(q: SearchQuery, params: dict, query_emb, timings: dict) -> dict:
+    t0 = time.perf_counter()
+    async with _pool().connection() as conn:
+        if params["mode"] == "hybrid":
+            results, legs = await hybrid_search(conn, q.query, query_emb, q.top_k, params)
+            timings.update(legs)
+        else:
+            results = await search(conn, query_emb, q.top_k, params)
+    timings["db_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return {"results": results, "search": params, "timings_ms": timings}
 
 @app.post("/search")
-def semantic_search(q: SearchQuery):
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    query_emb = model.encode(q.query).tolist()
-    cur.execute("""
-        SELECT article_id, title, source_url,
-               (embedding <=> %s) AS distance
-        FROM dw.dim_articles
-        WHERE embedding IS NOT NULL
-        ORDER BY distance ASC
-        LIMIT %s;
-    """, (str(query_emb), q.top_k))
-    results = [{"id": row[0], "title": row[1], "url": row[2], "distance": row[3]} for row in cur.fetchall()]
-
-    cur.close()
-    conn.close()
-    return {"results": results}
+async def semantic_search(q: SearchQuery):
+    try:
+        params = _params(q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    t0 = time.perf_counter()
+    query_emb = await ENCODER.encode(q.query)
+    timings = {"encode_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    return await _run_search(q, params, query_emb, timings)
+
+@app.post("/search/batch")
+async def semantic_search_batch(payload: SearchBatch):
+    if not payload.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(payload.items) > SEARCH_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {SEARCH_BATCH_MAX_ITEMS} items per batch")
+    try:
+        params = [_params(q) for q in payload.items]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    started = time.perf_counter()
+    # mọi câu vào chung hàng đợi encode: một (hoặc vài) forward pass cho cả batch
+    vecs = await ENCODER.encode_many([q.query for q in payload.items])
+    encode_ms = round((time.perf_counter() - started) * 1000, 1)
+    slots = asyncio.Semaphore(max(1, SEARCH_BATCH_DB_CONCURRENCY))
+
+    async def run(i: int, q: SearchQuery):
+        async with slots:
+            try:
+                out = await _run_search(q, params[i], vecs[i], {"encode_ms": encode_ms})
+                return {"index": i, "ok": True, **out}
+            except Exception as e:
+                return {"index": i, "ok": False, "error": str(e)}
+
+    items = await asyncio.gather(*(run(i, q) for i, q in enumerate(payload.items)))
+    return {"items": items, "stats": {"total": len(items), "failed": sum(1 for it in items if not it["ok"]),
+                                      "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}}
+
+@app.get("/encoder")
+def encoder_stats():
+    return ENCODER.stats()
+
+@app.get("/pool")
+def pool_stats():
+    return _pool().stats()
+
+@app.on_event("startup")
+async def _startup():
+    await asyncio.to_thread(ENCODER.load)
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await ENCODER.stop()
+    await close_async_pool()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,443 @@
+import copy
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from .catalog import SchemaCatalog, get_catalog
+
+logger = logging.getLogger("analytics.semantic_cache")
+
+# =========================
+# Config
+# =========================
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX = int(os.getenv("SEMANTIC_CACHE_MAX", "5000"))
+SEMANTIC_CACHE_DIR = os.getenv(
+    "SEMANTIC_CACHE_DIR", os.path.join(os.getenv("MODEL_DIR", "models"), "semantic_cache")
+)
+SEMANTIC_CACHE_SAVE_EVERY = int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", "20"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+
+# =========================
+# Slot extraction
+# =========================
+# Các giá trị literal trong câu hỏi có thể thay đổi giữa các câu diễn đạt lại
+# (năm, ngày, số, slug...). Các "guard" (khái niệm làm đổi nghĩa câu hỏi) phải khớp, nếu không coi là miss.
+_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})/((?:19|20)\d{2})\b")
+_MONTH_YEAR_RE = re.compile(r"\btháng\s+(\d{1,2})\s*(?:/|năm\s+)((?:19|20)\d{2})\b")
+_MONTH_RE = re.compile(r"\btháng\s+(\d{1,2})\b")
+_YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+_NUMBER_RE = re.compile(r"\b(\d+(?:[.,]\d+)?)\b")
+_QUOTED_RE = re.compile(r"['\"“”‘’]([^'\"“”‘’]+)['\"“”‘’]")
+_SLUG_RE = re.compile(r"\b([a-z0-9]+(?:-[a-z0-9]+)+)\b")
+
+_SENTIMENT_WORDS = [("tích cực", "pos"), ("tiêu cực", "neg"), ("trung lập", "neu")]
+# "cao nhất", "nhiều từ nhất", "ít bài viết nhất"...; "ít nhất 500 từ" là so sánh, không phải chiều
+_DIRECTION_RE = re.compile(r"\b(cao|nhiều|dài|lớn|thấp|ít|ngắn|nhỏ)((?:\s+\w+){0,2}?)\s+nhất\b")
+_DIRECTION_WORDS = {"cao": "DESC", "nhiều": "DESC", "dài": "DESC", "lớn": "DESC",
+                    "thấp": "ASC", "ít": "ASC", "ngắn": "ASC", "nhỏ": "ASC"}
+# Mỗi guard ánh xạ các cách nói về cùng một khái niệm. Chỉ so những gì đổi nghĩa câu hỏi:
+# "tổng" (mặc định khi xếp hạng theo một measure) và từ đệm như "năm", "ngày" không phải guard;
+# năm/ngày cụ thể đã là slot.
+_GUARD_PATTERNS = {
+    "agg": [
+        ("avg", r"trung bình"),
+        ("count", r"số lượng|số bài|bao nhiêu bài|mấy bài|đếm"),
+        ("max", r"tối đa(?!\s*\d)"),
+        ("min", r"tối thiểu(?!\s*\d)"),
+    ],
+    "entity": [
+        ("source", r"nguồn"), ("author", r"tác giả"), ("topic", r"chủ đề"), ("keyword", r"từ khóa"),
+        ("title", r"tiêu đề"), ("content", r"nội dung"),
+    ],
+    "grain": [("day", r"(?:theo|mỗi|từng) ngày"), ("month", r"(?:theo|mỗi|từng) tháng"),
+              ("year", r"(?:theo|mỗi|từng) năm")],
+    "measure": [("word_count", r"(?:số|nhiều|ít) từ(?! khóa)"), ("read_time", r"thời gian đọc|phút đọc")],
+    "compare": [
+        ("vs", r"so với"),
+        ("gt", r"\btrên\b|(?:nhiều|lớn|cao|dài) hơn"),
+        ("lt", r"\bdưới\b|(?:ít|nhỏ|thấp|ngắn) hơn"),
+        ("gte", r"(?:ít nhất|tối thiểu)\s*\d"),
+        ("lte", r"(?:nhiều nhất|tối đa)\s*\d"),
+        ("contains", r"chứa"),
+    ],
+}
+_GUARD_RES = {k: [(name, re.compile(pat)) for name, pat in pats] for k, pats in _GUARD_PATTERNS.items()}
+
+
+def _to_number(s: str):
+    s = s.replace(",", ".")
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+def extract_slots(question: str) -> Tuple[List[Tuple[str, Any]], Dict[str, frozenset]]:
+    q = (question or "").lower()
+    slots: List[Tuple[str, Any]] = []
+
+    for m in _QUOTED_RE.finditer(q):
+        slots.append(("text", m.group(1).strip()))
+    rest = _QUOTED_RE.sub(" ", q)
+    for m in _SLUG_RE.finditer(rest):
+        slots.append(("text", m.group(1)))
+    rest = _SLUG_RE.sub(" ", rest)
+
+    for m in _DATE_RE.finditer(rest):
+        slots += [("day", int(m.group(1))), ("month", int(m.group(2))), ("year", int(m.group(3)))]
+    rest = _DATE_RE.sub(" ", rest)
+    for m in _MONTH_YEAR_RE.finditer(rest):
+        slots += [("month", int(m.group(1))), ("year", int(m.group(2)))]
+    rest = _MONTH_YEAR_RE.sub(" ", rest)
+    for m in _MONTH_RE.finditer(rest):
+        slots.append(("month", int(m.group(1))))
+    rest = _MONTH_RE.sub(" ", rest)
+    for m in _YEAR_RE.finditer(rest):
+        slots.append(("year", int(m.group(1))))
+    rest = _YEAR_RE.sub(" ", rest)
+    for m in _NUMBER_RE.finditer(rest):
+        slots.append(("number", _to_number(m.group(1))))
+
+    for word, val in _SENTIMENT_WORDS:
+        if word in q:
+            slots.append(("sentiment", val))
+    for m in _DIRECTION_RE.finditer(q):
+        if not m.group(2) and re.match(r"\s*\d", q[m.end():]) and not _YEAR_RE.match(q[m.end():].lstrip()):
+            continue
+        slots.append(("direction", _DIRECTION_WORDS[m.group(1)]))
+
+    guards = {k: frozenset(name for name, rx in pats if rx.search(q)) for k, pats in _GUARD_RES.items()}
+    return slots, guards
+
+
+def _signature(slots: List[Tuple[str, Any]]) -> List[str]:
+    return [t for t, _ in slots]
+
+
+def _replace_values(node, mapping: Dict[Any, Any]):
+    if isinstance(node, dict):
+        return {k: (node[k] if k == "metric_hint" else _replace_values(node[k], mapping)) for k in node}
+    if isinstance(node, list):
+        return [_replace_values(v, mapping) for v in node]
+    if isinstance(node, bool) or node is None:
+        return node
+    if isinstance(node, (int, float)):
+        return mapping.get(node, node)
+    if isinstance(node, str):
+        stripped = node.strip().strip("'")
+        key = _to_number(stripped) if re.fullmatch(r"\d+(?:\.\d+)?", stripped) else stripped.lower()
+        if key in mapping:
+            return str(mapping[key])
+        # LIKE '%...%' và các chuỗi chứa slug/text
+        out = node
+        for old, new in mapping.items():
+            if isinstance(old, str) and len(old) > 2 and old in out.lower():
+                out = re.sub(re.escape(old), str(new), out, flags=re.IGNORECASE)
+        return out
+    return node
+
+
+def rebind_plan(plan: Dict, old_slots: List, new_slots: List) -> Dict | None:
+    """
+    Thay các literal của câu hỏi cũ trong plan bằng literal của câu hỏi mới (theo vị trí cùng loại).
+    Chiều sắp xếp là tuỳ chọn: "nhiều từ nhất" không có từ chỉ chiều, "cao nhất" thì có.
+    """
+    old_dirs = [v for k, v in old_slots if k == "direction"]
+    new_dirs = [v for k, v in new_slots if k == "direction"]
+    old_slots = [s for s in old_slots if s[0] != "direction"]
+    new_slots = [s for s in new_slots if s[0] != "direction"]
+    if _signature(old_slots) != _signature(new_slots):
+        return None
+    direction: Dict[str, str] = {}
+    if old_dirs and len(old_dirs) == len(new_dirs):
+        direction = dict(zip(old_dirs, new_dirs))
+    elif len(set(new_dirs)) == 1:
+        # chỉ câu mới nói rõ chiều: dùng chiều đó
+        direction = {"ASC": new_dirs[0], "DESC": new_dirs[0]}
+    mapping: Dict[Any, Any] = {}
+    for (kind, old), (_, new) in zip(old_slots, new_slots):
+        key = old.lower() if isinstance(old, str) else old
+        if key in mapping and mapping[key] != new:
+            return None  # cùng một giá trị cũ ánh xạ sang hai giá trị mới → không chắc chắn
+        mapping[key] = new
+
+    new_plan = _replace_values(copy.deepcopy(plan), mapping)
+    ob = new_plan.get("order_by")
+    if direction and isinstance(ob, dict) and ob.get("direction"):
+        cur = str(ob["direction"]).upper()
+        ob["direction"] = direction.get(cur, cur)
+    return new_plan
+
+
+def reuse_plan(old_question: str, plan: Dict, question: str, new_slots: List | None = None,
+               new_guards: Dict | None = None) -> Dict | None:
+    """Plan của câu cũ rebind cho câu mới, hoặc None nếu guard khác nhau / không rebind được."""
+    if new_slots is None or new_guards is None:
+        new_slots, new_guards = extract_slots(question)
+    # tính lại từ câu hỏi gốc: entry lưu bởi phiên bản guard cũ vẫn so được
+    old_slots, old_guards = extract_slots(old_question)
+    if old_guards != new_guards:
+        return None
+    return rebind_plan(plan, old_slots, new_slots)
+
+
+# Các cặp câu diễn đạt lại phải dùng chung plan (True) hoặc không (False): `python -m analytics.semantic_cache check`.
+# Câu đã cache phải khớp rule_parser (plan thật, cùng dạng với Deconstructor); nếu câu mới cũng khớp thì
+# plan rebind phải trùng plan của chính câu đó.
+REPHRASE_CASES = [
+    ("Top 5 nguồn có tổng số từ cao nhất năm 2022", "Top 5 nguồn có tổng số từ nhiều nhất trong năm 2022", True),
+    ("Top 5 nguồn có tổng số từ cao nhất năm 2022", "5 nguồn nhiều từ nhất 2022", True),
+    ("Top 5 nguồn có tổng số từ cao nhất năm 2022", "Top 3 nguồn có tổng số từ cao nhất năm 2023", True),
+    ("Top 5 nguồn có tổng số từ cao nhất năm 2022", "Top 5 nguồn có tổng số từ thấp nhất năm 2022", True),
+    ("Tác giả nào viết nhiều bài nhất năm 2020", "Tác giả nào viết ít bài nhất năm 2020", True),
+    ("Số bài viết theo từng nguồn trong tháng 3/2021", "Có bao nhiêu bài viết của mỗi nguồn trong tháng 5/2022", True),
+    ("Top 5 nguồn có tổng số từ cao nhất năm 2022", "Top 5 tác giả có tổng số từ cao nhất năm 2022", False),
+    ("Top 5 nguồn có tổng số từ cao nhất năm 2022", "Top 5 nguồn có trung bình số từ cao nhất năm 2022", False),
+    ("Tổng số từ của các bài viết theo từng chủ đề", "Trung bình số từ của các bài viết theo từng chủ đề", False),
+    ("Có bao nhiêu bài viết trong năm 2021", "Có bao nhiêu bài viết trên 500 từ trong năm 2021", False),
+]
+
+
+def _without_hint(plan: Dict) -> Dict:
+    return {k: v for k, v in plan.items() if k != "metric_hint"}
+
+
+def check_rephrases(cases=REPHRASE_CASES) -> List[Dict]:
+    """Các cặp trong REPHRASE_CASES cho kết quả khác kỳ vọng (không cần model/faiss)."""
+    from .rule_parser import parse_question
+
+    failures = []
+    for old, new, expect in cases:
+        cached = parse_question(old)
+        if cached is None:
+            failures.append({"cached": old, "error": "not parsed by rule_parser"})
+            continue
+        plan = reuse_plan(old, cached, new)
+        expected_plan = parse_question(new) if expect else None
+        if (plan is not None) != expect or (
+                plan is not None and expected_plan is not None and _without_hint(plan) != _without_hint(expected_plan)):
+            failures.append({"cached": old, "question": new, "expected_hit": expect, "plan": plan,
+                             "guards": [extract_slots(old)[1], extract_slots(new)[1]]})
+    return failures
+
+
+# =========================
+# Semantic cache
+# =========================
+class SemanticCache:
+    """
+    Index faiss (cosine qua inner product trên vector đã chuẩn hoá) các câu hỏi đã trả lời,
+    ánh xạ sang plan (trước normalize) + plan đã validate + SQL. Lưu xuống đĩa và nạp lại khi khởi động.
+    """
+
+    def __init__(self, cache_dir: str = SEMANTIC_CACHE_DIR, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 maxsize: int = SEMANTIC_CACHE_MAX, catalog: Callable[[], SchemaCatalog] = get_catalog,
+                 model_name: str = EMBEDDING_MODEL, enabled: bool = SEMANTIC_CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.catalog = catalog
+        self.model_name = model_name
+        self.enabled = enabled
+        self._lock = threading.RLock()
+        self._model = None
+        self._index = None
+        self._entries: List[Dict] = []
+        self._schema_hash = ""
+        self._loaded = False
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self.rebind_failures = 0
+
+    # ----- lazy init -----
+    def _ensure(self) -> bool:
+        if not self.enabled:
+            return False
+        if self._loaded:
+            return self._index is not None
+        with self._lock:
+            if self._loaded:
+                return self._index is not None
+            self._loaded = True
+            try:
+                import faiss
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                logger.warning("Semantic cache disabled (missing dependency): %s", e)
+                return False
+            self._faiss = faiss
+            try:
+                self._model = SentenceTransformer(self.model_name)
+            except Exception as e:
+                logger.warning("Semantic cache disabled (could not load %s): %s", self.model_name, e)
+                return False
+            self._dim = self._model.get_sentence_embedding_dimension()
+            try:
+                self._schema_hash = self.catalog().hash
+            except OSError:
+                self._schema_hash = ""
+            self._index = faiss.IndexFlatIP(self._dim)
+            self._load()
+            return True
+
+    def _paths(self) -> Tuple[str, str]:
+        return os.path.join(self.cache_dir, "questions.faiss"), os.path.join(self.cache_dir, "entries.json")
+
+    def _load(self):
+        idx_path, meta_path = self._paths()
+        if not (os.path.exists(idx_path) and os.path.exists(meta_path)):
+            return
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("schema_hash") != self._schema_hash or meta.get("model") != self.model_name:
+                logger.info("Semantic cache on disk is stale (schema/model changed); starting empty")
+                return
+            index = self._faiss.read_index(idx_path)
+            if index.ntotal != len(meta["entries"]) or index.d != self._dim:
+                logger.warning("Semantic cache index/entries mismatch; starting empty")
+                return
+            self._index = index
+            self._entries = meta["entries"]
+            logger.info("Loaded %d semantic cache entries from %s", len(self._entries), self.cache_dir)
+        except Exception as e:
+            logger.warning("Could not load semantic cache: %s", e)
+
+    def save(self):
+        if self._index is None:
+            return
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            idx_path, meta_path = self._paths()
+            self._faiss.write_index(self._index, idx_path + ".tmp")
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"schema_hash": self._schema_hash, "model": self.model_name,
+                           "entries": self._entries}, f, ensure_ascii=False, default=str)
+            os.replace(idx_path + ".tmp", idx_path)
+            os.replace(meta_path + ".tmp", meta_path)
+            self._dirty = 0
+
+    def _encode(self, question: str):
+        # giữ dấu tiếng Việt: MiniLM đa ngôn ngữ phân biệt nghĩa tốt hơn khi còn dấu
+        text = re.sub(r"\s+", " ", (question or "").strip())
+        vec = self._model.encode([text], normalize_embeddings=True)
+        return vec.astype("float32")
+
+    def _check_schema(self):
+        try:
+            h = self.catalog().hash
+        except OSError:
+            return
+        if h != self._schema_hash:
+            logger.info("Semantic model changed; clearing semantic cache")
+            self._schema_hash = h
+            self._index.reset()
+            self._entries = []
+
+    # ----- public API -----
+    def load(self) -> bool:
+        return self._ensure()
+
+    def lookup(self, question: str) -> Tuple[Dict, Dict] | None:
+        """Trả về (plan đã rebind, metadata) nếu có câu hỏi tương tự vượt ngưỡng."""
+        if not self._ensure():
+            return None
+        vec = self._encode(question)
+        with self._lock:
+            self._check_schema()
+            if self._index.ntotal == 0:
+                self.misses += 1
+                return None
+            scores, ids = self._index.search(vec, min(5, self._index.ntotal))
+            new_slots, new_guards = extract_slots(question)
+            for score, i in zip(scores[0], ids[0]):
+                if i < 0 or score < self.threshold:
+                    break
+                entry = self._entries[i]
+                plan = reuse_plan(entry["question"], entry["plan"], question, new_slots, new_guards)
+                if plan is None:
+                    self.rebind_failures += 1
+                    continue
+                self.hits += 1
+                entry["hits"] = entry.get("hits", 0) + 1
+                return plan, {"matched_question": entry["question"], "similarity": round(float(score), 4)}
+            self.misses += 1
+            return None
+
+    def add(self, question: str, plan: Dict, validated_plan: Dict | None = None, sql: str = ""):
+        if not self._ensure() or not plan:
+            return
+        vec = self._encode(question)
+        slots, guards = extract_slots(question)
+        with self._lock:
+            self._check_schema()
+            if self._index.ntotal:
+                scores, _ = self._index.search(vec, 1)
+                if scores[0][0] >= 0.995:
+                    return  # gần như trùng câu đã có
+            if self._index.ntotal >= self.maxsize:
+                self._evict(max(1, self.maxsize // 10))
+            self._index.add(vec)
+            self._entries.append({
+                "question": question,
+                "plan": plan,
+                "validated_plan": validated_plan,
+                "sql": sql,
+                "slots": [list(s) for s in slots],
+                "guards": {k: sorted(v) for k, v in guards.items()},
+                "created_at": time.time(),
+                "hits": 0,
+            })
+            self._dirty += 1
+            if SEMANTIC_CACHE_SAVE_EVERY and self._dirty >= SEMANTIC_CACHE_SAVE_EVERY:
+                try:
+                    self.save()
+                except OSError as e:
+                    logger.warning("Could not persist semantic cache: %s", e)
+
+    def _evict(self, n: int):
+        # Bỏ n entry cũ nhất rồi dựng lại IndexFlatIP
+        keep = self._index.reconstruct_n(n, self._index.ntotal - n)
+        self._index.reset()
+        if len(keep):
+            self._index.add(keep)
+        self._entries = self._entries[n:]
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "rebind_failures": self.rebind_failures,
+        }
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Semantic cache tools")
+    parser.add_argument("command", choices=["check"], help="check: chạy REPHRASE_CASES (guard + rebind)")
+    parser.parse_args()
+
+    failures = check_rephrases()
+    for f in failures:
+        print(json.dumps(f, ensure_ascii=False, default=sorted))
+    print(f"{len(REPHRASE_CASES) - len(failures)}/{len(REPHRASE_CASES)} rephrase cases OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
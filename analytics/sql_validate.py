@@ -1,93 +1,744 @@
-
 import re
-import sqlparse
-from typing import Dict, List, Tuple
-
-UNSUPPORTED_FUNCTION_PATTERNS = [
-    r"\bWITH\s+TIES\b",
-    r"\bDAYOFWEEK\s*\(",
-    r"\bWEEKDAY\s*\(",
-    r"\bTIMESTAMPDIFF\s*\(",
-    r"\bMATCH\s*\(",
-    r"\bSELECT\s+TOP\b",
-    r"\bGETDATE\s*\(\)",
-]
-
-def extract_table_column_pairs(sql: str) -> List[tuple]:
-    return re.findall(r'([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)', sql)
+from typing import Dict, List, Set, Tuple
+
+from .catalog import SchemaCatalog, as_catalog
+
+# =========================
+# SQL Validator
+# =========================
+# Tokenize một lần (một regex đã compile), gom ngoặc thành cây, rồi duyệt từng
+# SELECT (kể cả subquery) đúng một lượt: kiểm tra loại câu lệnh, hàm không hỗ trợ,
+# bảng/cột theo catalog (có resolve alias), aggregate đặt sai chỗ và GROUP BY.
+
+UNSUPPORTED_FUNCTIONS = frozenset({
+    # MySQL / SQL Server, không có trong PostgreSQL
+    "DAYOFWEEK", "WEEKDAY", "TIMESTAMPDIFF", "MATCH", "GETDATE", "DATEDIFF", "DATE_FORMAT",
+    "STR_TO_DATE", "IFNULL", "CURDATE", "MONTHNAME", "DAYNAME", "YEARWEEK", "ISNULL", "DATEADD",
+})
+AGGREGATE_FUNCTIONS = frozenset({
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "STRING_AGG", "ARRAY_AGG", "JSON_AGG", "JSONB_AGG",
+    "BOOL_AND", "BOOL_OR", "EVERY", "STDDEV", "STDDEV_POP", "STDDEV_SAMP", "VARIANCE", "VAR_POP",
+    "VAR_SAMP", "PERCENTILE_CONT", "PERCENTILE_DISC", "MODE", "CORR", "COVAR_POP", "COVAR_SAMP",
+    "BIT_AND", "BIT_OR",
+})
+FORBIDDEN_KEYWORDS = frozenset({
+    "INSERT", "UPDATE", "DELETE", "MERGE", "DROP", "ALTER", "CREATE", "TRUNCATE", "GRANT", "REVOKE",
+    "COPY", "VACUUM", "CALL", "EXECUTE", "PREPARE", "LOCK", "REINDEX", "CLUSTER", "COMMENT",
+})
+# Từ khoá / tên có sẵn không phải là cột
+KEYWORDS = frozenset({
+    "ALL", "AND", "ANY", "ARRAY", "AS", "ASC", "ASYMMETRIC", "BETWEEN", "BOTH", "BY", "CASE", "CAST",
+    "COLLATE", "CROSS", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "CURRENT_USER", "DESC",
+    "DISTINCT", "ELSE", "END", "ESCAPE", "EXCEPT", "EXISTS", "FALSE", "FETCH", "FILTER", "FIRST",
+    "FOLLOWING", "FOR", "FROM", "FULL", "GROUP", "HAVING", "ILIKE", "IN", "INNER", "INTERSECT",
+    "INTERVAL", "IS", "ISNULL", "JOIN", "LAST", "LATERAL", "LEADING", "LEFT", "LIKE", "LIMIT",
+    "LOCALTIME", "LOCALTIMESTAMP", "NATURAL", "NEXT", "NOT", "NOTNULL", "NULL", "NULLS", "OFFSET",
+    "ON", "ONLY", "OR", "ORDER", "OUTER", "OVER", "PARTITION", "PRECEDING", "RANGE", "RIGHT", "ROW",
+    "ROWS", "SELECT", "SESSION_USER", "SIMILAR", "SOME", "SYMMETRIC", "THEN", "TIES", "TO", "TRAILING",
+    "TRUE", "UNBOUNDED", "UNION", "UNKNOWN", "USING", "WHEN", "WHERE", "WINDOW", "WITH", "WITHIN",
+    "CURRENT", "EXCLUDE", "OTHERS", "GROUPS",
+})
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*[\s\S]*?\*/)
+  | (?P<string>[eE]?'(?:[^']|'')*')
+  | (?P<qident>"(?:[^"]|"")+")
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+)
+  | (?P<param>\$\d+|%\(\w+\)s|%s)
+  | (?P<ident>[^\W\d][\w$]*)
+  | (?P<op>::|<=|>=|<>|!=|\|\||[-+*/%=<>(),.;\[\]:~^|&!@\#])
+  | (?P<bad>.)
+""", re.VERBOSE)
+
+# vị trí hợp lệ của các mệnh đề trong một SELECT
+_CLAUSE_ORDER = {"SELECT": 0, "INTO": 1, "FROM": 2, "WHERE": 3, "GROUP BY": 4, "HAVING": 5, "WINDOW": 6,
+                 "ORDER BY": 7, "LIMIT": 8, "OFFSET": 8, "FETCH": 8, "FOR": 9}
+_JOIN_WORDS = frozenset({"JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "OUTER"})
+_SET_OPS = frozenset({"UNION", "INTERSECT", "EXCEPT"})
+_OPERAND_KINDS = frozenset({"ident", "qident", "number", "string", "param"})
+
+# token: (kind, text, key) — key là chữ hoa cho ident, tên (bỏ ngoặc kép) cho qident
+Token = Tuple[str, str, str]
+
+
+class SQLSyntaxError(ValueError):
+    pass
+
+
+class _Paren(list):
+    """Nội dung của một cặp ngoặc (token hoặc _Paren lồng nhau)."""
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens: List[Token] = []
+    for m in _TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        if kind in ("ws", "comment"):
+            continue
+        text = m.group()
+        if kind == "bad":
+            if text in ("'", '"'):
+                raise SQLSyntaxError("Unterminated quoted string or identifier.")
+            raise SQLSyntaxError(f"Unexpected character {text!r} at position {m.start()}.")
+        if kind == "ident":
+            tokens.append((kind, text, text.upper()))
+        elif kind == "qident":
+            tokens.append((kind, text, text[1:-1].replace('""', '"')))
+        else:
+            tokens.append((kind, text, text))
+    return tokens
+
+
+def _group(tokens: List[Token]) -> List:
+    root: List = []
+    stack = [root]
+    for tok in tokens:
+        if tok[1] == "(":
+            p = _Paren()
+            stack[-1].append(p)
+            stack.append(p)
+        elif tok[1] == ")":
+            if len(stack) == 1:
+                raise SQLSyntaxError("Unbalanced parentheses: unexpected ')'.")
+            stack.pop()
+        else:
+            stack[-1].append(tok)
+    if len(stack) != 1:
+        raise SQLSyntaxError("Unbalanced parentheses: missing ')'.")
+    return root
+
 
 def split_statements(sql: str) -> List[str]:
-    parts = sqlparse.split(sql)
-    return [p.strip() for p in parts if p and p.strip()]
+    """Tách câu lệnh theo ';' ở mức ngoài cùng (không tính ';' trong chuỗi/comment)."""
+    out, start = [], 0
+    depth = 0
+    for m in _TOKEN_RE.finditer(sql):
+        t = m.group()
+        if m.lastgroup != "op":
+            continue
+        if t == "(":
+            depth += 1
+        elif t == ")":
+            depth -= 1
+        elif t == ";" and depth <= 0:
+            out.append(sql[start:m.start()])
+            start = m.end()
+    out.append(sql[start:])
+    return [s.strip() for s in out if s.strip()]
 
-def validate_sql(sql: str, catalog: Dict) -> Tuple[bool, List[str]]:
-    errors: List[str] = []
-    if not sql or not sql.strip():
-        return False, ["SQL is empty"]
 
-    statements = split_statements(sql)
-    if len(statements) > 1:
-        errors.append("Multiple SQL statements detected; only a single SELECT is allowed.")
+def _is_kw(item, *words: str) -> bool:
+    return isinstance(item, tuple) and item[0] == "ident" and item[2] in words
 
-    stmt = statements[0]
 
-    if not stmt.strip().upper().startswith("SELECT"):
-        errors.append("Only SELECT statements are allowed.")
-
-    valid_tables = {t["name"].lower() for t in catalog.get("tables", [])}
-    valid_columns = {}
-    for t in catalog.get("tables", []):
-        name = t["name"].lower()
-        cols = set()
-        for c in t.get("columns", []):
-            if isinstance(c, dict):
-                cols.add(list(c.keys())[0].lower())
-            else:
-                cols.add(str(c).lower())
-        valid_columns[name] = cols
-
-    lower_stmt = stmt.lower()
-    for pat in UNSUPPORTED_FUNCTION_PATTERNS:
-        if re.search(pat, lower_stmt, re.IGNORECASE):
-            errors.append(f"Unsupported or DB-specific function/pattern detected: {pat}")
-
-    if len(re.findall(r"\blimit\b", lower_stmt)) > 1:
-        errors.append("Multiple LIMIT clauses detected.")
-
-    pairs = extract_table_column_pairs(stmt)
-    for tbl, col in pairs:
-        tl = tbl.lower()
-        cl = col.lower()
-        if tl in valid_tables:
-            if cl not in valid_columns.get(tl, set()):
-                errors.append(f"Unknown column '{col}' on table '{tbl}'")
+def _render(items, lower: bool = False) -> str:
+    """Ghép lại biểu thức; lower=True cho dạng chuẩn hoá dùng để so sánh GROUP BY."""
+    parts: List[str] = []
+    prev_word = False
+
+    def emit(seq):
+        nonlocal prev_word
+        for it in seq:
+            if isinstance(it, _Paren):
+                parts.append("(")
+                prev_word = False
+                emit(it)
+                parts.append(")")
+                prev_word = True
+                continue
+            word = it[0] in _OPERAND_KINDS
+            if word and prev_word:
+                parts.append(" ")
+            parts.append(it[1].lower() if lower and it[0] == "ident" else it[1])
+            prev_word = word
+
+    emit(items)
+    return "".join(parts)
+
+
+def _split_commas(items: List) -> List[List]:
+    out, cur = [], []
+    for it in items:
+        if isinstance(it, tuple) and it[1] == ",":
+            out.append(cur)
+            cur = []
         else:
-            # allow alias usage; not strictly an error here
-            pass
-
-    sel_match = re.search(r"select\s+(.*?)\s+from\s", stmt, re.IGNORECASE | re.DOTALL)
-    if sel_match:
-        select_list = sel_match.group(1)
-        items = [s.strip() for s in re.split(r',(?![^(]*\))', select_list)]
-        group_by_match = re.search(r"group\s+by\s+(.*?)(?:order\s+by|limit|$)", stmt, re.IGNORECASE | re.DOTALL)
-        group_items = []
-        if group_by_match:
-            group_items = [g.strip() for g in group_by_match.group(1).split(",")]
-
-        non_agg_items = []
+            cur.append(it)
+    out.append(cur)
+    return out
+
+
+def _grouping_sets(raw: List) -> List[List] | None:
+    """ROLLUP (...), CUBE (...), GROUPING SETS (...) -> các biểu thức con; None nếu là biểu thức thường."""
+    if len(raw) == 2 and _is_kw(raw[0], "ROLLUP", "CUBE") and isinstance(raw[1], _Paren):
+        body = raw[1]
+    elif len(raw) == 3 and _is_kw(raw[0], "GROUPING") and _is_kw(raw[1], "SETS") and isinstance(raw[2], _Paren):
+        body = raw[2]
+    else:
+        return None
+    out = []
+    for part in _split_commas(list(body)):
+        nested = _grouping_sets(part)
+        if nested is not None:
+            out.extend(nested)
+        elif len(part) == 1 and isinstance(part[0], _Paren) and not _is_subquery(part[0]):
+            out.extend(x for x in _split_commas(list(part[0])) if x)  # (a, b) là một tập; () = tổng
+        elif part:
+            out.append(part)
+    return out
+
+
+def _is_subquery(p) -> bool:
+    return isinstance(p, _Paren) and bool(p) and _is_kw(p[0], "SELECT", "WITH")
+
+
+class _Scope:
+    def __init__(self, parent: "_Scope | None" = None):
+        self.parent = parent
+        # alias -> (bảng trong catalog hoặc None, tập cột đã biết hoặc None = không rõ)
+        self.sources: Dict[str, Tuple[str | None, Set[str] | None]] = {}
+        self.outputs: List[str] = []
+        # cột của JOIN ... USING (...): các nguồn đã gộp thành một cột, tên trần không mơ hồ
+        self.using: Set[str] = set()
+
+
+class _Ref:
+    __slots__ = ("key", "text", "local")
+
+    def __init__(self, key, text: str, local: bool):
+        self.key = key
+        self.text = text
+        self.local = local
+
+
+class _Expr:
+    """Kết quả duyệt một biểu thức: ref cột ngoài aggregate, các lời gọi hàm (để so với GROUP BY)."""
+    __slots__ = ("refs", "calls", "has_agg", "text", "norm")
+
+    def __init__(self, items):
+        self.refs: List[_Ref] = []
+        self.calls: List[Tuple[str, List[_Ref]]] = []
+        self.has_agg = False
+        self.text = _render(items)
+        self.norm = _render(items, lower=True)
+
+
+class _Validator:
+    def __init__(self, catalog: SchemaCatalog):
+        self.catalog = catalog
+        self.tables = catalog.tables_lower
+        self.columns = catalog.columns_lower
+        self.errors: List[str] = []
+
+    def err(self, msg: str):
+        if msg not in self.errors:
+            self.errors.append(msg)
+
+    # ----- statement -----
+    def statement(self, items: List, parent: _Scope | None = None) -> List[str]:
+        """Validate một SELECT (có thể có UNION); trả về tên cột output của nhánh đầu."""
+        if not items:
+            self.err("Empty subquery.")
+            return []
+        if _is_kw(items[0], "WITH"):
+            self.err("Only SELECT statements are allowed (WITH/CTE is not supported).")
+            return []
+        branches, cur = [], []
         for it in items:
-            # remove aliases " as x"
-            t = re.sub(r"\s+as\s+[\w\"]+$", "", it, flags=re.IGNORECASE).strip()
-            if not re.search(r"\b(sum|avg|count|min|max)\s*\(", t, re.IGNORECASE):
-                non_agg_items.append(t)
-        if non_agg_items:
-            if not group_items:
-                errors.append(f"Non-aggregated select columns {non_agg_items} but GROUP BY missing.")
+            if isinstance(it, tuple) and it[0] == "ident" and it[2] in _SET_OPS:
+                branches.append(cur)
+                cur = []
+            elif cur == [] and branches and _is_kw(it, "ALL", "DISTINCT"):
+                continue
+            else:
+                cur.append(it)
+        branches.append(cur)
+        outputs: List[str] = []
+        for i, br in enumerate(branches):
+            if len(br) == 1 and _is_subquery(br[0]):
+                br = list(br[0])
+            if not br or not _is_kw(br[0], "SELECT"):
+                self.err("Only SELECT statements are allowed.")
+                continue
+            out = self.select(br, parent)
+            if i == 0:
+                outputs = out
+        return outputs
+
+    def select(self, items: List, parent: _Scope | None) -> List[str]:
+        clauses: Dict[str, List] = {}
+        order: List[str] = []
+        cur = None
+        i = 0
+        while i < len(items):
+            it = items[i]
+            name = None
+            if isinstance(it, tuple) and it[0] == "ident":
+                k = it[2]
+                if k in ("GROUP", "ORDER") and i + 1 < len(items) and _is_kw(items[i + 1], "BY"):
+                    name = f"{k} BY"
+                    i += 1
+                elif k in _CLAUSE_ORDER and not (k == "FOR" and cur is None):
+                    name = k
+                elif k in FORBIDDEN_KEYWORDS:
+                    self.err(f"Only SELECT statements are allowed ({k} found).")
+            if name:
+                if name in clauses:
+                    self.err(f"Duplicate {name} clause.")
+                elif order and _CLAUSE_ORDER[name] < _CLAUSE_ORDER[order[-1]]:
+                    self.err(f"{name} clause after {order[-1]}.")
+                clauses.setdefault(name, [])
+                order.append(name)
+                cur = name
+            elif cur is not None:
+                clauses[cur].append(it)
+            i += 1
+
+        if "INTO" in clauses:
+            self.err("SELECT ... INTO is not allowed.")
+        if "FOR" in clauses:
+            self.err("Row locking (FOR UPDATE/SHARE) is not allowed.")
+        for name in ("WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT"):
+            for j, it in enumerate(clauses.get(name, [])):
+                if _is_kw(it, "JOIN", "ON"):
+                    self.err(f"{it[2]} found in {name} clause (joins must be in FROM).")
+                    # phần còn lại của mệnh đề không phân tích được; tránh báo lỗi dây chuyền
+                    clauses[name] = clauses[name][:j]
+                    break
+
+        scope = _Scope(parent)
+        self.from_clause(clauses.get("FROM", []), scope)
+
+        # SELECT list
+        sel = list(clauses.get("SELECT", []))
+        if sel and _is_kw(sel[0], "TOP"):
+            self.err("Unsupported or DB-specific function/pattern detected: SELECT TOP")
+            sel = sel[2:]
+        if sel and _is_kw(sel[0], "DISTINCT", "ALL"):
+            sel = sel[1:]
+            if sel and _is_kw(sel[0], "ON") and len(sel) > 1 and isinstance(sel[1], _Paren):
+                self.expr(list(sel[1]), scope, "SELECT")
+                sel = sel[2:]
+        if not sel:
+            self.err("SELECT list is empty.")
+        select_items: List[Tuple[_Expr | None, str | None]] = []
+        for raw in _split_commas(sel):
+            alias = None
+            if len(raw) >= 3 and _is_kw(raw[-2], "AS") and isinstance(raw[-1], tuple):
+                alias = raw[-1][2].lower() if raw[-1][0] == "ident" else raw[-1][2]
+                raw = raw[:-2]
+            elif (len(raw) >= 2 and isinstance(raw[-1], tuple) and raw[-1][0] in ("ident", "qident")
+                  and (raw[-1][0] == "qident" or raw[-1][2] not in KEYWORDS)
+                  and (isinstance(raw[-2], _Paren) or raw[-2][0] in _OPERAND_KINDS)
+                  and not (isinstance(raw[-2], tuple) and raw[-2][0] == "ident"
+                           and raw[-2][2] in KEYWORDS and raw[-2][2] != "END")):
+                alias = raw[-1][2].lower() if raw[-1][0] == "ident" else raw[-1][2]
+                raw = raw[:-1]
+            if not raw:
+                self.err("Empty item in SELECT list.")
+                continue
+            if raw[-1][1:2] == ("*",) and isinstance(raw[-1], tuple):
+                select_items.append((None, alias))
+                if len(raw) == 3 and isinstance(raw[0], tuple):
+                    self.qualified(raw[0], None, scope, "SELECT")
+                scope.outputs.append("*")
+                continue
+            e = self.expr(raw, scope, "SELECT")
+            select_items.append((e, alias))
+            scope.outputs.append(alias or self._output_name(raw))
+
+        where = clauses.get("WHERE")
+        if "WHERE" in clauses:
+            if not where:
+                self.err("WHERE clause is empty.")
+            self.expr(where, scope, "WHERE")
+
+        group_exprs: List[_Expr] = []
+        if "GROUP BY" in clauses:
+            if not clauses["GROUP BY"]:
+                self.err("GROUP BY clause is empty.")
+            for raw in _split_commas(clauses["GROUP BY"]):
+                if not raw:
+                    continue
+                if len(raw) == 1 and raw[0][0] == "number":
+                    n = int(float(raw[0][1]))
+                    if 1 <= n <= len(select_items) and select_items[n - 1][0] is not None:
+                        group_exprs.append(select_items[n - 1][0])
+                    else:
+                        self.err(f"GROUP BY position {n} is not in select list.")
+                    continue
+                if len(raw) == 1 and isinstance(raw[0], tuple) and raw[0][0] in ("ident", "qident"):
+                    name = raw[0][2].lower() if raw[0][0] == "ident" else raw[0][2]
+                    if not self._bare_known(name, scope):
+                        match = [e for e, a in select_items if a == name and e is not None]
+                        if match:
+                            group_exprs.append(match[0])
+                            continue
+                sets = _grouping_sets(raw)
+                if sets is not None:
+                    group_exprs.extend(self.expr(x, scope, "GROUP BY") for x in sets)
+                    continue
+                group_exprs.append(self.expr(raw, scope, "GROUP BY"))
+
+        having = self.expr(clauses["HAVING"], scope, "HAVING") if "HAVING" in clauses else None
+
+        order_exprs: List[_Expr] = []
+        for raw in _split_commas(clauses.get("ORDER BY", [])):
+            while raw and _is_kw(raw[-1], "ASC", "DESC", "FIRST", "LAST", "NULLS"):
+                raw = raw[:-1]
+            if not raw:
+                continue
+            if len(raw) == 1 and raw[0][0] == "number":
+                n = int(float(raw[0][1]))
+                if not 1 <= n <= len(select_items):
+                    self.err(f"ORDER BY position {n} is not in select list.")
+                continue
+            if len(raw) == 1 and isinstance(raw[0], tuple) and raw[0][0] in ("ident", "qident"):
+                name = raw[0][2].lower() if raw[0][0] == "ident" else raw[0][2]
+                if any(a == name for _, a in select_items) and not self._bare_known(name, scope):
+                    continue
+            order_exprs.append(self.expr(raw, scope, "ORDER BY"))
+
+        for name in ("LIMIT", "OFFSET"):
+            if name in clauses:
+                self.expr(clauses[name], scope, name)
+        if "FETCH" in clauses:
+            fetch = clauses["FETCH"]
+            if any(_is_kw(fetch[i], "WITH") and _is_kw(fetch[i + 1], "TIES") for i in range(len(fetch) - 1)):
+                self.err("Unsupported or DB-specific function/pattern detected: WITH TIES")
+
+        self.check_grouping(select_items, group_exprs, having, order_exprs, "GROUP BY" in clauses)
+        return scope.outputs
+
+    @staticmethod
+    def _output_name(raw: List) -> str:
+        last = raw[-1]
+        if isinstance(last, tuple) and last[0] in ("ident", "qident"):
+            return last[2].lower() if last[0] == "ident" else last[2]
+        if isinstance(last, _Paren) and len(raw) >= 2 and isinstance(raw[-2], tuple) and raw[-2][0] == "ident":
+            return raw[-2][2].lower()
+        return "?column?"
+
+    # ----- FROM -----
+    def from_clause(self, items: List, scope: _Scope):
+        i, n = 0, len(items)
+        expect_source = True
+        while i < n:
+            it = items[i]
+            if isinstance(it, tuple) and it[1] == ",":
+                expect_source = True
+                i += 1
+                continue
+            if _is_kw(it, *_JOIN_WORDS):
+                if _is_kw(it, "JOIN"):
+                    expect_source = True
+                i += 1
+                continue
+            if _is_kw(it, "LATERAL", "ONLY"):
+                i += 1
+                continue
+            if _is_kw(it, "ON"):
+                j = i + 1
+                while j < n and not ((_is_kw(items[j], *_JOIN_WORDS)
+                                      and not (j + 1 < n and isinstance(items[j + 1], _Paren)))
+                                     or (isinstance(items[j], tuple) and items[j][1] == ",")):
+                    j += 1
+                if j == i + 1:
+                    self.err("JOIN ... ON condition is empty.")
+                self.expr(items[i + 1:j], scope, "ON")
+                i = j
+                continue
+            if _is_kw(it, "USING") and i + 1 < n and isinstance(items[i + 1], _Paren):
+                scope.using.update(t[2].lower() if t[0] == "ident" else t[2] for t in items[i + 1]
+                                   if isinstance(t, tuple) and t[0] in ("ident", "qident"))
+                i += 2
+                continue
+            if not expect_source:
+                self.err(f"Unexpected token in FROM clause: {_render([it])}")
+                i += 1
+                continue
+            # nguồn dữ liệu: bảng, subquery hoặc hàm trả về tập
+            table, cols = None, None
+            default_alias = None
+            if isinstance(it, _Paren):
+                if _is_subquery(it):
+                    cols = set(self.statement(list(it), scope.parent))
+                    if "*" in cols or "?column?" in cols:
+                        cols = None
+                else:
+                    self.err("Unsupported parenthesised FROM item.")
+                i += 1
+            elif isinstance(it, tuple) and it[0] in ("ident", "qident"):
+                parts = [it]
+                i += 1
+                while i + 1 < n and isinstance(items[i], tuple) and items[i][1] == "." \
+                        and isinstance(items[i + 1], tuple) and items[i + 1][0] in ("ident", "qident"):
+                    parts.append(items[i + 1])
+                    i += 2
+                if i < n and isinstance(items[i], _Paren):
+                    # generate_series(...), unnest(...): không biết cột
+                    self.expr(list(items[i]), scope, "FROM")
+                    i += 1
+                    default_alias = parts[-1][2].lower()
+                else:
+                    name = ".".join(p[2].lower() if p[0] == "ident" else p[2] for p in parts)
+                    default_alias = parts[-1][2].lower() if parts[-1][0] == "ident" else parts[-1][2]
+                    if name in self.tables:
+                        table, cols = name, set(self.columns.get(name, ()))
+                    else:
+                        hint = [t for t in self.tables if t.endswith("." + name)]
+                        self.err(f"Unknown table '{name}'" + (f" (did you mean '{hint[0]}'?)" if hint else ""))
+            else:
+                self.err(f"Unexpected token in FROM clause: {_render([it])}")
+                i += 1
+                continue
+
+            alias = default_alias
+            if i < n and _is_kw(items[i], "AS"):
+                i += 1
+            if i < n and isinstance(items[i], tuple) and (
+                    items[i][0] == "qident" or (items[i][0] == "ident" and items[i][2] not in KEYWORDS)):
+                alias = items[i][2].lower() if items[i][0] == "ident" else items[i][2]
+                i += 1
+                if i < n and isinstance(items[i], _Paren):  # alias(col1, col2)
+                    cols = {c[2].lower() for c in items[i] if isinstance(c, tuple) and c[0] == "ident"}
+                    i += 1
+            if alias is None:
+                self.err("Subquery in FROM must have an alias.")
+                alias = f"?subquery{len(scope.sources)}"
+            if alias in scope.sources:
+                self.err(f"Table alias '{alias}' specified more than once.")
+            scope.sources[alias] = (table, cols)
+            expect_source = False
+
+    # ----- expressions -----
+    def _lookup(self, qualifier: str, scope: _Scope):
+        s, local = scope, True
+        while s is not None:
+            if qualifier in s.sources:
+                return s.sources[qualifier], local
+            s, local = s.parent, False
+        return None, False
+
+    def _bare_known(self, col: str, scope: _Scope) -> bool:
+        s = scope
+        while s is not None:
+            for table, cols in s.sources.values():
+                if cols is None or col in cols:
+                    return True
+            s = s.parent
+        return False
+
+    def qualified(self, q_tok: Token, col: str | None, scope: _Scope, where: str, schema: str | None = None):
+        q = q_tok[2].lower() if q_tok[0] == "ident" else q_tok[2]
+        text = f"{q}.{col or '*'}"
+        if schema:
+            full = f"{schema}.{q}"
+            hits = [(a, src) for a, src in scope.sources.items() if src[0] == full]
+            if not hits:
+                self.err(f"Missing FROM-clause entry for table '{full}'")
+                return None
+            q = hits[0][0]
+        src, local = self._lookup(q, scope)
+        if src is None:
+            self.err(f"Missing FROM-clause entry for table '{q}' (in '{text}')")
+            return None
+        table, cols = src
+        if col is not None and cols is not None and col not in cols:
+            if table:
+                self.err(f"Unknown column '{col}' on table '{table}' (alias '{q}')")
             else:
-                for n in non_agg_items:
-                    matched = any(n == g or n in g or g in n for g in group_items)
-                    if not matched:
-                        errors.append(f"Non-aggregated select '{n}' not present in GROUP BY {group_items}.")
+                self.err(f"Unknown column '{col}' in subquery '{q}'")
+        return _Ref((q, col), text, local)
 
-    is_valid = not errors
-    return is_valid, errors
+    def bare(self, col: str, scope: _Scope, where: str) -> _Ref | None:
+        s, local = scope, True
+        while s is not None:
+            found = [a for a, (table, cols) in s.sources.items() if cols is not None and col in cols]
+            unknown = any(cols is None for _, cols in s.sources.values())
+            if len(found) > 1 and col not in s.using:
+                self.err(f"Column reference '{col}' is ambiguous ({', '.join(sorted(found))}).")
+                return _Ref((found[0], col), col, local)
+            if found:
+                return _Ref((found[0], col), col, local)
+            if unknown:
+                return _Ref((None, col), col, local)
+            s, local = s.parent, False
+        if where in ("ORDER BY", "GROUP BY") and col in scope.outputs:
+            return None
+        self.err(f"Unknown column '{col}'" + (f" in {where}" if where else ""))
+        return None
+
+    def expr(self, items: List, scope: _Scope, where: str) -> _Expr:
+        e = _Expr(items)
+        self._walk(items, scope, where, e, in_agg=False)
+        return e
+
+    def _walk(self, items: List, scope: _Scope, where: str, e: _Expr, in_agg: bool, skip_first_ident=False):
+        n = len(items)
+        i = 0
+        while i < n:
+            it = items[i]
+            if isinstance(it, _Paren):
+                if _is_subquery(it):
+                    self.statement(list(it), scope)
+                else:
+                    self._walk(it, scope, where, e, in_agg)
+                i += 1
+                continue
+            kind, text, key = it
+            if kind not in ("ident", "qident"):
+                if text == "::":
+                    i += 2  # bỏ qua tên kiểu
+                    while i < n and _is_kw(items[i], "PRECISION", "VARYING", "ZONE", "WITH", "WITHOUT", "TIME"):
+                        i += 1
+                    continue
+                i += 1
+                continue
+            nxt = items[i + 1] if i + 1 < n else None
+
+            # gọi hàm
+            if kind == "ident" and isinstance(nxt, _Paren) and not _is_subquery(nxt):
+                fn = key
+                if fn in UNSUPPORTED_FUNCTIONS:
+                    self.err(f"Unsupported or DB-specific function/pattern detected: {fn}(")
+                if fn in FORBIDDEN_KEYWORDS:
+                    self.err(f"Only SELECT statements are allowed ({fn} found).")
+                after = items[i + 2] if i + 2 < n else None
+                is_window = _is_kw(after, "OVER")
+                call_start = len(e.refs)
+                if fn in AGGREGATE_FUNCTIONS and not is_window and fn != "MODE" or fn == "MODE" and _is_kw(after, "WITHIN"):
+                    if in_agg:
+                        self.err(f"Aggregate function calls cannot be nested ({fn}).")
+                    if where in ("WHERE", "ON", "GROUP BY", "FROM"):
+                        self.err(f"Aggregate functions are not allowed in {where} ({fn}).")
+                    e.has_agg = True
+                    sub = _Expr([])
+                    self._walk(nxt, scope, where, sub, in_agg=True)
+                else:
+                    self._walk(nxt, scope, where, e, in_agg, skip_first_ident=(fn == "EXTRACT"))
+                    e.calls.append((_render([it, nxt], lower=True), e.refs[call_start:]))
+                i += 2
+                # FILTER (WHERE ...) thuộc aggregate; OVER (...) / WITHIN GROUP (...) thì không:
+                # RANK() OVER (ORDER BY COUNT(*)) hợp lệ, và cột PARTITION BY phải có trong GROUP BY
+                while i < n and _is_kw(items[i], "FILTER", "OVER", "WITHIN"):
+                    clause = items[i][2]
+                    if clause == "WITHIN" and i + 1 < n and _is_kw(items[i + 1], "GROUP"):
+                        i += 1
+                    if i + 1 < n and isinstance(items[i + 1], _Paren):
+                        if clause == "FILTER":
+                            self._walk(items[i + 1], scope, where, _Expr([]), in_agg=True)
+                        else:
+                            self._walk(items[i + 1], scope, where, e if clause == "OVER" else _Expr([]), in_agg)
+                        i += 2
+                    else:
+                        i += 1  # OVER w (named window)
+                continue
+
+            # alias.column hoặc schema.table.column
+            if isinstance(nxt, tuple) and nxt[1] == "." and i + 2 < n and isinstance(items[i + 2], tuple):
+                a = items[i + 2]
+                if a[1] == "*":
+                    self.qualified(it, None, scope, where)
+                    i += 3
+                    continue
+                if a[0] in ("ident", "qident"):
+                    col = a[2].lower() if a[0] == "ident" else a[2]
+                    if (i + 4 < n and isinstance(items[i + 3], tuple) and items[i + 3][1] == "."
+                            and isinstance(items[i + 4], tuple) and items[i + 4][0] in ("ident", "qident")):
+                        c3 = items[i + 4][2].lower() if items[i + 4][0] == "ident" else items[i + 4][2]
+                        ref = self.qualified(a, c3, scope, where, schema=key.lower())
+                        i += 5
+                    else:
+                        ref = self.qualified(it, col, scope, where)
+                        i += 3
+                    if ref is not None and not in_agg:
+                        e.refs.append(ref)
+                    continue
+
+            if skip_first_ident:
+                skip_first_ident = False
+                i += 1
+                continue
+            prev = items[i - 1] if i else None
+            if kind == "ident" and (key in KEYWORDS or _is_kw(prev, "AS")):
+                i += 1
+                continue
+            if isinstance(nxt, tuple) and nxt[0] == "string":  # DATE '2020-01-01', INTERVAL '1 day'
+                i += 2
+                continue
+            col = key.lower() if kind == "ident" else key
+            ref = self.bare(col, scope, where)
+            if ref is not None and not in_agg:
+                e.refs.append(ref)
+            i += 1
+
+    # ----- GROUP BY -----
+    def check_grouping(self, select_items, group_exprs: List[_Expr], having: _Expr | None,
+                       order_exprs: List[_Expr], has_group: bool):
+        exprs = [e for e, _ in select_items if e is not None]
+        aggregated = has_group or any(e.has_agg for e in exprs) or (having is not None and having.has_agg)
+        if not aggregated:
+            if having is not None:
+                self.err("HAVING requires GROUP BY or an aggregate in the select list.")
+            return
+
+        group_norms = {g.norm for g in group_exprs}
+        grouped_keys = set()
+        for g in group_exprs:
+            grouped_keys.update(r.key for r in g.refs if r.text == g.norm or len(g.refs) == 1 and g.calls == [])
+
+        def ungrouped(e: _Expr) -> List[str]:
+            if e.norm in group_norms:
+                return []
+            covered = set()
+            for call_norm, refs in e.calls:
+                if call_norm in group_norms:
+                    covered.update(id(r) for r in refs)
+            return [r.text for r in e.refs if r.local and id(r) not in covered and r.key not in grouped_keys]
+
+        group_items = [g.text for g in group_exprs]
+        bad_select = [e.text for e in exprs if ungrouped(e)]
+        if bad_select:
+            if not has_group:
+                self.err(f"Non-aggregated select columns {bad_select} but GROUP BY missing.")
+            else:
+                for t in bad_select:
+                    self.err(f"Non-aggregated select '{t}' not present in GROUP BY {group_items}.")
+        for clause, items in (("HAVING", [having] if having is not None else []), ("ORDER BY", order_exprs)):
+            for e in items:
+                for t in ungrouped(e):
+                    self.err(f"Column '{t}' in {clause} must appear in GROUP BY or be used in an aggregate function.")
+
+
+def validate_sql(sql: str, catalog: SchemaCatalog | Dict) -> Tuple[bool, List[str]]:
+    if not sql or not sql.strip():
+        return False, ["SQL is empty"]
+    v = _Validator(as_catalog(catalog))
+    try:
+        tree = _group(tokenize(sql))
+    except SQLSyntaxError as e:
+        return False, [str(e)]
+
+    statements, cur = [], []
+    for it in tree:
+        if isinstance(it, tuple) and it[1] == ";":
+            if cur:
+                statements.append(cur)
+            cur = []
+        else:
+            cur.append(it)
+    if cur:
+        statements.append(cur)
+    if not statements:
+        return False, ["SQL is empty"]
+    if len(statements) > 1:
+        v.err("Multiple SQL statements detected; only a single SELECT is allowed.")
+
+    stmt = statements[0]
+    if not _is_kw(stmt[0], "SELECT"):
+        v.err("Only SELECT statements are allowed.")
+    else:
+        v.statement(stmt)
+    return not v.errors, v.errors
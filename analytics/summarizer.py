@@ -0,0 +1,239 @@
+import datetime
+import decimal
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+# =========================
+# Template Summarizer
+# =========================
+# Sinh câu trả lời tiếng Việt trực tiếp từ plan + kết quả cho các dạng kết quả
+# thường gặp (1 giá trị, top-N, so sánh 2 nhóm, bảng phân nhóm nhỏ). Chỉ những
+# kết quả có hình dạng lạ mới cần gọi LLM.
+
+SUMMARY_MAX_LIST = int(os.getenv("SUMMARY_MAX_LIST", "5"))
+
+DIMENSION_LABELS = {
+    "source_name": "nguồn",
+    "author_name": "tác giả",
+    "topic_name": "chủ đề",
+    "full_date": "ngày",
+    "day": "ngày",
+    "month": "tháng",
+    "year": "năm",
+    "sentiment": "cảm xúc",
+    "title": "bài viết",
+}
+SENTIMENT_LABELS = {"pos": "tích cực", "neg": "tiêu cực", "neu": "trung lập"}
+_AGG_LABELS = {"count": "Số bài viết", "sum": "Tổng", "avg": "Trung bình", "min": "Giá trị nhỏ nhất",
+               "max": "Giá trị lớn nhất"}
+
+# Đếm số câu trả lời theo đường sinh: template | llm | fallback | error | empty
+SUMMARY_SOURCE_COUNTS: Counter = Counter()
+
+
+def create_fallback_response(question: str, columns: list, rows: list) -> str:
+    if not rows:
+        return "Không tìm thấy dữ liệu phù hợp với câu hỏi của bạn."
+    try:
+        first_row = rows[0]
+        if isinstance(first_row, (list, tuple)):
+            main_value = first_row[0]
+        elif isinstance(first_row, dict):
+            main_value = list(first_row.values())[0]
+        else:
+            main_value = first_row
+        if isinstance(main_value, (int, float)):
+            return f"Có {int(main_value)} kết quả phù hợp với câu hỏi của bạn."
+        return f"Kết quả chính: {str(main_value)}."
+    except Exception:
+        return "Kết quả có nhưng không thể diễn giải chi tiết."
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool)
+
+
+def format_number(v) -> str:
+    """Định dạng số kiểu Việt Nam: 1.234.567 và 12,5."""
+    if isinstance(v, decimal.Decimal):
+        v = float(v)
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    if isinstance(v, int):
+        return f"{v:,}".replace(",", ".")
+    s = f"{v:,.2f}".rstrip("0").rstrip(".")
+    return s.replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def format_value(v) -> str:
+    """Giá trị dimension: in nguyên (năm 2019, không phải 2.019); chỉ cột metric mới qua format_number."""
+    if v is None:
+        return "(không có)"
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        return v.strftime("%d/%m/%Y")
+    return SENTIMENT_LABELS.get(str(v), str(v))
+
+
+def _dimension_label(dim: str) -> str:
+    col = str(dim).split(".")[-1]
+    return DIMENSION_LABELS.get(col, col.replace("_", " "))
+
+
+def _metric_label(plan: Dict) -> str:
+    hint = str(plan.get("metric_hint") or "").strip()
+    if hint:
+        # "Tổng số từ theo nguồn" → "Tổng số từ"; phần nhóm đã nằm ở dimension
+        return re.split(r"\s+(?:theo|của mỗi|cho mỗi|mỗi|từng)\s+", hint, maxsplit=1)[0]
+    metric = str(plan.get("metric") or "").lower()
+    label = _AGG_LABELS.get(metric, "Giá trị")
+    col = plan.get("metric_col")
+    if metric != "count" and col:
+        label = f"{label} {_dimension_label(col)}"
+    return label
+
+
+def _filter_context(plan: Dict) -> str:
+    """Mô tả ngắn các bộ lọc đơn giản; gặp bộ lọc lạ thì bỏ qua toàn bộ phần mô tả."""
+    by_col: Dict[str, Any] = {}
+    for f in plan.get("filters") or []:
+        if not isinstance(f, dict) or f.get("operator", "=") != "=":
+            return ""
+        by_col[str(f.get("column", "")).split(".")[-1]] = f.get("value")
+    parts: List[str] = []
+    day, month, year = by_col.pop("day", None), by_col.pop("month", None), by_col.pop("year", None)
+    if day and month and year:
+        parts.append(f"ngày {day}/{month}/{year}")
+    elif month and year:
+        parts.append(f"tháng {month}/{year}")
+    elif month:
+        parts.append(f"tháng {month}")
+    elif year:
+        parts.append(f"năm {year}")
+    elif day:
+        return ""
+    if parts:
+        parts[0] = f"trong {parts[0]}"
+    if "topic_name" in by_col:
+        parts.append(f"thuộc chủ đề '{by_col.pop('topic_name')}'")
+    if "source_name" in by_col:
+        parts.append(f"của nguồn '{by_col.pop('source_name')}'")
+    if "author_name" in by_col:
+        parts.append(f"của tác giả {by_col.pop('author_name')}")
+    if "sentiment" in by_col:
+        parts.append(f"có cảm xúc {SENTIMENT_LABELS.get(str(by_col.pop('sentiment')), '?')}")
+    if by_col:
+        return ""
+    return " ".join(parts)
+
+
+def _labelled(label: str, plan: Dict) -> str:
+    ctx = _filter_context(plan)
+    return f"{label} {ctx}" if ctx else label
+
+
+def _group_text(row: list, n_dims: int) -> str:
+    return ", ".join(format_value(v) for v in row[:n_dims])
+
+
+def _named_group_text(row: list, dims: List[str]) -> str:
+    """Nhóm kèm tên dimension ("tháng 1", "nguồn VnExpress") cho câu so sánh."""
+    return ", ".join(f"{_dimension_label(d)} {format_value(v)}" for d, v in zip(dims, row))
+
+
+def _orders_by_metric(plan: Dict, column) -> bool:
+    """order_by là chính aggregate của metric (COUNT(*), SUM(fa.word_count), sum_result...)."""
+    col = re.sub(r"\s+", "", str(column or "")).lower()
+    metric = str(plan.get("metric") or "").lower()
+    if not col or not metric:
+        return False
+    if col == f"{metric}_result":
+        return True
+    m = re.fullmatch(r"(\w+)\((.*)\)", col)
+    if not m or m.group(1) != metric:
+        return False
+    return metric == "count" or m.group(2) == re.sub(r"\s+", "", str(plan.get("metric_col") or "")).lower()
+
+
+def template_summary(question: str, plan: Dict | None, result: Dict) -> str | None:
+    """
+    Câu trả lời dựng từ template cho các dạng kết quả quen thuộc; None nếu hình dạng
+    kết quả không khớp (để LLM xử lý).
+    """
+    columns = result.get("columns") or []
+    rows = [list(r) for r in (result.get("rows") or [])]
+    if not rows or not columns:
+        return None
+    total = result.get("total_rows", len(rows))
+    complete = total == len(rows) and not result.get("has_more")
+
+    # 1 giá trị duy nhất
+    if len(rows) == 1 and len(columns) == 1 and _is_number(rows[0][0]):
+        if not plan:
+            return f"Kết quả là {format_number(rows[0][0])}."
+        if plan.get("dimensions"):
+            return None
+        return f"{_labelled(_metric_label(plan), plan)} là {format_number(rows[0][0])}."
+
+    if not plan:
+        return None
+    dims = plan.get("dimensions") or []
+    n_dims = len(dims)
+    # dạng GROUP BY: các cột dimension rồi đúng 1 cột số ở cuối
+    if not n_dims or len(columns) != n_dims + 1 or not all(_is_number(r[-1]) for r in rows if r[-1] is not None):
+        return None
+    if any(r[-1] is None for r in rows):
+        return None
+
+    metric = _metric_label(plan)
+    metric_low = metric[:1].lower() + metric[1:]
+    dim_label = " - ".join(_dimension_label(d) for d in dims)
+    ctx = _filter_context(plan)
+    ctx = f" {ctx}" if ctx else ""
+    order = plan.get("order_by") or {}
+    limit = plan.get("limit")
+    # Top-1 / Top-N chỉ khi sắp theo metric; sắp theo dimension (năm, tháng...) là bảng phân nhóm
+    ordered = isinstance(order, dict) and _orders_by_metric(plan, order.get("column"))
+    direction = str(order.get("direction", "DESC")).upper() if ordered else "DESC"
+    superlative = "thấp nhất" if direction == "ASC" else "cao nhất"
+
+    # Top-1
+    if ordered and (limit == 1 or len(rows) == 1):
+        top = rows[0]
+        ties = [r for r in rows[1:] if r[-1] == top[-1]]
+        names = " và ".join([_group_text(top, n_dims)] + [_group_text(r, n_dims) for r in ties])
+        return f"{dim_label.capitalize()} có {metric_low}{ctx} {superlative} là {names} ({format_number(top[-1])})."
+
+    # Top-N
+    if ordered and len(rows) <= SUMMARY_MAX_LIST:
+        items = "; ".join(f"{_group_text(r, n_dims)} ({format_number(r[-1])})" for r in rows)
+        head = f"Top {len(rows)} {dim_label} theo {metric_low}{ctx}"
+        return f"{head} ({superlative} trước): {items}."
+
+    # So sánh 2 nhóm
+    if len(rows) == 2 and complete:
+        (a, b) = rows
+        va, vb = float(a[-1]), float(b[-1])
+        na, nb = _named_group_text(a, dims), _named_group_text(b, dims)
+        if va == vb:
+            return f"{metric}{ctx} của {na} và {nb} bằng nhau ({format_number(a[-1])})."
+        hi, lo, vhi, vlo = (na, nb, va, vb) if va > vb else (nb, na, vb, va)
+        diff = vhi - vlo
+        pct = f" (≈{format_number(round(diff / vlo * 100, 1))}%)" if vlo > 0 else ""
+        return (f"{metric}{ctx}: {na} là {format_number(a[-1])}, {nb} là {format_number(b[-1])}; "
+                f"{hi} cao hơn {lo} {format_number(round(diff, 2))}{pct}.")
+
+    # Bảng phân nhóm ngắn
+    if complete and len(rows) <= SUMMARY_MAX_LIST:
+        items = "; ".join(f"{_group_text(r, n_dims)}: {format_number(r[-1])}" for r in rows)
+        return f"{metric} theo {dim_label}{ctx} — {items}."
+
+    # Nhiều nhóm: nêu số nhóm và nhóm lớn nhất trong phần dữ liệu đã có
+    if complete:
+        best = max(rows, key=lambda r: float(r[-1]))
+        worst = min(rows, key=lambda r: float(r[-1]))
+        return (f"Có {format_number(len(rows))} {dim_label}{ctx}. "
+                f"{metric} cao nhất thuộc về {_group_text(best, n_dims)} ({format_number(best[-1])}), "
+                f"thấp nhất là {_group_text(worst, n_dims)} ({format_number(worst[-1])}).")
+    return None
@@ -0,0 +1,370 @@
+# text_index.py
+# Full-text search cho dw.dim_articles: cột tsvector sinh tự động (GENERATED ... STORED, Postgres
+# tự cập nhật khi title/content đổi) + GIN index; và truy vấn hybrid của /search gộp danh sách
+# full-text với danh sách vector bằng reciprocal-rank fusion trong một câu SQL.
+#
+#
+# Ngoài ra: index cho filter kiểu từ khoá của NL2SQL (cột khai báo `text_index: trigram|fulltext`
+# trong semantic_model.yaml). Planner chỉ sinh predicate dùng index khi index đã tồn tại,
+# nếu không thì giữ LIKE như cũ.
+#
+#   python -m analytics.text_index build     # thêm cột search_tsv + CREATE INDEX CONCURRENTLY
+#   python -m analytics.text_index migrate   # pg_trgm + index cho các cột text_index của catalog
+#   python -m analytics.text_index status
+#   python -m analytics.text_index drop
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+import psycopg2
+
+try:
+    from .vector_index import (
+        VECTOR_BUILD_MEMORY, VECTOR_COLUMN, VECTOR_TABLE, _bounded, _db_config, search_params, settings_sql,
+    )
+except ImportError:  # search_api.py chạy trực tiếp
+    from vector_index import (
+        VECTOR_BUILD_MEMORY, VECTOR_COLUMN, VECTOR_TABLE, _bounded, _db_config, search_params, settings_sql,
+    )
+
+logger = logging.getLogger("analytics.text_index")
+
+# =========================
+# Config
+# =========================
+TEXT_SEARCH_COLUMN = os.getenv("TEXT_SEARCH_COLUMN", "search_tsv")
+# 'simple': không có từ điển tiếng Việt trong Postgres; chỉ tách từ + lowercase, giữ dấu
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "simple")
+# Trọng số của danh sách full-text khi gộp (0 = chỉ vector, 1 = chỉ full-text)
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.5"))
+# k của RRF: score = w / (k + rank); k lớn làm phẳng chênh lệch giữa các hạng đầu
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Số ứng viên lấy từ mỗi nhánh trước khi gộp (tối thiểu top_k)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Planner viết filter từ khoá thành predicate dùng index (khi index tồn tại)
+KEYWORD_INDEX_ENABLED = os.getenv("KEYWORD_INDEX_ENABLED", "1") not in ("0", "false", "False", "")
+
+
+def index_name() -> str:
+    return f"{VECTOR_TABLE.split('.')[-1]}_{TEXT_SEARCH_COLUMN}_gin"
+
+
+def create_sql() -> List[str]:
+    # title trọng số A, content trọng số B: ts_rank_cd ưu tiên khớp ở tiêu đề
+    cfg = TEXT_SEARCH_CONFIG
+    return [
+        f"ALTER TABLE {VECTOR_TABLE} ADD COLUMN IF NOT EXISTS {TEXT_SEARCH_COLUMN} tsvector "
+        f"GENERATED ALWAYS AS (setweight(to_tsvector('{cfg}', coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{cfg}', coalesce(content, '')), 'B')) STORED",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name()} ON {VECTOR_TABLE} "
+        f"USING gin ({TEXT_SEARCH_COLUMN})",
+    ]
+
+
+# =========================
+# Hybrid query
+# =========================
+# Hai nhánh chạy lần lượt trong cùng một câu lệnh: meta ép tính hết lex rồi vec (count(*)) và ghi
+# clock_timestamp() sau mỗi nhánh, nên thời gian từng nhánh có được mà không tốn thêm round trip.
+_HYBRID_SQL = f"""
+    WITH lex AS (
+        SELECT article_id, row_number() OVER (ORDER BY score DESC, article_id) AS rank
+        FROM (
+            SELECT article_id,
+                   ts_rank_cd({TEXT_SEARCH_COLUMN}, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', $2)) AS score
+            FROM {VECTOR_TABLE}
+            WHERE {TEXT_SEARCH_COLUMN} @@ websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', $2)
+            ORDER BY score DESC
+            LIMIT $3
+        ) t
+    ),
+    vec AS (
+        SELECT article_id, distance, row_number() OVER (ORDER BY distance, article_id) AS rank
+        FROM (
+            SELECT article_id, ({VECTOR_COLUMN} <=> $1) AS distance
+            FROM {VECTOR_TABLE}
+            WHERE {VECTOR_COLUMN} IS NOT NULL
+            ORDER BY {VECTOR_COLUMN} <=> $1
+            LIMIT $3
+        ) t
+    ),
+    meta AS (
+        SELECT statement_timestamp() AS started,
+               (SELECT clock_timestamp() FROM (SELECT count(*) FROM lex) c) AS lex_done,
+               (SELECT clock_timestamp() FROM (SELECT count(*) FROM vec) c) AS vec_done
+    )
+    SELECT m.started, m.lex_done, m.vec_done, r.*
+    FROM meta m
+    LEFT JOIN LATERAL (
+        SELECT f.article_id, a.title, a.source_url, f.lexical_rank, f.vector_rank, f.distance, f.score
+        FROM (
+            SELECT COALESCE(l.article_id, v.article_id) AS article_id,
+                   l.rank AS lexical_rank, v.rank AS vector_rank, v.distance,
+                   COALESCE($4::float8 / ($5::float8 + l.rank), 0)
+                   + COALESCE((1 - $4::float8) / ($5::float8 + v.rank), 0) AS score
+            FROM lex l FULL OUTER JOIN vec v ON v.article_id = l.article_id
+        ) f
+        JOIN {VECTOR_TABLE} a ON a.article_id = f.article_id
+        ORDER BY f.score DESC, f.article_id
+        LIMIT $6
+    ) r ON true
+"""
+
+
+def hybrid_params(top_k: int, lexical_weight: float | None = None, candidates: int | None = None,
+                  ef_search: int | None = None, probes: int | None = None) -> Dict:
+    weight = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else float(lexical_weight)
+    if not 0.0 <= weight <= 1.0:
+        raise ValueError("lexical_weight must be between 0 and 1")
+    n = max(_bounded(candidates, HYBRID_CANDIDATES, "candidates"), _bounded(top_k, 5, "top_k"))
+    # nhánh vector dùng ANN; cần đủ ứng viên cho cả danh sách gộp
+    return {**search_params("hybrid", n, ef_search, probes), "lexical_weight": weight,
+            "rrf_k": HYBRID_RRF_K, "candidates": n}
+
+
+def _ms(a, b) -> float:
+    return round((b - a).total_seconds() * 1000, 2)
+
+
+async def hybrid_search(conn, query: str, query_vec: Sequence[float], top_k: int,
+                        params: Dict) -> Tuple[List[Dict], Dict]:
+    """Kết quả đã gộp (RRF) và thời gian từng nhánh (ms, đo trên server)."""
+    await conn.execute(settings_sql(params))
+    rows = await conn.fetch(_HYBRID_SQL, np.asarray(query_vec, dtype=np.float32), query,
+                            params["candidates"], params["lexical_weight"], float(params["rrf_k"]), int(top_k))
+    first = rows[0]
+    timings = {"lexical_ms": _ms(first["started"], first["lex_done"]),
+               "vector_ms": _ms(first["lex_done"], first["vec_done"])}
+    results = [{"id": r["article_id"], "title": r["title"], "url": r["source_url"],
+                "score": r["score"], "lexical_rank": r["lexical_rank"], "vector_rank": r["vector_rank"],
+                "distance": r["distance"]}
+               for r in rows if r["article_id"] is not None]
+    return results, timings
+
+
+# =========================
+# Keyword predicates (NL2SQL)
+# =========================
+# Toán tử của filter được coi là "chứa từ khoá" trên cột text_index. '=' chỉ khi filter được đánh dấu
+# {"match": "keyword"} (model hay viết da.title = 'covid' khi ý là tiêu đề chứa 'covid'); không thì
+# '=' vẫn là so sánh bằng.
+KEYWORD_OPERATORS = frozenset({"LIKE", "ILIKE"})
+
+
+def keyword_index_name(table: str, column: str, kind: str) -> str:
+    return f"{table.split('.')[-1]}_{column}_{'trgm' if kind == 'trigram' else 'fts'}"
+
+
+def keyword_index_sql(catalog) -> List[str]:
+    stmts = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] if any(
+        k == "trigram" for _, _, k in catalog.text_search.values()) else []
+    for table, column, kind in sorted(catalog.text_search.values()):
+        # fulltext: biểu thức phải khớp đúng predicate để planner của Postgres dùng được index
+        expr = f"{column} gin_trgm_ops" if kind == "trigram" else f"to_tsvector('{TEXT_SEARCH_CONFIG}', {column})"
+        stmts.append(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {keyword_index_name(table, column, kind)} "
+                     f"ON {table} USING gin ({expr})")
+    return stmts
+
+
+def _keyword_term(value) -> str | None:
+    """'%công nghệ%' / 'công nghệ' → công nghệ; None nếu có wildcard ở giữa (giữ LIKE)."""
+    if not isinstance(value, str):
+        return None
+    term = _unquote(value).strip("%").strip()
+    if not term or "%" in term or "_" in term:
+        return None
+    return term
+
+
+# term gồm các từ trọn vẹn: 'simple' tách token theo chữ/số nên chỉ khớp cả từ ("côn" không khớp "công")
+_WHOLE_WORDS_RE = re.compile(r"\w+(?:\s+\w+)*")
+
+
+def _fulltext_term(op: str, value, term: str) -> bool:
+    """Full-text chỉ thay được ILIKE '%term%' (hoặc '=' keyword) khi term là các từ trọn vẹn;
+    LIKE phân biệt hoa thường và pattern neo đầu/cuối thì giữ nguyên."""
+    if not _WHOLE_WORDS_RE.fullmatch(term):
+        return False
+    return op == "=" or (op == "ILIKE" and _unquote(value) == f"%{term}%")
+
+
+def _unquote(value: str) -> str:
+    text = value.strip()
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        text = text[1:-1].replace("''", "'")
+    return text
+
+
+def _quote(text: str) -> str:
+    return "'" + text.replace("'", "''") + "'"
+
+
+class KeywordIndexes:
+    """Index từ khoá nào đã có trên DB (kiểm tra định kỳ); đếm predicate đã viết theo loại."""
+
+    def __init__(self, enabled: bool = KEYWORD_INDEX_ENABLED):
+        self.enabled = enabled
+        self.available: Set[str] = set()
+        self.checked_at: float | None = None
+        self.counts: Dict[str, int] = {"trigram": 0, "fulltext": 0, "like_fallback": 0}
+        self._lock = threading.Lock()
+
+    def refresh_status(self, db_config: Dict) -> Set[str]:
+        conn = psycopg2.connect(**db_config)
+        try:
+            with conn.cursor() as cur:
+                # chỉ index hợp lệ (CREATE INDEX CONCURRENTLY lỗi giữa chừng để lại index invalid)
+                cur.execute("""
+                    SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indisvalid AND c.relam = (SELECT oid FROM pg_am WHERE amname = 'gin')
+                """)
+                found = {r[0] for r in cur.fetchall()}
+        finally:
+            conn.close()
+        with self._lock:
+            self.available = found
+            self.checked_at = time.time()
+        return found
+
+    def predicate(self, column: str, op: str, value, catalog, keyword: bool = False) -> str | None:
+        """
+        Predicate dùng index cho filter từ khoá; None nếu không áp dụng (caller giữ cách viết cũ).
+        keyword=True: filter '=' được planner đánh dấu là "chứa từ khoá".
+        """
+        spec = getattr(catalog, "text_search", {}).get(str(column).lower()) if catalog is not None else None
+        if spec is None or not (op in KEYWORD_OPERATORS or (op == "=" and keyword)):
+            return None
+        term = _keyword_term(value)
+        table, col, kind = spec
+        if (term is None or not self.enabled or keyword_index_name(table, col, kind) not in self.available
+                or kind == "fulltext" and not _fulltext_term(op, value, term)):
+            self.counts["like_fallback"] += 1
+            return None
+        self.counts[kind] += 1
+        if kind == "trigram":
+            # gin_trgm_ops phục vụ được cả LIKE lẫn ILIKE (kể cả wildcard đầu chuỗi): giữ nguyên toán tử và
+            # pattern của filter để kết quả không phụ thuộc việc index có hay không
+            if op != "=":
+                return f"{column} {op} {_quote(_unquote(value))}"
+            # '=' đánh dấu keyword → chứa term, không phân biệt hoa thường; term không chứa % hay _
+            # nên chỉ cần escape dấu \ (ký tự escape mặc định của LIKE)
+            pattern = "%" + term.replace("\\", "\\\\") + "%"
+            return f"{column} ILIKE {_quote(pattern)}"
+        # phraseto_tsquery: các từ phải đứng liền nhau, gần nghĩa với LIKE '%cụm từ%'
+        return (f"to_tsvector('{TEXT_SEARCH_CONFIG}', {column}) @@ "
+                f"phraseto_tsquery('{TEXT_SEARCH_CONFIG}', {_quote(term)})")
+
+    def stats(self, catalog) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "checked_at": self.checked_at,
+            "columns": {alias_col: {"kind": kind, "index": keyword_index_name(t, c, kind),
+                                    "available": keyword_index_name(t, c, kind) in self.available}
+                        for alias_col, (t, c, kind) in sorted(catalog.text_search.items())},
+            "predicates": dict(self.counts),
+        }
+
+
+KEYWORD_INDEXES = KeywordIndexes()
+
+
+# =========================
+# CLI: build / migrate / status / drop
+# =========================
+def build(db_config: Dict):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for stmt in create_sql():
+                t0 = time.perf_counter()
+                # ADD COLUMN ... STORED ghi lại cả bảng (khoá ACCESS EXCLUSIVE): chạy ngoài giờ cao điểm
+                logger.info("%s", stmt)
+                cur.execute(stmt)
+                logger.info("Done in %.1fs", time.perf_counter() - t0)
+            cur.execute(f"ANALYZE {VECTOR_TABLE}")
+    finally:
+        conn.close()
+
+
+def migrate(db_config: Dict, catalog):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = %s", (VECTOR_BUILD_MEMORY,))
+            for stmt in keyword_index_sql(catalog):
+                t0 = time.perf_counter()
+                logger.info("%s", stmt)
+                cur.execute(stmt)
+                logger.info("Done in %.1fs", time.perf_counter() - t0)
+            for table in sorted({t for t, _, _ in catalog.text_search.values()}):
+                cur.execute(f"ANALYZE {table}")
+    finally:
+        conn.close()
+
+
+def drop(db_config: Dict):
+    schema = VECTOR_TABLE.split(".")[0] if "." in VECTOR_TABLE else "public"
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{index_name()}")
+            cur.execute(f"ALTER TABLE {VECTOR_TABLE} DROP COLUMN IF EXISTS {TEXT_SEARCH_COLUMN}")
+    finally:
+        conn.close()
+
+
+def status(db_config: Dict) -> Dict:
+    schema, _, table = VECTOR_TABLE.rpartition(".")
+    schema = schema or "public"
+    conn = psycopg2.connect(**db_config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM information_schema.columns "
+                        "WHERE table_schema = %s AND table_name = %s AND column_name = %s",
+                        (schema, table, TEXT_SEARCH_COLUMN))
+            has_column = cur.fetchone() is not None
+            cur.execute("SELECT pg_relation_size(c.oid) FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                        "WHERE n.nspname = %s AND c.relname = %s", (schema, index_name()))
+            row = cur.fetchone()
+    finally:
+        conn.close()
+    return {"table": VECTOR_TABLE, "column": TEXT_SEARCH_COLUMN if has_column else None,
+            "index": index_name() if row else None, "index_bytes": row[0] if row else None}
+
+
+def main():
+    import argparse
+
+    from .catalog import SEMANTIC_MODEL_PATH, load_catalog
+
+    parser = argparse.ArgumentParser(description="Manage the full-text and keyword indexes")
+    parser.add_argument("command", choices=["build", "migrate", "status", "drop", "sql"])
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+
+    catalog = load_catalog(SEMANTIC_MODEL_PATH)
+    if args.command == "sql":
+        print(";\n".join(create_sql() + keyword_index_sql(catalog)) + ";")
+    elif args.command == "build":
+        build(_db_config())
+    elif args.command == "migrate":
+        migrate(_db_config(), catalog)
+    elif args.command == "drop":
+        drop(_db_config())
+    else:
+        st = status(_db_config())
+        print(f"{st['table']}: column={st['column']} index={st['index']} bytes={st['index_bytes']}")
+        KEYWORD_INDEXES.refresh_status(_db_config())
+        for col, info in KEYWORD_INDEXES.stats(catalog)["columns"].items():
+            print(f"  {col:<16} {info['kind']:<9} {info['index']:<32} {'ready' if info['available'] else 'missing'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import contextlib
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# =========================
+# Tracing + Prometheus metrics
+# =========================
+# Mỗi request /ask có một Trace (giữ trong ContextVar): các bước gọi span("tên bước") để đo
+# thời gian. Khi request kết thúc, finish() ghi các span vào histogram theo outcome
+# (ok | plan_error | sql_error | corrected). /metrics xuất dạng text của Prometheus;
+# không cần thêm thư viện prometheus_client.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name, self.doc, self.labelnames = name, doc, labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = (), buckets=DURATION_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, labels
+        self.buckets = tuple(buckets)
+        # labels -> [đếm theo bucket..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            row = self._values.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, row in sorted(self._values.items()):
+                for b, n in zip(self.buckets, row):
+                    le = 'le="%s"' % _fmt(b)
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {n}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, inf)} {row[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(row[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {row[-1]}")
+        return lines
+
+
+REQUESTS = Counter("nl2sql_requests_total", "Requests answered, by outcome.", ("outcome",))
+REQUEST_SECONDS = Histogram("nl2sql_request_duration_seconds", "End-to-end request time.", ("outcome",))
+STAGE_SECONDS = Histogram("nl2sql_stage_duration_seconds", "Time spent per pipeline stage.",
+                          ("stage", "outcome"))
+LLM_TOKENS = Counter("nl2sql_llm_tokens_total", "Tokens reported by Ollama.", ("role", "kind"))
+LLM_SECONDS = Histogram("nl2sql_llm_duration_seconds", "Ollama-reported time per call.", ("role", "phase"))
+ROWS = Histogram("nl2sql_rows_returned", "Rows returned by run_sql (total_rows).", ("outcome",),
+                 buckets=ROW_BUCKETS)
+METRICS = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, LLM_TOKENS, LLM_SECONDS, ROWS]
+
+# Counter có sẵn ở module khác (plan_source, summary_source...) xuất kèm lúc scrape
+_EXTERNAL: List[Callable[[], List[str]]] = []
+
+
+def register_counts(name: str, doc: str, label: str, counts: Callable[[], Dict[str, int]]):
+    def render() -> List[str]:
+        lines = [f"# HELP {name} {doc}", f"# TYPE {name} counter"]
+        for key, v in sorted(counts().items()):
+            lines.append(f'{name}{{{label}="{_escape(key)}"}} {v}')
+        return lines
+    _EXTERNAL.append(render)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for m in METRICS:
+        lines.extend(m.render())
+    for render in _EXTERNAL:
+        lines.extend(render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Dict] = []
+        self._open: List[Dict] = []
+
+    def breakdown(self, outcome: str | None = None) -> Dict:
+        return {
+            "outcome": outcome,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "spans": sorted(self.spans, key=lambda s: s.get("start_ms", 0.0)),
+        }
+
+
+_CURRENT: ContextVar[Trace | None] = ContextVar("nl2sql_trace", default=None)
+
+
+def begin() -> Trace:
+    trace = Trace()
+    _CURRENT.set(trace)
+    return trace
+
+
+def current() -> Trace | None:
+    return _CURRENT.get()
+
+
+@contextlib.contextmanager
+def span(stage: str, **attrs) -> Iterator[Dict]:
+    """
+    Đo một bước; dict trả về dùng để gắn thêm thuộc tính (rows, tokens...).
+    Không có trace đang chạy (script, đường sync) thì chỉ là no-op.
+    """
+    trace = _CURRENT.get()
+    record = {"stage": stage, **attrs}
+    if trace is None:
+        yield record
+        return
+    t0 = time.perf_counter()
+    record["start_ms"] = round((t0 - trace.started) * 1000, 1)
+    trace._open.append(record)
+    try:
+        yield record
+    finally:
+        trace._open.remove(record)
+        record["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        trace.spans.append(record)
+
+
+def annotate(**attrs):
+    """Gắn thuộc tính vào span trong cùng đang mở (vd. số token của lời gọi LLM)."""
+    trace = _CURRENT.get()
+    if trace is not None and trace._open:
+        trace._open[-1].update(attrs)
+
+
+def record_llm(role: str, resp_json: Dict):
+    """Số token và thời gian Ollama báo về cho một lời gọi."""
+    prompt_tokens = int(resp_json.get("prompt_eval_count") or 0)
+    eval_tokens = int(resp_json.get("eval_count") or 0)
+    LLM_TOKENS.inc(role, "prompt", amount=prompt_tokens)
+    LLM_TOKENS.inc(role, "eval", amount=eval_tokens)
+    LLM_SECONDS.observe((resp_json.get("prompt_eval_duration") or 0) / 1e9, role, "prompt_eval")
+    LLM_SECONDS.observe((resp_json.get("eval_duration") or 0) / 1e9, role, "eval")
+    annotate(prompt_tokens=prompt_tokens, eval_tokens=eval_tokens)
+
+
+def finish(trace: Trace, outcome: str, rows: int | None = None) -> Dict:
+    """Ghi trace vào metrics theo outcome và trả về phần breakdown cho response."""
+    if _CURRENT.get() is trace:
+        _CURRENT.set(None)
+    elapsed = time.perf_counter() - trace.started
+    REQUESTS.inc(outcome)
+    REQUEST_SECONDS.observe(elapsed, outcome)
+    for s in trace.spans:
+        STAGE_SECONDS.observe(s["ms"] / 1000, s["stage"], outcome)
+    if rows is not None:
+        ROWS.observe(rows, outcome)
+    return trace.breakdown(outcome)
@@ -0,0 +1,246 @@
+# vector_index.py
+# Index ANN (pgvector HNSW hoặc IVFFlat) cho dw.dim_articles.embedding và truy vấn /search.
+# Index nằm trong Postgres nên tự đồng bộ khi INSERT/UPDATE; IVFFlat cần `reindex` khi phân bố
+# dữ liệu đổi nhiều (centroid được chọn lúc build).
+#
+#   python -m analytics.vector_index build      # CREATE INDEX CONCURRENTLY theo VECTOR_INDEX_KIND
+#   python -m analytics.vector_index reindex    # REINDEX CONCURRENTLY (sau khi nạp nhiều dữ liệu)
+#   python -m analytics.vector_index status
+#   python -m analytics.vector_index drop
+import logging
+import os
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+import psycopg2
+
+logger = logging.getLogger("analytics.vector_index")
+
+# =========================
+# Config
+# =========================
+VECTOR_TABLE = os.getenv("VECTOR_TABLE", "dw.dim_articles")
+VECTOR_COLUMN = os.getenv("VECTOR_COLUMN", "embedding")
+# hnsw (recall tốt, build chậm, tốn RAM) | ivfflat (build nhanh, cần đủ dữ liệu trước khi build)
+VECTOR_INDEX_KIND = os.getenv("VECTOR_INDEX_KIND", "hnsw").strip().lower()
+VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "16"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "64"))
+# 0 = tự chọn: rows/1000 (tối thiểu 10), theo khuyến nghị của pgvector
+VECTOR_IVF_LISTS = int(os.getenv("VECTOR_IVF_LISTS", "0"))
+VECTOR_BUILD_MEMORY = os.getenv("VECTOR_BUILD_MEMORY", "1GB")
+# Mặc định lúc truy vấn; request có thể ghi đè
+SEARCH_MODE = os.getenv("SEARCH_MODE", "ann").strip().lower()
+SEARCH_EF_SEARCH = int(os.getenv("SEARCH_EF_SEARCH", "40"))
+SEARCH_PROBES = int(os.getenv("SEARCH_PROBES", "10"))
+SEARCH_MAX_EF = 1000
+
+INDEX_KINDS = ("hnsw", "ivfflat")
+# hybrid: ANN + full-text, gộp bằng reciprocal-rank fusion (xem text_index.py)
+SEARCH_MODES = ("ann", "exact", "hybrid")
+
+
+def index_name(kind: str = VECTOR_INDEX_KIND) -> str:
+    return f"{VECTOR_TABLE.split('.')[-1]}_{VECTOR_COLUMN}_{kind}"
+
+
+def create_index_sql(kind: str = VECTOR_INDEX_KIND, lists: int | None = None) -> str:
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}' (expected one of {', '.join(INDEX_KINDS)})")
+    if kind == "hnsw":
+        opts = f"m = {VECTOR_HNSW_M}, ef_construction = {VECTOR_HNSW_EF_CONSTRUCTION}"
+    else:
+        opts = f"lists = {lists or VECTOR_IVF_LISTS or 100}"
+    # /search dùng khoảng cách cosine (<=>) nên index theo vector_cosine_ops
+    return (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(kind)} ON {VECTOR_TABLE} "
+            f"USING {kind} ({VECTOR_COLUMN} vector_cosine_ops) WITH ({opts})")
+
+
+# =========================
+# Binary codec
+# =========================
+# Định dạng nhị phân của pgvector: int16 số chiều, int16 (không dùng), rồi float4 big-endian.
+# Gửi vector dạng này tránh việc Postgres parse chuỗi '[0.1, 0.2, ...]' ở mỗi truy vấn.
+def encode_vector(vec: Sequence[float]) -> bytes:
+    arr = np.asarray(vec, dtype=">f4").ravel()
+    return np.array([arr.size, 0], dtype=">u2").tobytes() + arr.tobytes()
+
+
+def decode_vector(data: bytes) -> np.ndarray:
+    dim = int(np.frombuffer(data[:2], dtype=">u2")[0])
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=4).astype(np.float32)
+
+
+async def register_vector(conn):
+    """init của asyncpg pool: đăng ký codec nhị phân cho kiểu vector (schema của extension)."""
+    schema = await conn.fetchval(
+        "SELECT n.nspname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace "
+        "WHERE t.typname = 'vector' LIMIT 1"
+    )
+    if schema is None:
+        logger.warning("pgvector type not found; vector parameters cannot be sent")
+        return
+    await conn.set_type_codec("vector", schema=schema, encoder=encode_vector, decoder=decode_vector,
+                              format="binary")
+
+
+# =========================
+# Query
+# =========================
+def _bounded(value: int | None, default: int, name: str) -> int:
+    value = default if value is None else int(value)
+    if not 1 <= value <= SEARCH_MAX_EF:
+        raise ValueError(f"{name} must be between 1 and {SEARCH_MAX_EF}")
+    return value
+
+
+def search_params(mode: str | None = None, top_k: int = 5, ef_search: int | None = None,
+                  probes: int | None = None) -> Dict:
+    mode = (mode or SEARCH_MODE).lower()
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}' (expected one of {', '.join(SEARCH_MODES)})")
+    # ef_search được nâng lên top_k: top_k cũng phải nằm trong giới hạn pgvector chấp nhận
+    top_k = _bounded(top_k, 5, "top_k")
+    if mode == "exact":
+        return {"mode": mode}
+    # HNSW trả về tối đa ef_search ứng viên: nhỏ hơn top_k sẽ thiếu kết quả
+    return {"mode": mode, "ef_search": max(_bounded(ef_search, SEARCH_EF_SEARCH, "ef_search"), top_k),
+            "probes": _bounded(probes, SEARCH_PROBES, "probes")}
+
+
+def settings_sql(params: Dict) -> str:
+    """Các SET LOCAL của một truy vấn, gửi chung một lần (simple query protocol)."""
+    if params["mode"] == "exact":
+        return "SET LOCAL enable_indexscan = off"
+    # đặt cả hai: tham số của loại index không tồn tại không ảnh hưởng gì
+    return (f"SET LOCAL hnsw.ef_search = {int(params['ef_search'])}; "
+            f"SET LOCAL ivfflat.probes = {int(params['probes'])}")
+
+
+_SEARCH_SQL = f"""
+    SELECT article_id, title, source_url, ({VECTOR_COLUMN} <=> $1) AS distance
+    FROM {VECTOR_TABLE}
+    WHERE {VECTOR_COLUMN} IS NOT NULL
+    ORDER BY {VECTOR_COLUMN} <=> $1
+    LIMIT $2
+"""
+
+
+async def search(conn, query_vec: Sequence[float], top_k: int, params: Dict) -> List[Dict]:
+    """
+    Top-k theo khoảng cách cosine; phải chạy trong transaction (SET LOCAL) của AsyncConnectionPool.
+    exact: tắt index scan để Postgres tính khoảng cách với mọi dòng (dùng làm ground truth).
+    """
+    await conn.execute(settings_sql(params))
+    rows = await conn.fetch(_SEARCH_SQL, np.asarray(query_vec, dtype=np.float32), int(top_k))
+    return [{"id": r["article_id"], "title": r["title"], "url": r["source_url"], "distance": r["distance"]}
+            for r in rows]
+
+
+# =========================
+# CLI: build / reindex / status / drop
+# =========================
+def _db_config() -> Dict:
+    return {
+        "dbname": os.getenv("DB_NAME", "postgres"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", os.getenv("DB_PASS", "postgres")),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+    }
+
+
+def _ivf_lists(cur) -> int:
+    if VECTOR_IVF_LISTS:
+        return VECTOR_IVF_LISTS
+    cur.execute(f"SELECT COUNT(*) FROM {VECTOR_TABLE} WHERE {VECTOR_COLUMN} IS NOT NULL")
+    return max(10, cur.fetchone()[0] // 1000)
+
+
+def build(db_config: Dict, kind: str = VECTOR_INDEX_KIND):
+    conn = psycopg2.connect(**db_config)
+    # CREATE INDEX CONCURRENTLY không chạy được trong transaction
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = %s", (VECTOR_BUILD_MEMORY,))
+            stmt = create_index_sql(kind, _ivf_lists(cur) if kind == "ivfflat" else None)
+            t0 = time.perf_counter()
+            logger.info("%s", stmt)
+            cur.execute(stmt)
+            cur.execute(f"ANALYZE {VECTOR_TABLE}")
+            logger.info("Built %s in %.1fs", index_name(kind), time.perf_counter() - t0)
+    finally:
+        conn.close()
+
+
+def reindex(db_config: Dict, kind: str = VECTOR_INDEX_KIND):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = %s", (VECTOR_BUILD_MEMORY,))
+            t0 = time.perf_counter()
+            schema = VECTOR_TABLE.split(".")[0] if "." in VECTOR_TABLE else "public"
+            cur.execute(f"REINDEX INDEX CONCURRENTLY {schema}.{index_name(kind)}")
+            logger.info("Reindexed %s in %.1fs", index_name(kind), time.perf_counter() - t0)
+    finally:
+        conn.close()
+
+
+def drop(db_config: Dict, kind: str = VECTOR_INDEX_KIND):
+    conn = psycopg2.connect(**db_config)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            schema = VECTOR_TABLE.split(".")[0] if "." in VECTOR_TABLE else "public"
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}.{index_name(kind)}")
+    finally:
+        conn.close()
+
+
+def status(db_config: Dict) -> Dict:
+    schema, _, table = VECTOR_TABLE.rpartition(".")
+    conn = psycopg2.connect(**db_config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT i.indexname, i.indexdef, pg_relation_size((i.schemaname || '.' || i.indexname)::regclass)
+                FROM pg_indexes i
+                WHERE i.schemaname = %s AND i.tablename = %s
+                  AND (i.indexdef ILIKE '%%USING hnsw%%' OR i.indexdef ILIKE '%%USING ivfflat%%')
+            """, (schema or "public", table))
+            indexes = [{"name": n, "definition": d, "bytes": size} for n, d, size in cur.fetchall()]
+            cur.execute(f"SELECT COUNT(*), COUNT({VECTOR_COLUMN}) FROM {VECTOR_TABLE}")
+            total, embedded = cur.fetchone()
+    finally:
+        conn.close()
+    return {"table": VECTOR_TABLE, "rows": total, "embedded": embedded, "indexes": indexes}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the pgvector ANN index used by /search")
+    parser.add_argument("command", choices=["build", "reindex", "status", "drop", "sql"])
+    parser.add_argument("--kind", choices=INDEX_KINDS, default=VECTOR_INDEX_KIND)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+
+    if args.command == "sql":
+        print(create_index_sql(args.kind) + ";")
+    elif args.command == "build":
+        build(_db_config(), args.kind)
+    elif args.command == "reindex":
+        reindex(_db_config(), args.kind)
+    elif args.command == "drop":
+        drop(_db_config(), args.kind)
+    else:
+        st = status(_db_config())
+        print(f"{st['table']}: {st['embedded']}/{st['rows']} rows embedded")
+        for ix in st["indexes"]:
+            print(f"  {ix['name']:<40} {ix['bytes'] / 2**20:8.1f} MiB  {ix['definition']}")
+
+
+if __name__ == "__main__":
+    main()
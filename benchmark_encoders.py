@@ -0,0 +1,163 @@
+import argparse
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import psycopg2
+
+from analytics.encoder import EMBEDDING_MODEL, ENCODER_BACKENDS, load_model
+from analytics.onnx_encoder import SAMPLE_TEXTS, cosine_rows
+from analytics.vector_index import VECTOR_TABLE, _db_config
+
+# ===== Config =====
+CORPUS = 2000
+QUERIES = 200
+TOP_K = 10
+BATCH = 32
+MAX_CHARS = 2000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def rss_mib():
+    """(RSS hiện tại, RSS đỉnh) của process, MiB."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def measure(backend, model, queries, corpus, batch, threads):
+    """Chạy trong process riêng (spawn) để RSS của backend này không lẫn với backend kia."""
+    base, _ = rss_mib()
+    t0 = time.perf_counter()
+    enc = load_model(model, backend, threads)
+    load_s = time.perf_counter() - t0
+    loaded, _ = rss_mib()
+
+    # /search encode từng câu một: độ trễ một câu là số liệu chính
+    enc.encode(queries[:5], batch_size=1)
+    latencies, query_vecs = [], []
+    for text in queries:
+        start = time.perf_counter()
+        query_vecs.append(np.asarray(enc.encode([text], batch_size=1), dtype=np.float32)[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # backfill encode theo batch lớn: throughput
+    start = time.perf_counter()
+    corpus_vecs = np.asarray(enc.encode(corpus, batch_size=batch), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    _, peak = rss_mib()
+    return {
+        "backend": backend,
+        "load_s": load_s,
+        "rss_base": base,
+        "rss_loaded": loaded,
+        "rss_peak": peak,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "mean": statistics.mean(latencies),
+        "throughput": len(corpus) / elapsed if elapsed else 0.0,
+        "queries": np.stack(query_vecs),
+        "corpus": corpus_vecs,
+    }
+
+
+def load_texts(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def sample_corpus(n):
+    """Bài viết ngẫu nhiên (cùng text mà backfill encode) và tiêu đề của chúng làm câu truy vấn."""
+    conn = psycopg2.connect(**_db_config())
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT title, left(coalesce(nullif(content, ''), title, ''), %s) FROM {VECTOR_TABLE} "
+                        f"WHERE coalesce(content, title) IS NOT NULL ORDER BY random() LIMIT %s", (MAX_CHARS, n))
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    return [t for t, _ in rows if t], [c for _, c in rows]
+
+
+def top_k(queries, corpus, k):
+    q = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+    c = corpus / np.clip(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12, None)
+    return np.argsort(-(q @ c.T), axis=1)[:, :k]
+
+
+def overlap(a, b):
+    return statistics.mean(len(set(x) & set(y)) / len(x) for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Latency, throughput, memory and retrieval agreement of the torch and ONNX encoders")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--backends", nargs="*", choices=ENCODER_BACKENDS, default=list(ENCODER_BACKENDS))
+    parser.add_argument("--texts", help="file câu truy vấn (mỗi dòng một câu); corpus lấy từ DB")
+    parser.add_argument("--no-db", action="store_true", help="không đọc DB: corpus = câu truy vấn")
+    parser.add_argument("--corpus", type=int, default=CORPUS)
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--threads", type=int, default=0, help="0 = mặc định của backend")
+    parser.add_argument("--min-cosine", type=float, default=0.0,
+                        help="exit 1 nếu cosine nhỏ nhất giữa hai backend dưới ngưỡng")
+    args = parser.parse_args()
+
+    queries, corpus = [], []
+    if not args.no_db:
+        try:
+            queries, corpus = sample_corpus(args.corpus)
+        except psycopg2.Error as e:
+            print(f"Cannot sample {VECTOR_TABLE} ({e}); using --texts / sample texts as corpus")
+    if args.texts:
+        queries = load_texts(args.texts)
+    queries = (queries or SAMPLE_TEXTS)[:args.queries]
+    corpus = corpus or queries
+    print(f"{len(queries)} queries, {len(corpus)} corpus texts, top_k={args.top_k}, batch={args.batch}\n")
+
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for backend in args.backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            results[backend] = pool.submit(measure, backend, args.model, queries, corpus,
+                                           args.batch, args.threads).result()
+
+    print(f"{'backend':<8} {'load s':>7} {'RSS MiB':>8} {'peak MiB':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'texts/s':>9}")
+    for r in results.values():
+        print(f"{r['backend']:<8} {r['load_s']:7.1f} {r['rss_loaded'] - r['rss_base']:8.0f} "
+              f"{r['rss_peak']:9.0f} {r['p50']:8.2f} {r['p95']:8.2f} {r['throughput']:9.1f}")
+
+    if len(results) < 2:
+        return 0
+    ref, other = results["torch"], results["onnx"]
+    cos = np.concatenate([cosine_rows(ref["queries"], other["queries"]), cosine_rows(ref["corpus"], other["corpus"])])
+    k = min(args.top_k, len(corpus))
+    agree = overlap(top_k(ref["queries"], ref["corpus"], k), top_k(other["queries"], other["corpus"], k))
+    # truy vấn ONNX trên corpus torch: dùng ONNX cho /search mà chưa backfill lại
+    mixed = overlap(top_k(ref["queries"], ref["corpus"], k), top_k(other["queries"], ref["corpus"], k))
+    print(f"\ncosine onnx vs torch: min {cos.min():.4f}, mean {cos.mean():.4f}")
+    print(f"top-{k} overlap: {agree:.3f} (both onnx), {mixed:.3f} (onnx queries, torch corpus)")
+    return 1 if cos.min() < args.min_cosine else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
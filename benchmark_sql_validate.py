@@ -0,0 +1,243 @@
+import re
+import sys
+import time
+
+import sqlparse
+
+from analytics.catalog import load_catalog
+from analytics.sql_validate import validate_sql
+
+# ===== Config =====
+SCHEMA_FILE = "semantic_model.yaml"
+ITERATIONS = 2000
+
+# Regression cases: SQL lấy từ results.txt (model sinh ra) + vài case bổ sung.
+# (sql, hợp lệ?, đoạn thông báo lỗi mong đợi)
+CASES = [
+    ("""SELECT da.source_name, SUM(fa.word_count) AS sum_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022
+GROUP BY da.source_name
+ORDER BY SUM(fa.word_count) DESC
+LIMIT 5;""", True, None),
+    ("""SELECT au.author_name, MAX(fa.read_time) AS max_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id
+GROUP BY au.author_name
+ORDER BY MAX(fa.read_time) ASC
+LIMIT 1;""", True, None),
+    ("""SELECT dd.full_date, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.day = 15 AND dd.month = 6 AND dd.year = 2022
+GROUP BY dd.full_date;""", True, None),
+    ("""SELECT da.source_name, AVG(fa.word_count) AS avg_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022 AND dd.month = 10
+GROUP BY da.source_name
+HAVING fa.sentiment = 'neutral'
+ORDER BY AVG(fa.word_count) ASC
+LIMIT 1;""", False, "in HAVING must appear in GROUP BY"),
+    ("""SELECT au.author_name, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2021 AND fa.article_id GROUP BY ''
+GROUP BY au.author_name
+HAVING COUNT(fa.article_id) >= 5;""", False, "Duplicate GROUP BY"),
+    ("""SELECT COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+WHERE dd.year = 2020 AND fa.word_count < 500;""", False, "Missing FROM-clause entry for table 'dd'"),
+    ("""SELECT dt.topic_name, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id
+INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id
+INNER JOIN dw.dim_topics dt ON fa.topic_id = dt.topic_id
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022
+GROUP BY dt.topic_name;""", False, "specified more than once"),
+    ("""SELECT COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+WHERE da.content LIKE '%sức khỏe%';""", True, None),
+    ("""SELECT dd.year, dd.month, SUM(fa.word_count) AS sum_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2021 AND dd.month = 11
+GROUP BY dd.year, dd.month;""", True, None),
+    ("""SELECT dd.day
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.month = 1 AND dd.year = 2021
+GROUP BY dd.day;""", True, None),
+    ("""SELECT COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year IN ('2019', '2020');""", True, None),
+    ("""SELECT dt.topic_name, dd.year, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_topics dt ON fa.topic_id = dt.topic_id
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2020
+GROUP BY dt.topic_name, dd.year;
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_topics dt ON fa.topic_id = dt.topic_id
+GROUP BY dt.topic_name, dd.year;""", False, "Multiple SQL statements"),
+    ("""SELECT dd.day, dd.month, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022""", False, "GROUP BY missing"),
+    ("""SELECT dd.day, dd.month, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022
+WHERE dd.year = 2022
+GROUP BY dd.day, dd.month
+ORDER BY COUNT(fa.article_id) ASC
+LIMIT 1;""", False, "Duplicate WHERE"),
+    ("""SELECT au.author_name, COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id
+GROUP BY au.author_name
+HAVING COUNT(fa.article_id) >= 10;""", True, None),
+    ("""SELECT da.title
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+WHERE da.title LIKE '%COVID%'
+GROUP BY da.title;""", True, None),
+    ("""SELECT COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+ORDER BY fa.word_count DESC
+LIMIT 5;""", False, "in ORDER BY must appear in GROUP BY"),
+    ("""SELECT dd.year, dd.month, da.source_name
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_articles da ON fa.article_id = da.article_id
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022
+GROUP BY dd.year, dd.month, da.source_name
+ORDER BY avg(fa.word_count) DESC;""", True, None),
+    ("""SELECT dd.day, dd.month, dd.year
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+WHERE dd.year = 2022
+GROUP BY dd.day, dd.month, dd.year
+ORDER BY max(fa.word_count) DESC
+LIMIT 1;""", True, None),
+    ("""SELECT COUNT(*) AS count_result
+FROM dw.fact_articles fa
+INNER JOIN dw.dim_authors au ON fa.author_id = au.author_id;""", True, None),
+    # bổ sung
+    ("SELECT da.title FROM dw.dim_articles da LIMIT 10", True, None),
+    ("SELECT 1; DROP TABLE dw.fact_articles", False, "Multiple SQL statements"),
+    ("DELETE FROM dw.fact_articles", False, "Only SELECT"),
+    ("SELECT TOP 5 da.title FROM dw.dim_articles da", False, "SELECT TOP"),
+    ("SELECT DAYOFWEEK(dd.full_date) FROM dw.dim_date dd", False, "DAYOFWEEK"),
+    ("SELECT fa.bogus FROM dw.fact_articles fa", False, "Unknown column 'bogus'"),
+    ("SELECT article_id FROM dw.fact_articles fa JOIN dw.dim_articles da ON fa.article_id = da.article_id",
+     False, "ambiguous"),
+    ("SELECT fa.word_count FROM fact_articles fa", False, "did you mean 'dw.fact_articles'"),
+    ("SELECT COUNT(*) FROM dw.fact_articles fa WHERE SUM(fa.word_count) > 10", False, "not allowed in WHERE"),
+    ("""SELECT EXTRACT(YEAR FROM dd.full_date) AS y, COUNT(*)
+FROM dw.fact_articles fa JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+GROUP BY EXTRACT(YEAR FROM dd.full_date) ORDER BY y""", True, None),
+    ("""SELECT au.author_name FROM dw.fact_articles fa JOIN dw.dim_authors au ON fa.author_id = au.author_id
+WHERE EXISTS (SELECT 1 FROM dw.dim_date d2 WHERE d2.date_id = fa.date_id AND d2.year = 2020)""", True, None),
+    ("SELECT 'a;b' AS x, da.title FROM dw.dim_articles da -- ; comment", True, None),
+    # regex cũ coi 'dd.day' khớp 'dd.day_of_week' vì so khớp chuỗi con (n in g)
+    ("""SELECT dd.day, COUNT(*) FROM dw.fact_articles fa JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+GROUP BY dd.full_date""", False, "not present in GROUP BY"),
+    # window function trên aggregate: OVER (...) không phải ngữ cảnh aggregate
+    ("""SELECT da.source_name, RANK() OVER (ORDER BY COUNT(*) DESC) AS rnk
+FROM dw.fact_articles fa JOIN dw.dim_articles da ON fa.article_id = da.article_id
+GROUP BY da.source_name""", True, None),
+    ("""SELECT da.source_name, COUNT(*), RANK() OVER (PARTITION BY da.title ORDER BY COUNT(*) DESC)
+FROM dw.fact_articles fa JOIN dw.dim_articles da ON fa.article_id = da.article_id
+GROUP BY da.source_name""", False, "not present in GROUP BY"),
+    ("SELECT COUNT(*) FILTER (WHERE SUM(fa.word_count) > 1) FROM dw.fact_articles fa", False, "nested"),
+    # USING gộp cột nối thành một
+    ("SELECT date_id FROM dw.fact_articles fa JOIN dw.dim_date dd USING (date_id)", True, None),
+    ("""SELECT da.source_name, dd.year, COUNT(*) FROM dw.fact_articles fa
+JOIN dw.dim_articles da ON fa.article_id = da.article_id JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+GROUP BY ROLLUP (da.source_name, dd.year)""", True, None),
+    ("""SELECT da.source_name, dd.year, COUNT(*) FROM dw.fact_articles fa
+JOIN dw.dim_articles da ON fa.article_id = da.article_id JOIN dw.dim_date dd ON fa.date_id = dd.date_id
+GROUP BY GROUPING SETS ((da.source_name, dd.year), (da.source_name), ())""", True, None),
+]
+
+LEGACY_PATTERNS = [
+    r"\bWITH\s+TIES\b", r"\bDAYOFWEEK\s*\(", r"\bWEEKDAY\s*\(", r"\bTIMESTAMPDIFF\s*\(",
+    r"\bMATCH\s*\(", r"\bSELECT\s+TOP\b", r"\bGETDATE\s*\(\)",
+]
+
+
+def legacy_validate(sql, catalog):
+    """Regex stack cũ của validate_sql (chỉ để so sánh tốc độ)."""
+    errors = []
+    statements = [p.strip() for p in sqlparse.split(sql) if p and p.strip()]
+    stmt = statements[0]
+    lower_stmt = stmt.lower()
+    for pat in LEGACY_PATTERNS:
+        if re.search(pat, lower_stmt, re.IGNORECASE):
+            errors.append(pat)
+    for tbl, col in re.findall(r'([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)', stmt):
+        if tbl.lower() in catalog.tables_lower and col.lower() not in catalog.columns_lower.get(tbl.lower(), set()):
+            errors.append(col)
+    sel_match = re.search(r"select\s+(.*?)\s+from\s", stmt, re.IGNORECASE | re.DOTALL)
+    if sel_match:
+        items = [s.strip() for s in re.split(r',(?![^(]*\))', sel_match.group(1))]
+        gb = re.search(r"group\s+by\s+(.*?)(?:order\s+by|limit|$)", stmt, re.IGNORECASE | re.DOTALL)
+        group_items = [g.strip() for g in gb.group(1).split(",")] if gb else []
+        for it in items:
+            t = re.sub(r"\s+as\s+[\w\"]+$", "", it, flags=re.IGNORECASE).strip()
+            if not re.search(r"\b(sum|avg|count|min|max)\s*\(", t, re.IGNORECASE):
+                if not any(t == g or t in g or g in t for g in group_items):
+                    errors.append(t)
+    return not errors, errors
+
+
+def check_cases(catalog):
+    failed = 0
+    for i, (sql, expect_valid, expect_msg) in enumerate(CASES, 1):
+        ok, errors = validate_sql(sql, catalog)
+        good = ok == expect_valid and (expect_msg is None or any(expect_msg in e for e in errors))
+        if not good:
+            failed += 1
+            print(f"[FAIL] case {i}: expected valid={expect_valid} ({expect_msg}), got {ok} {errors}")
+    print(f"Regression cases: {len(CASES) - failed}/{len(CASES)} passed")
+    return failed
+
+
+def bench(fn, catalog, label):
+    sqls = [c[0] for c in CASES]
+    start = time.perf_counter()
+    for _ in range(ITERATIONS // len(sqls) + 1):
+        for sql in sqls:
+            fn(sql, catalog)
+    n = (ITERATIONS // len(sqls) + 1) * len(sqls)
+    per_query = (time.perf_counter() - start) / n * 1e6
+    print(f"{label:<22} {per_query:8.1f} µs/query  ({n} runs)")
+    return per_query
+
+
+def main():
+    catalog = load_catalog(SCHEMA_FILE)
+    failed = check_cases(catalog)
+    print("\n=== Micro-benchmark ===")
+    new = bench(validate_sql, catalog, "validate_sql (AST)")
+    old = bench(legacy_validate, catalog, "legacy regex stack")
+    print(f"Speed-up: {old / new:.1f}x")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
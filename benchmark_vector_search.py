@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import asyncpg
+
+from analytics.db_pool import _asyncpg_dsn_kwargs
+from analytics.vector_index import (
+    VECTOR_COLUMN, VECTOR_TABLE, _db_config, register_vector, search, search_params,
+)
+
+# ===== Config =====
+QUERIES = 200
+TOP_K = 10
+EF_SEARCH = [10, 20, 40, 80, 160]
+PROBES = [1, 5, 10, 20, 50]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+async def sample_queries(conn, n):
+    """Dùng embedding của các bài viết ngẫu nhiên làm vector truy vấn."""
+    rows = await conn.fetch(
+        f"SELECT {VECTOR_COLUMN} FROM {VECTOR_TABLE} WHERE {VECTOR_COLUMN} IS NOT NULL ORDER BY random() LIMIT $1", n
+    )
+    return [r[0] for r in rows]
+
+
+async def run(conn, queries, top_k, params):
+    latencies, results = [], []
+    for vec in queries:
+        start = time.perf_counter()
+        async with conn.transaction(readonly=True):
+            rows = await search(conn, vec, top_k, params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([r["id"] for r in rows])
+    return latencies, results
+
+
+async def run_text_param(conn, queries, top_k):
+    """Cách cũ của /search: vector gửi dạng chuỗi '[...]' và quét toàn bộ."""
+    latencies = []
+    for vec in queries:
+        text = str([float(x) for x in vec])
+        start = time.perf_counter()
+        async with conn.transaction(readonly=True):
+            await conn.execute("SET LOCAL enable_indexscan = off")
+            await conn.fetch(
+                f"SELECT article_id, ({VECTOR_COLUMN} <=> $1::text::vector) AS distance FROM {VECTOR_TABLE} "
+                f"WHERE {VECTOR_COLUMN} IS NOT NULL ORDER BY distance LIMIT $2", text, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def recall(truth, got, k):
+    return statistics.mean(len(set(t[:k]) & set(g[:k])) / max(1, min(k, len(t))) for t, g in zip(truth, got))
+
+
+def report(label, latencies, rec=None):
+    rec_s = f"{rec:8.3f}" if rec is not None else f"{'-':>8}"
+    print(f"{label:<28} {rec_s} {statistics.mean(latencies):9.2f} {percentile(latencies, 50):9.2f} "
+          f"{percentile(latencies, 95):9.2f}")
+
+
+async def main_async(args):
+    conn = await asyncpg.connect(**_asyncpg_dsn_kwargs(_db_config()))
+    try:
+        await register_vector(conn)
+        queries = await sample_queries(conn, args.queries)
+        if not queries:
+            print(f"No embeddings in {VECTOR_TABLE}.{VECTOR_COLUMN}")
+            return 1
+        print(f"{len(queries)} queries, top_k={args.top_k}, kind={args.kind}\n")
+        print(f"{'mode':<28} {'recall@k':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+
+        # chạy một lượt để làm nóng cache trang trước khi đo
+        await run(conn, queries[:10], args.top_k, search_params("exact"))
+        exact_lat, truth = await run(conn, queries, args.top_k, search_params("exact"))
+        report("exact (binary param)", exact_lat, 1.0)
+        report("exact (text param, old)", await run_text_param(conn, queries, args.top_k))
+
+        knobs = [("ef_search", v) for v in args.ef_search] if args.kind == "hnsw" else \
+            [("probes", v) for v in args.probes]
+        for name, value in knobs:
+            params = search_params("ann", args.top_k, **{name: value})
+            lat, got = await run(conn, queries, args.top_k, params)
+            report(f"ann {name}={value}", lat, recall(truth, got, args.top_k))
+        # mặc định của /search (SEARCH_EF_SEARCH / SEARCH_PROBES): dùng cho --min-recall
+        lat, got = await run(conn, queries, args.top_k, search_params("ann", args.top_k))
+        default_recall = recall(truth, got, args.top_k)
+        report("ann (defaults)", lat, default_recall)
+    finally:
+        await conn.close()
+    return 1 if default_recall < args.min_recall else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of ANN search vs the exact scan")
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--kind", choices=["hnsw", "ivfflat"], default="hnsw",
+                        help="index đang được build (quyết định tham số nào được quét)")
+    parser.add_argument("--ef-search", type=int, nargs="*", default=EF_SEARCH)
+    parser.add_argument("--probes", type=int, nargs="*", default=PROBES)
+    parser.add_argument("--min-recall", type=float, default=0.0,
+                        help="exit 1 nếu recall với tham số mặc định dưới ngưỡng")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
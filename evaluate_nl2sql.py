@@ -1,7 +1,44 @@
+import argparse
+import datetime
+import hashlib
 import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
 import requests
 
-API_URL = "http://localhost:8002/ask"  # chỉnh theo docker-compose nếu cần
+# ===== Config =====
+API_URL = os.getenv("EVAL_API_URL", "http://localhost:8002")  # chỉnh theo docker-compose nếu cần
+TEST_FILE = "test_questions_2.json"
+PARALLEL = int(os.getenv("EVAL_PARALLEL", "4"))
+TIMEOUT = float(os.getenv("EVAL_TIMEOUT", "180"))
+GT_CACHE_FILE = os.getenv("EVAL_GT_CACHE", ".eval_cache/ground_truth.json")
+# số dòng tối đa so sánh cho mỗi câu (cả ground truth lẫn kết quả model qua /results/{token})
+MAX_ROWS = int(os.getenv("EVAL_MAX_ROWS", "10000"))
+STAGES = ("prepare_ms", "execute_ms", "summary_ms")
+
+DB_CONFIG = {
+    "dbname": os.getenv("DB_NAME", "postgres"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASS", "postgres"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432"),
+}
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # mỗi thread một Session (giữ kết nối keep-alive tới API)
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
 
 def normalize_rows(rows):
     norm = []
@@ -13,82 +50,278 @@ def normalize_rows(rows):
                 # làm tròn để so sánh gần đúng
                 val = round(val, 4)
                 new_row.append(val)
-            except:
+            except (TypeError, ValueError):
                 new_row.append(str(x).strip().lower())
         norm.append(tuple(new_row))
-    return sorted(norm)
+    return sorted(norm, key=repr)
+
+
+def percentile(values, p):
+    """Percentile nội suy tuyến tính (p trong [0, 100])."""
+    if not values:
+        return None
+    vals = sorted(values)
+    k = (len(vals) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(vals) - 1)
+    return round(vals[lo] + (vals[hi] - vals[lo]) * (k - lo), 1)
+
 
-def evaluate_test(test, idx):
+def latency_stats(values):
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), 1),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 1),
+    }
+
+
+# ===== Ground truth (chạy thẳng trên DB, cache giữa các lần chạy) =====
+def sql_key(sql: str) -> str:
+    return hashlib.sha256(" ".join(sql.split()).rstrip(";").encode("utf-8")).hexdigest()[:16]
+
+
+class GroundTruth:
+    """Kết quả của ground-truth SQL, lưu trên đĩa theo hash của câu SQL."""
+
+    def __init__(self, path=GT_CACHE_FILE, refresh=False):
+        self.path = path
+        self.data = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not refresh and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def rows(self, sql: str):
+        key = sql_key(sql)
+        with self._lock:
+            if key in self.data:
+                self.hits += 1
+                return [tuple(r) for r in self.data[key]["rows"]]
+        rows = self._query(sql)
+        with self._lock:
+            self.misses += 1
+            self.data[key] = {"sql": sql, "rows": [list(r) for r in rows]}
+        return rows
+
+    @staticmethod
+    def _query(sql: str):
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            conn.set_session(readonly=True)
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                raw = cur.fetchmany(MAX_ROWS)
+        finally:
+            conn.close()
+        # ngày/giờ theo ISO như JSON của API; số → float, còn lại → str (lưu cache được)
+        raw = [[v.isoformat() if isinstance(v, (datetime.date, datetime.time)) else v for v in r] for r in raw]
+        return normalize_rows(raw)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+# ===== Chạy một câu hỏi =====
+def fetch_all_rows(raw_result, timeout):
+    rows = list(raw_result.get("rows", []))
+    token = raw_result.get("next_token")
+    while token and len(rows) < MAX_ROWS:
+        resp = _session().get(f"{API_URL}/results/{token}", timeout=timeout)
+        resp.raise_for_status()
+        page = resp.json()
+        rows.extend(page.get("rows", []))
+        token = page.get("next_token")
+    return rows[:MAX_ROWS]
+
+
+def evaluate_test(test, idx, gt: GroundTruth, timeout):
     question = test.get("question")
     gt_sql = test.get("ground_truth_sql")
-    model_sql = None
-
-    print(f"\n=== Test {idx+1} ===")
-    print(f"Q: {question}")
+    item = {"index": idx, "question": question, "valid": False, "semantic_ok": False, "status": "ok",
+            "sql": None, "plan_source": None, "summary_source": None, "latency_ms": None,
+            "timings_ms": {}, "error": None}
 
+    start = time.perf_counter()
     try:
-        resp_model = requests.post(API_URL, json={"question": question})
-        model_out = resp_model.json()
-        model_sql = model_out.get("sql")
+        resp = _session().post(f"{API_URL}/ask", json={"question": question}, timeout=timeout)
+        item["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        resp.raise_for_status()
+        model_out = resp.json()
+    except requests.Timeout:
+        item.update(status="timeout", latency_ms=round((time.perf_counter() - start) * 1000, 1))
+        return item
     except Exception as e:
-        print("[ERROR] model call failed:", e)
-        return False, False
+        item.update(status="error", error=str(e))
+        return item
 
-    print("Model SQL:", model_sql)
+    model_sql = model_out.get("sql")
+    item.update(sql=model_sql, plan_source=model_out.get("plan_source"),
+                summary_source=model_out.get("summary_source"),
+                timings_ms={k: v for k, v in (model_out.get("timings_ms") or {}).items() if k in STAGES})
 
     # --- VALID CHECK ---
-    valid = bool(
-        model_out.get("sql_success") 
-        and isinstance(model_sql, str) 
+    item["valid"] = bool(
+        model_out.get("sql_success")
+        and isinstance(model_sql, str)
         and model_sql.strip().upper().startswith("SELECT")
     )
 
     # --- SEMANTIC CHECK ---
-    semantic_ok = False
-    if valid and gt_sql:
+    if item["valid"] and gt_sql:
         try:
-            resp_gt = requests.post(API_URL, json={"sql": gt_sql})
-            gt_out = resp_gt.json()
-
-            if not gt_out.get("raw_result") or not model_out.get("raw_result"):
-                print("[WARN] Missing raw_result, skip semantic check")
-                return valid, False
-
-            gt_rows = normalize_rows(gt_out["raw_result"].get("rows", []))
-            model_rows = normalize_rows(model_out["raw_result"].get("rows", []))
-
-            semantic_ok = (gt_rows == model_rows)
-            if semantic_ok:
-                print("[OK] Semantic match")
-            else:
-                print("[FAIL] Semantic mismatch")
-                print("GT rows:", gt_rows)
-                print("Model rows:", model_rows)
+            gt_rows = gt.rows(gt_sql)
+            model_rows = normalize_rows(fetch_all_rows(model_out.get("raw_result") or {}, timeout))
+            # so sánh sau khi chuẩn hóa qua JSON (giống dạng lưu trong cache)
+            model_rows = [tuple(r) for r in json.loads(json.dumps(model_rows, default=str))]
+            item["semantic_ok"] = gt_rows == model_rows
+            if not item["semantic_ok"]:
+                item["mismatch"] = {"gt_rows": len(gt_rows), "model_rows": len(model_rows),
+                                    "gt_sample": gt_rows[:3], "model_sample": model_rows[:3]}
         except Exception as e:
-            print("[ERROR] GT check failed:", e)
+            item.update(status="gt_error", error=str(e))
+    return item
+
+
+# ===== Báo cáo =====
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def build_report(items, args, gt: GroundTruth, wall_s):
+    total = len(items)
+    valid = sum(1 for it in items if it["valid"])
+    semantic = sum(1 for it in items if it["semantic_ok"])
+    answered = [it for it in items if it["latency_ms"] is not None and it["status"] != "timeout"]
+    by_status, by_plan_source = {}, {}
+    for it in items:
+        by_status[it["status"]] = by_status.get(it["status"], 0) + 1
+        if it["plan_source"]:
+            by_plan_source[it["plan_source"]] = by_plan_source.get(it["plan_source"], 0) + 1
+    latency = {"end_to_end": latency_stats([it["latency_ms"] for it in answered])}
+    for stage in STAGES:
+        latency[stage[:-3]] = latency_stats([it["timings_ms"][stage] for it in answered
+                                             if stage in it["timings_ms"]])
+    return {
+        "meta": {
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "api_url": API_URL,
+            "test_file": args.tests,
+            "parallel": args.parallel,
+            "git_commit": _git_commit(),
+            "wall_s": round(wall_s, 2),
+            "ground_truth_cache": {"hits": gt.hits, "misses": gt.misses},
+        },
+        "summary": {
+            "total": total,
+            "valid": valid,
+            "semantic": semantic,
+            "valid_rate": round(valid / total, 4) if total else 0.0,
+            "semantic_rate": round(semantic / total, 4) if total else 0.0,
+            "by_status": by_status,
+            "by_plan_source": by_plan_source,
+            "latency_ms": latency,
+        },
+        "items": items,
+    }
+
 
-    return valid, semantic_ok
+def compare(report, baseline, max_accuracy_drop, max_p95_increase):
+    """In khác biệt so với lần chạy trước; trả về danh sách regression."""
+    regressions = []
+    cur, old = report["summary"], baseline["summary"]
+    print("\n==== So sánh với baseline ====")
+    for key in ("valid_rate", "semantic_rate"):
+        delta = cur[key] - old.get(key, 0.0)
+        print(f"{key}: {old.get(key, 0.0):.3f} → {cur[key]:.3f} ({delta:+.3f})")
+        if -delta > max_accuracy_drop:
+            regressions.append(f"{key} dropped by {-delta:.3f}")
+    for stage, stats in cur["latency_ms"].items():
+        prev = old.get("latency_ms", {}).get(stage, {})
+        if not stats.get("p95") or not prev.get("p95"):
+            continue
+        ratio = stats["p95"] / prev["p95"] - 1
+        print(f"p95 {stage}: {prev['p95']} → {stats['p95']} ms ({ratio:+.1%})")
+        if ratio > max_p95_increase:
+            regressions.append(f"p95 {stage} up {ratio:.1%}")
+
+    old_items = {it["question"]: it for it in baseline.get("items", [])}
+    for it in report["items"]:
+        prev = old_items.get(it["question"])
+        if prev is None:
+            continue
+        if prev["semantic_ok"] and not it["semantic_ok"]:
+            print(f"[REGRESSION] #{it['index']} {it['question']}")
+        elif not prev["semantic_ok"] and it["semantic_ok"]:
+            print(f"[FIXED] #{it['index']} {it['question']}")
+    return regressions
 
 
 def main():
-    with open("test_questions_2.json", "r", encoding="utf-8") as f:
+    parser = argparse.ArgumentParser(description="Đánh giá NL2SQL: độ chính xác + độ trễ, chạy song song.")
+    parser.add_argument("--tests", default=TEST_FILE)
+    parser.add_argument("--parallel", type=int, default=PARALLEL)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="timeout mỗi request (s)")
+    parser.add_argument("--report", default=None, help="file JSON báo cáo (mặc định reports/eval_<time>.json)")
+    parser.add_argument("--baseline", default=None, help="báo cáo lần trước để so sánh")
+    parser.add_argument("--refresh-gt", action="store_true", help="bỏ cache ground truth, chạy lại trên DB")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0)
+    parser.add_argument("--max-p95-increase", type=float, default=0.2, help="0.2 = cho phép chậm hơn 20%%")
+    args = parser.parse_args()
+
+    with open(args.tests, "r", encoding="utf-8") as f:
         tests = json.load(f)
 
-    total = len(tests)
-    valid_count = 0
-    semantic_count = 0
+    gt = GroundTruth(refresh=args.refresh_gt)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+        items = list(pool.map(lambda p: evaluate_test(p[1], p[0], gt, args.timeout), enumerate(tests)))
+    wall_s = time.perf_counter() - started
+    gt.save()
 
-    for idx, test in enumerate(tests):
-        valid, semantic_ok = evaluate_test(test, idx)
-        if valid:
-            valid_count += 1
-        if semantic_ok:
-            semantic_count += 1
+    for it in items:
+        mark = "OK" if it["semantic_ok"] else ("VALID" if it["valid"] else it["status"].upper())
+        print(f"[{mark}] #{it['index']} {it['latency_ms']} ms  {it['question']}")
+        if it["error"]:
+            print(f"    error: {it['error']}")
 
+    report = build_report(items, args, gt, wall_s)
+    summary = report["summary"]
+    total = summary["total"]
     print("\n==== Evaluation Summary ====")
     print(f"Total questions: {total}")
-    print(f"Valid SQL: {valid_count}/{total} ({valid_count/total*100:.1f}%)")
-    print(f"Semantic correct: {semantic_count}/{total} ({semantic_count/total*100:.1f}%)")
+    print(f"Valid SQL: {summary['valid']}/{total} ({summary['valid_rate'] * 100:.1f}%)")
+    print(f"Semantic correct: {summary['semantic']}/{total} ({summary['semantic_rate'] * 100:.1f}%)")
+    for stage, stats in summary["latency_ms"].items():
+        if stats["n"]:
+            print(f"{stage:<11} p50={stats['p50']} p95={stats['p95']} p99={stats['p99']} ms (n={stats['n']})")
+    print(f"Wall time: {wall_s:.1f}s with parallel={args.parallel}")
+
+    path = args.report or os.path.join("reports", f"eval_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True, default=str)
+    print(f"Report: {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_accuracy_drop, args.max_p95_increase)
+        if regressions:
+            print("\nRegressions:", "; ".join(regressions))
+            sys.exit(1)
 
 
 if __name__ == "__main__":